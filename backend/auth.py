@@ -3,14 +3,19 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from ttl_cache import TTLCache
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
 
 security = HTTPBearer()
 
+# Verified token -> claims, each entry expiring with its token's exp
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -21,23 +26,54 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[str]:
+def create_user_access_token(user, expires_delta: Optional[timedelta] = None):
+    # Name and role travel in the signed claims so requests need no user lookup
+    return create_access_token(
+        data={"sub": user.id, "name": user.name, "role": user.role},
+        expires_delta=expires_delta
+    )
+
+def decode_token(token: str) -> Optional[dict]:
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        return user_id
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    if claims.get("sub") is None or "exp" not in claims:
+        return None
+
+    token_cache.set(token, claims, expires_at=claims["exp"])
+    return claims
 
-async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
-    token = credentials.credentials
-    user_id = verify_token(token)
-    if user_id is None:
+def verify_token(token: str) -> Optional[str]:
+    claims = decode_token(token)
+    if claims is None:
+        return None
+    return claims["sub"]
+
+async def get_current_user_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    claims = decode_token(credentials.credentials)
+    if claims is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user_id
\ No newline at end of file
+    return claims
+
+async def get_current_user_id(claims: dict = Depends(get_current_user_claims)) -> str:
+    return claims["sub"]
+
+def require_role(*roles: str):
+    """Dependency factory checking the role claim without a database read"""
+    async def check_role(claims: dict = Depends(get_current_user_claims)) -> dict:
+        if claims.get("role", "customer") not in roles:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        return claims
+    return check_role
@@ -0,0 +1,91 @@
+import time
+from datetime import datetime
+from typing import List
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+
+# Bookkeeping fields that never count as a change
+IGNORED_FIELDS = ("_id", "created_at", "updated_at")
+
+
+class BatchResult:
+    def __init__(self, size: int):
+        self.size = size
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.seconds = 0.0
+        # (id, [changed field names]) for documents that differ from the stored copy
+        self.diffs: List[tuple] = []
+
+
+def changed_fields(new_doc: dict, existing: dict) -> List[str]:
+    return [
+        field for field, value in new_doc.items()
+        if field not in IGNORED_FIELDS and existing.get(field) != value
+    ]
+
+
+async def upsert_batch(collection: AsyncIOMotorCollection,
+                       docs: List[dict],
+                       overwrite: bool = True,
+                       dry_run: bool = False) -> BatchResult:
+    """Write a batch of documents keyed on ``id`` with one bulk_write.
+
+    With ``overwrite`` the stored documents are diffed first (one ``$in``
+    read) so unchanged documents are not rewritten and keep their
+    ``updated_at``. Without it, existing documents are left untouched and
+    missing ones are inserted, which needs no read at all (a dry run reads
+    the ids to count what would be inserted).
+    """
+    result = BatchResult(len(docs))
+    started = time.perf_counter()
+
+    if not overwrite:
+        if dry_run:
+            # Count what the upserts would insert; duplicates in the batch insert once
+            ids = {doc["id"] for doc in docs}
+            stored = {doc["id"] async for doc in collection.find({"id": {"$in": list(ids)}}, {"_id": 0, "id": 1})}
+            result.inserted = len(ids - stored)
+        elif docs:
+            operations = [UpdateOne({"id": doc["id"]}, {"$setOnInsert": doc}, upsert=True) for doc in docs]
+            write = await collection.bulk_write(operations, ordered=False)
+            result.inserted = write.upserted_count
+        result.unchanged = len(docs) - result.inserted
+        result.seconds = time.perf_counter() - started
+        return result
+
+    ids = [doc["id"] for doc in docs]
+    existing = {
+        doc["id"]: doc
+        async for doc in collection.find({"id": {"$in": ids}}, {"_id": 0})
+    }
+
+    now = datetime.utcnow()
+    operations = []
+    for doc in docs:
+        stored = existing.get(doc["id"])
+        if stored is None:
+            result.inserted += 1
+        else:
+            fields = changed_fields(doc, stored)
+            if not fields:
+                result.unchanged += 1
+                continue
+            result.changed += 1
+            result.diffs.append((doc["id"], fields))
+
+        values = {k: v for k, v in doc.items() if k not in IGNORED_FIELDS}
+        values["updated_at"] = now
+        operations.append(UpdateOne(
+            {"id": doc["id"]},
+            {"$set": values, "$setOnInsert": {"created_at": doc.get("created_at", now)}},
+            upsert=True
+        ))
+
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "50000"))
+CATALOG_CACHE_POLL_SECONDS = float(os.getenv("CATALOG_CACHE_POLL_SECONDS", "5"))
+
+# Error code returned by standalone servers, which have no oplog to watch
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+ChangeListener = Callable[[Optional[str], Optional[dict]], Any]
+
+
+class CatalogEntry:
+    __slots__ = ("doc", "response", "json", "loaded_at")
+
+    def __init__(self, doc: dict, response: Any, json: Optional[bytes] = None):
+        self.doc = doc
+        self.response = response
+        self.json = json
+        self.loaded_at = time.monotonic()
+
+
+class CatalogCache:
+    """In-process product catalog shared by the product and cart services.
+
+    Entries are keyed by product id and hold the raw document together with
+    its prebuilt response object and that response serialized to JSON. When
+    the whole catalog fits within ``max_entries`` it is loaded in one query
+    so listings can be served from memory; otherwise the cache degrades to a
+    bounded LRU of single products.
+    """
+
+    def __init__(self,
+                 to_response: Callable[[dict], Any],
+                 to_json: Optional[Callable[[Any], bytes]] = None,
+                 ttl_seconds: float = CATALOG_CACHE_TTL_SECONDS,
+                 max_entries: int = CATALOG_CACHE_MAX_ENTRIES,
+                 poll_seconds: float = CATALOG_CACHE_POLL_SECONDS):
+        self._to_response = to_response
+        self._to_json = to_json
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.poll_seconds = poll_seconds
+        self._entries: "OrderedDict[str, CatalogEntry]" = OrderedDict()
+        self._complete_at: Optional[float] = None
+        self._load_lock = asyncio.Lock()
+        self._listeners: List[ChangeListener] = []
+        self._derived: Dict[str, tuple] = {}
+        self._high_water = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl_seconds
+
+    def _store(self, doc: dict) -> CatalogEntry:
+        doc.pop("_id", None)
+        response = self._to_response(doc)
+        entry = CatalogEntry(doc, response, self._to_json(response) if self._to_json else None)
+        self._entries[doc["id"]] = entry
+        self._entries.move_to_end(doc["id"])
+        updated_at = doc.get("updated_at")
+        if updated_at is not None and (self._high_water is None or updated_at > self._high_water):
+            self._high_water = updated_at
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._complete_at = None
+        # Derived views were built from the entry this one replaces
+        self.version += 1
+        return entry
+
+    def _lookup(self, product_id: str) -> Optional[CatalogEntry]:
+        entry = self._entries.get(product_id)
+        if entry is None or not self._is_fresh(entry.loaded_at):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(product_id)
+        self.hits += 1
+        return entry
+
+    def peek(self, product_id: str) -> Optional[CatalogEntry]:
+        return self._entries.get(product_id)
+
+    async def get_entry(self, collection: AsyncIOMotorCollection, product_id: str) -> Optional[CatalogEntry]:
+        entry = self._lookup(product_id)
+        if entry is not None:
+            return entry
+
+        doc = await collection.find_one({"id": product_id}, {"_id": 0})
+        if not doc:
+            if self._entries.pop(product_id, None) is not None:
+                self.version += 1
+            return None
+        return self._store(doc)
+
+    async def get(self, collection: AsyncIOMotorCollection, product_id: str) -> Optional[dict]:
+        entry = await self.get_entry(collection, product_id)
+        return entry.doc if entry else None
+
+    async def get_response(self, collection: AsyncIOMotorCollection, product_id: str) -> Optional[Any]:
+        entry = await self.get_entry(collection, product_id)
+        return entry.response if entry else None
+
+    async def get_many(self, collection: AsyncIOMotorCollection, product_ids: Iterable[str]) -> Dict[str, dict]:
+        found = {}
+        missing = []
+        for product_id in product_ids:
+            entry = self._lookup(product_id)
+            if entry is not None:
+                found[product_id] = entry.doc
+            else:
+                missing.append(product_id)
+
+        if missing:
+            # Fetch every miss in one round trip
+            async for doc in collection.find({"id": {"$in": missing}}, {"_id": 0}):
+                found[doc["id"]] = self._store(doc).doc
+        return found
+
+    async def all_entries(self, collection: AsyncIOMotorCollection) -> Optional[List[CatalogEntry]]:
+        """Return every product, loading the catalog if needed.
+
+        Returns None when the catalog is too large to hold in memory, in which
+        case callers should query Mongo directly.
+        """
+        if self._complete_at is not None and self._is_fresh(self._complete_at):
+            return list(self._entries.values())
+
+        async with self._load_lock:
+            if self._complete_at is not None and self._is_fresh(self._complete_at):
+                return list(self._entries.values())
+
+            if await collection.estimated_document_count() > self.max_entries:
+                return None
+
+            docs = await collection.find({}, {"_id": 0}).to_list(length=None)
+            self._entries.clear()
+            for doc in docs:
+                self._store(doc)
+            self._complete_at = time.monotonic()
+            self.version += 1
+            return list(self._entries.values())
+
+    def derived(self, name: str, build: Callable[[List[CatalogEntry]], Any]) -> Any:
+        """Memoize a structure built from the cached catalog until the catalog changes"""
+        cached = self._derived.get(name)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        value = build(list(self._entries.values()))
+        self._derived[name] = (self.version, value)
+        return value
+
+    def fingerprint(self) -> Optional[Tuple[str, Optional[datetime]]]:
+        """(version tag, last modified) of the complete cached catalog.
+
+        The tag is derived from the newest ``updated_at`` and the product
+        count, so it is the same in every process looking at the same data.
+        Returns None unless the whole catalog is loaded and fresh.
+        """
+        if self._complete_at is None or not self._is_fresh(self._complete_at):
+            return None
+
+        def build(entries: List[CatalogEntry]):
+            stamps = [e.doc["updated_at"] for e in entries if e.doc.get("updated_at")]
+            last_modified = max(stamps) if stamps else None
+            stamp = last_modified.isoformat() if last_modified else "-"
+            return f"{stamp}:{len(entries)}", last_modified
+
+        return self.derived("fingerprint", build)
+
+    def invalidate(self, product_id: Optional[str] = None):
+        if product_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(product_id, None)
+        self._complete_at = None
+        self.version += 1
+
+    def add_listener(self, callback: ChangeListener):
+        """Register a callback invoked with (product_id, doc) for each catalog change.
+
+        ``product_id`` is None when the change could not be attributed to a
+        single product (e.g. a delete seen through a change stream).
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: ChangeListener):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    async def _apply_change(self, product_id: Optional[str], doc: Optional[dict]):
+        if doc is not None and self._complete_at is not None:
+            # Keep a complete catalog complete instead of forcing a reload
+            self._store(doc)
+        else:
+            self.invalidate(product_id)
+
+        for callback in self._listeners:
+            try:
+                result = callback(product_id, doc)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("Catalog change listener failed")
+
+    async def watch(self, collection: AsyncIOMotorCollection):
+        """Keep the cache coherent with the products collection.
+
+        Uses a change stream where the deployment supports one and falls back
+        to polling ``updated_at`` on standalone servers. Runs until cancelled.
+        """
+        while True:
+            try:
+                async with collection.watch(full_document="updateLookup") as stream:
+                    logger.info("Catalog cache following products change stream")
+                    async for change in stream:
+                        doc = change.get("fullDocument")
+                        if change["operationType"] in ("insert", "update", "replace") and doc:
+                            await self._apply_change(doc["id"], doc)
+                        else:
+                            await self._apply_change(None, None)
+            except PyMongoError as e:
+                if isinstance(e, OperationFailure) and e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Change streams unavailable, polling products every %ss", self.poll_seconds)
+                    await self._poll(collection)
+                    continue
+                # Includes lost history and rejected resume tokens: changes may
+                # have been missed, so drop everything and reopen the stream
+                logger.exception("Catalog change stream failed, restarting")
+                self.invalidate()
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _poll(self, collection: AsyncIOMotorCollection):
+        # Deletes leave no updated_at behind; they show up as fewer products
+        # than the cache holds (or than the previous poll counted, when only
+        # part of the catalog is cached; a delete offset by an insert there
+        # lingers until the entry expires)
+        last_count = None
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                # Until a product with updated_at has been seen there is no
+                # high-water mark, so every product counts as changed
+                query = {} if self._high_water is None else {"updated_at": {"$gt": self._high_water}}
+                async for doc in collection.find(query, {"_id": 0}):
+                    await self._apply_change(doc["id"], doc)
+                count = await collection.estimated_document_count()
+                known = len(self._entries) if self._complete_at is not None else last_count
+                if known is not None and count < known:
+                    await self._apply_change(None, None)
+                last_count = count
+            except PyMongoError:
+                logger.exception("Catalog cache poll failed")
@@ -0,0 +1,228 @@
+"""Streaming catalog import.
+
+Reads products, categories or testimonials from JSON (an array), NDJSON or
+CSV in fixed-size batches and upserts each batch with a single bulk_write
+keyed on ``id``. Memory use is bounded by the batch size, not the file.
+
+    python catalog_import.py products feed.ndjson
+    python catalog_import.py products feed.csv --batch-size 1000 --dry-run
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from bulk_upsert import BatchResult, upsert_batch
+from invalidation_bus import invalidation_bus
+from models.product import ProductService, category_from_record, product_from_record
+from models.testimonial import testimonial_from_record
+
+DEFAULT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+# A JSON array element that still does not parse after this many characters
+# is malformed (or absurdly large); fail instead of buffering the rest of the file
+MAX_RECORD_SIZE = 16 * READ_CHUNK_SIZE
+
+# kind -> (collection name, record -> model, invalidation topic)
+IMPORTERS: Dict[str, tuple] = {
+    "products": ("products", product_from_record, "catalog"),
+    "categories": ("categories", category_from_record, "categories"),
+    "testimonials": ("testimonials", testimonial_from_record, "testimonials"),
+}
+
+# CSV columns holding lists, stored as "a|b|c"
+CSV_LIST_COLUMNS = ("features",)
+CSV_LIST_SEPARATOR = "|"
+
+
+def iter_json_array(stream: TextIO) -> Iterator[dict]:
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    exhausted = False
+
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("JSON import files must contain a top-level array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if exhausted:
+                    raise
+                if len(buffer) - position > MAX_RECORD_SIZE:
+                    raise ValueError(f"Invalid JSON array element (or one over {MAX_RECORD_SIZE} characters): {e}")
+            else:
+                position = end
+                yield record
+                continue
+
+        if exhausted:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = stream.read(READ_CHUNK_SIZE)
+        exhausted = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_ndjson(stream: TextIO) -> Iterator[dict]:
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}")
+
+
+def iter_csv(stream: TextIO) -> Iterator[dict]:
+    for row in csv.DictReader(stream):
+        # Empty cells mean "use the model default"
+        record = {key: value for key, value in row.items() if value not in ("", None)}
+        for column in CSV_LIST_COLUMNS:
+            if column in record:
+                record[column] = [part.strip() for part in record[column].split(CSV_LIST_SEPARATOR) if part.strip()]
+        yield record
+
+
+READERS: Dict[str, Callable[[TextIO], Iterator[dict]]] = {
+    "json": iter_json_array,
+    "ndjson": iter_ndjson,
+    "jsonl": iter_ndjson,
+    "csv": iter_csv,
+}
+
+
+def batched(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ImportReport:
+    def __init__(self):
+        self.batches = 0
+        self.records = 0
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.seconds = 0.0
+
+    def add(self, result: BatchResult):
+        self.batches += 1
+        self.records += result.size
+        self.inserted += result.inserted
+        self.changed += result.changed
+        self.unchanged += result.unchanged
+
+
+async def import_records(db: AsyncIOMotorDatabase,
+                         kind: str,
+                         records: Iterable[dict],
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         dry_run: bool = False,
+                         progress: Optional[Callable[[int, BatchResult, ImportReport], None]] = None) -> ImportReport:
+    collection_name, to_model, topic = IMPORTERS[kind]
+    collection = db[collection_name]
+    report = ImportReport()
+    started = time.perf_counter()
+
+    for batch in batched(records, batch_size):
+        docs = [to_model(record).dict() for record in batch]
+        result = await upsert_batch(collection, docs, overwrite=True, dry_run=dry_run)
+        report.add(result)
+        if progress:
+            progress(report.batches, result, report)
+
+    if not dry_run and (report.inserted or report.changed):
+        if kind == "products":
+            await ProductService(db).refresh_category_counts()
+        # Running servers cache these; imported rows may predate what they have seen
+        await invalidation_bus.publish(topic)
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def print_progress(batch_number: int, result: BatchResult, report: ImportReport, show_diffs: bool = False):
+    print(
+        f"batch {batch_number}: {result.size} records "
+        f"({result.inserted} new, {result.changed} changed, {result.unchanged} unchanged) "
+        f"in {result.seconds * 1000:.1f}ms, {report.records} total"
+    )
+    if show_diffs:
+        for record_id, fields in result.diffs:
+            print(f"  ~ {record_id}: {', '.join(fields)}")
+
+
+def detect_format(path: Path) -> str:
+    suffix = path.suffix.lower().lstrip(".")
+    if suffix not in READERS:
+        raise ValueError(f"Cannot infer format from '{path.name}'; pass --format")
+    return suffix
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(IMPORTERS))
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=sorted(READERS), help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if not args.dry_run:
+            await invalidation_bus.open(db)
+        reader = READERS[args.format or detect_format(args.path)]
+        with open(args.path, newline="", encoding="utf-8") as stream:
+            report = await import_records(
+                db,
+                args.kind,
+                reader(stream),
+                batch_size=args.batch_size,
+                dry_run=args.dry_run,
+                progress=lambda n, result, report: print_progress(n, result, report, show_diffs=args.dry_run)
+            )
+    finally:
+        client.close()
+
+    prefix = "dry run: " if args.dry_run else ""
+    print(
+        f"{prefix}{report.records} {args.kind} in {report.batches} batches: "
+        f"{report.inserted} new, {report.changed} changed, {report.unchanged} unchanged "
+        f"in {report.seconds:.2f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
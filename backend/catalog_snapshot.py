@@ -0,0 +1,97 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+from typing import Optional
+
+import fast_json
+from models.product import ProductService
+from models.testimonial import TestimonialService
+
+# Testimonials are not watched, so the bundle is also rebuilt after this long
+CATALOG_SNAPSHOT_TTL_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_TTL_SECONDS", "300"))
+CATALOG_SNAPSHOT_GZIP_LEVEL = int(os.getenv("CATALOG_SNAPSHOT_GZIP_LEVEL", "9"))
+
+
+class SnapshotBundle:
+    __slots__ = ("version", "etag", "gzip_etag", "body", "gzipped", "built_at")
+
+    def __init__(self, body: bytes, gzip_level: int):
+        digest = hashlib.sha256(body).hexdigest()
+        self.version = digest[:16]
+        # Strong validators name exact bytes, so each encoding gets its own
+        self.etag = f'"{self.version}"'
+        self.gzip_etag = f'"{self.version}-gzip"'
+        self.body = body
+        # mtime=0 keeps the compressed bytes identical across processes
+        self.gzipped = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        self.built_at = time.monotonic()
+
+
+class CatalogSnapshot:
+    """Whole storefront catalog as one pre-serialized, pre-compressed bundle.
+
+    Rebuilt when the product catalog or category counts change, or after
+    ``ttl_seconds``; requests in between only hand out the stored bytes.
+    """
+
+    def __init__(self,
+                 products: ProductService,
+                 testimonials: TestimonialService,
+                 ttl_seconds: float = CATALOG_SNAPSHOT_TTL_SECONDS,
+                 gzip_level: int = CATALOG_SNAPSHOT_GZIP_LEVEL):
+        self.products = products
+        self.testimonials = testimonials
+        self.ttl_seconds = ttl_seconds
+        self.gzip_level = gzip_level
+        self._bundle: Optional[SnapshotBundle] = None
+        self._source_key: Optional[tuple] = None
+        self._lock = asyncio.Lock()
+        self.builds = 0
+
+    def invalidate(self):
+        """Rebuild on the next request even if the catalog looks unchanged"""
+        self._source_key = None
+
+    async def _source(self) -> tuple:
+        catalog_key = await self.products.catalog_change_key()
+        _, categories_tag, _ = await self.products.get_categories_with_validators()
+        return catalog_key, categories_tag
+
+    def _is_current(self, source_key: tuple) -> bool:
+        return (
+            self._bundle is not None
+            and self._source_key == source_key
+            and time.monotonic() - self._bundle.built_at < self.ttl_seconds
+        )
+
+    async def get(self) -> SnapshotBundle:
+        source_key = await self._source()
+        if self._is_current(source_key):
+            return self._bundle
+
+        async with self._lock:
+            # Another request may have rebuilt it while we waited
+            source_key = await self._source()
+            if self._is_current(source_key):
+                return self._bundle
+
+            products = await self.products.get_all_product_json()
+            categories, _, _ = await self.products.get_categories_with_validators()
+            testimonials = await self.testimonials.get_active_testimonials()
+
+            body = (
+                b'{"products":[' + b",".join(products) + b"],"
+                + b'"categories":' + fast_json.dumps([c.dict() for c in categories]) + b","
+                + b'"testimonials":' + fast_json.dumps([t.dict() for t in testimonials]) + b"}"
+            )
+            bundle = SnapshotBundle(body, self.gzip_level)
+            # Keep the old object when nothing changed so its bytes stay shared
+            if self._bundle is not None and self._bundle.version == bundle.version:
+                self._bundle.built_at = bundle.built_at
+            else:
+                self._bundle = bundle
+            self._source_key = source_key
+            self.builds += 1
+            return self._bundle
@@ -0,0 +1,61 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from starlette.responses import Response
+
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=60, stale-while-revalidate=300")
+
+
+def make_etag(*parts: str) -> str:
+    digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:24]
+    # Weak: the representation may be re-encoded (e.g. gzip) downstream
+    return f'W/"{digest}"'
+
+
+def query_key(request: Request) -> str:
+    """Query string normalized so parameter order does not change the ETag"""
+    return "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo hands back naive datetimes that are already UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        bare = etag[2:] if etag.startswith("W/") else etag
+        return "*" in candidates or any(
+            (tag[2:] if tag.startswith("W/") else tag) == bare for tag in candidates
+        )
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return _as_utc(last_modified) <= since
+    return False
+
+
+def caching_headers(etag: str, last_modified: Optional[datetime] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Set
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from catalog_snapshot import CatalogSnapshot
+from idempotency import IdempotencyStore
+from indexes import ensure_indexes
+from invalidation_bus import invalidation_bus
+from metrics import command_listener, metrics
+from slow_queries import slow_query_log
+from models.cart import CartService
+from models.order import OrderService
+from models.product import ProductService, catalog_cache
+from models.testimonial import TestimonialService
+from models.user import UserService
+from password_hasher import password_hasher
+from payment_queue import PAYMENT_WORKERS, PaymentQueue
+from rate_limit import RATE_LIMIT_STORE, MongoBucketStore, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+
+class ServiceContainer:
+    """Application-lifetime owner of the Mongo client and the service singletons.
+
+    Created by the app lifespan; routes reach it through request.app.state.
+    """
+
+    def __init__(self,
+                 mongo_url: str,
+                 db_name: str,
+                 client: Optional[AsyncIOMotorClient] = None,
+                 maintenance: bool = True,
+                 **client_options):
+        options = {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            # Per-request command accounting for /api/metrics and the slow-query log
+            "event_listeners": [command_listener, slow_query_log],
+        }
+        options.update(client_options)
+        self.min_pool_size = options["minPoolSize"]
+        # An existing client (e.g. an in-memory stand-in for benchmarks) can be passed in
+        self.client = client if client is not None else AsyncIOMotorClient(mongo_url, **options)
+        self.db: AsyncIOMotorDatabase = self.client[db_name]
+
+        self.products = ProductService(self.db)
+        self.carts = CartService(self.db)
+        # PAYMENT_WORKERS=0 settles payments inline in the order request
+        self.payments = PaymentQueue(self.db) if PAYMENT_WORKERS > 0 else None
+        self.orders = OrderService(self.db, payments=self.payments)
+        self.users = UserService(self.db)
+        self.testimonials = TestimonialService(self.db)
+        self.catalog_snapshot = CatalogSnapshot(self.products, self.testimonials)
+        self.idempotency = IdempotencyStore(self.db)
+
+        # With several worker processes only one runs the database upkeep
+        # (category counts, cart repricing, orphaned payments); the others
+        # hear about its writes on the invalidation bus
+        self.maintenance = maintenance
+        self._subscriptions = [
+            ("catalog", self._on_catalog_invalidated),
+            ("categories", self._on_categories_invalidated),
+            ("testimonials", self._on_testimonials_invalidated),
+        ]
+        self._tasks: List[asyncio.Task] = []
+        # Category counts are materialized; product changes mark them for a refresh
+        self._category_counts_dirty = asyncio.Event()
+        # Carts snapshot product fields; changed products are reconciled in batches
+        self._stale_cart_products: Set[Optional[str]] = set()
+        self._carts_stale = asyncio.Event()
+
+    def _mark_category_counts_dirty(self, product_id, doc):
+        self._category_counts_dirty.set()
+
+    def _mark_carts_stale(self, product_id, doc):
+        self._stale_cart_products.add(product_id)
+        self._carts_stale.set()
+
+    def _on_catalog_invalidated(self, product_id):
+        catalog_cache.invalidate(product_id)
+        if self.maintenance:
+            # e.g. an import from another process: counts and cart prices may be off
+            self._mark_category_counts_dirty(product_id, None)
+            self._mark_carts_stale(product_id, None)
+
+    def _on_categories_invalidated(self, category_id):
+        self.products.invalidate_categories()
+
+    def _on_testimonials_invalidated(self, testimonial_id):
+        self.catalog_snapshot.invalidate()
+
+    async def start(self):
+        metrics.start_loop_monitor()
+        slow_query_log.attach(self.client, asyncio.get_running_loop())
+        await ensure_indexes(self.db)
+        if RATE_LIMIT_STORE == "mongo":
+            # Share rate-limit buckets with the other workers
+            rate_limiter.use_store(MongoBucketStore(self.db))
+        for topic, callback in self._subscriptions:
+            invalidation_bus.subscribe(topic, callback)
+        # Follow the bus before warming up, so nothing published while the
+        # caches load is missed
+        await invalidation_bus.start(self.db)
+        await self.warm_up()
+
+        self._tasks.append(asyncio.create_task(catalog_cache.watch(self.db.products)))
+        if self.maintenance:
+            catalog_cache.add_listener(self._mark_category_counts_dirty)
+            catalog_cache.add_listener(self._mark_carts_stale)
+            self._category_counts_dirty.set()
+            self._tasks.append(asyncio.create_task(self._maintain_category_counts()))
+            self._tasks.append(asyncio.create_task(self._reconcile_carts()))
+        if self.payments is not None:
+            # Worker 0 also re-enqueues orphaned orders and dead-letters stuck jobs
+            self.payments.start(recover=self.maintenance)
+
+    async def warm_up(self):
+        # Concurrent pings check out minPoolSize sockets, so the first
+        # requests do not pay for TCP and auth handshakes
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(max(1, self.min_pool_size))))
+        await catalog_cache.all_entries(self.db.products)
+        # Loads categories and testimonials and prebuilds the compressed bundle
+        await self.catalog_snapshot.get()
+
+    async def _maintain_category_counts(self):
+        while True:
+            await self._category_counts_dirty.wait()
+            self._category_counts_dirty.clear()
+            try:
+                await self.products.refresh_category_counts()
+            except Exception:
+                logger.exception("Failed to refresh category counts")
+
+    async def _reconcile_carts(self):
+        while True:
+            await self._carts_stale.wait()
+            self._carts_stale.clear()
+            # Changes arriving during a pass are picked up by the next one
+            product_ids, self._stale_cart_products = self._stale_cart_products, set()
+            try:
+                modified = await self.carts.reconcile_products(product_ids)
+                if modified:
+                    logger.info("Repriced %d carts after %d product changes", modified, len(product_ids))
+            except Exception:
+                logger.exception("Failed to reconcile carts")
+
+    async def close(self):
+        catalog_cache.remove_listener(self._mark_category_counts_dirty)
+        catalog_cache.remove_listener(self._mark_carts_stale)
+        for topic, callback in self._subscriptions:
+            invalidation_bus.unsubscribe(topic, callback)
+        await invalidation_bus.stop()
+        rate_limiter.reset_store()
+        if self.payments is not None:
+            await self.payments.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await metrics.stop_loop_monitor()
+        slow_query_log.detach()
+        password_hasher.shutdown()
+        self.client.close()
+
+
+async def get_services(request: Request) -> ServiceContainer:
+    return request.app.state.services
+
+
+async def get_idempotency_store(request: Request) -> IdempotencyStore:
+    return request.app.state.services.idempotency
+
+
+async def get_db(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.state.services.db
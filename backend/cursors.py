@@ -0,0 +1,19 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(data: dict) -> str:
+    """Opaque, URL-safe pagination cursor"""
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    return data
@@ -0,0 +1,18 @@
+import json
+from typing import Any
+
+from starlette.responses import Response
+
+
+def dumps(value: Any) -> bytes:
+    """Compact UTF-8 JSON matching what FastAPI's JSONResponse would render"""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONBytesResponse(Response):
+    """Response for bodies that are already serialized JSON.
+
+    Returning it from a route bypasses response_model validation and
+    re-encoding, so only use it for trusted, pre-shaped data.
+    """
+    media_type = "application/json"
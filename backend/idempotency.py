@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from fast_json import JSONBytesResponse
+from ttl_cache import TTLCache
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# How long a first execution may hold a key before another process may take it over
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+# How long a duplicate waits for the first execution before giving up with a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_POLL_SECONDS = 0.05
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different payload"""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still executing"""
+
+
+class IdempotentResult:
+    __slots__ = ("body", "replayed")
+
+    def __init__(self, body: bytes, replayed: bool):
+        self.body = body
+        self.replayed = replayed
+
+
+def request_fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Idempotency-Key bookkeeping for non-idempotent endpoints.
+
+    Completed responses are kept in a TTL-indexed Mongo collection, fronted
+    by an in-process LRU. Duplicates arriving while the first request runs
+    wait for its outcome: in-process through a shared future, across
+    processes by polling the claim document.
+    """
+
+    def __init__(self,
+                 db: AsyncIOMotorDatabase,
+                 ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+                 cache_size: int = IDEMPOTENCY_CACHE_SIZE,
+                 lock_seconds: float = IDEMPOTENCY_LOCK_SECONDS,
+                 wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.collection = db.idempotency_keys
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        # record id -> (fingerprint, body)
+        self._completed = TTLCache(maxsize=cache_size, ttl_seconds=ttl_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def run(self,
+                  scope: str,
+                  user_id: str,
+                  key: str,
+                  fingerprint: str,
+                  execute: Callable[[], Awaitable[bytes]]) -> IdempotentResult:
+        record_id = f"{scope}:{user_id}:{key}"
+
+        cached = self._completed.get(record_id)
+        if cached is not None:
+            return IdempotentResult(self._check(cached[0], fingerprint, cached[1]), replayed=True)
+
+        inflight = self._inflight.get(record_id)
+        if inflight is not None:
+            stored_fingerprint, body = await asyncio.shield(inflight)
+            return IdempotentResult(self._check(stored_fingerprint, fingerprint, body), replayed=True)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[record_id] = future
+        try:
+            result = await self._claim_and_execute(record_id, fingerprint, execute)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result((fingerprint, result.body))
+            return result
+        finally:
+            del self._inflight[record_id]
+
+    def _check(self, stored_fingerprint: str, fingerprint: str, body: bytes) -> bytes:
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+        return body
+
+    async def _claim_and_execute(self,
+                                 record_id: str,
+                                 fingerprint: str,
+                                 execute: Callable[[], Awaitable[bytes]]) -> IdempotentResult:
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = datetime.utcnow()
+            try:
+                await self.collection.insert_one({
+                    "_id": record_id,
+                    "fingerprint": fingerprint,
+                    "status": "pending",
+                    "locked_until": now + timedelta(seconds=self.lock_seconds),
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                })
+                break
+            except DuplicateKeyError:
+                pass
+
+            doc = await self.collection.find_one({"_id": record_id})
+            if doc is None:
+                # Released by a failed execution; try to claim it again
+                continue
+            if doc["status"] == "completed":
+                self._completed.set(record_id, (doc["fingerprint"], doc["body"]))
+                return IdempotentResult(self._check(doc["fingerprint"], fingerprint, doc["body"]), replayed=True)
+
+            self._check(doc["fingerprint"], fingerprint, b"")
+            if doc["locked_until"] <= now:
+                # The first execution's process died; take the key over
+                taken = await self.collection.update_one(
+                    {"_id": record_id, "status": "pending", "locked_until": doc["locked_until"]},
+                    {"$set": {"locked_until": now + timedelta(seconds=self.lock_seconds)}}
+                )
+                if taken.modified_count:
+                    break
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still being processed")
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        try:
+            body = await execute()
+        except BaseException:
+            # Failed requests are not recorded, so the client may retry them
+            await self.collection.delete_one({"_id": record_id, "status": "pending"})
+            raise
+
+        await self.collection.update_one(
+            {"_id": record_id},
+            {"$set": {"status": "completed", "body": body}, "$unset": {"locked_until": ""}}
+        )
+        self._completed.set(record_id, (fingerprint, body))
+        return IdempotentResult(body, replayed=False)
+
+
+async def idempotent_response(store: IdempotencyStore,
+                              scope: str,
+                              user_id: str,
+                              key: str,
+                              payload: Any,
+                              execute: Callable[[], Awaitable[bytes]]) -> JSONBytesResponse:
+    """Run ``execute`` at most once per key and answer with its stored JSON body"""
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"
+        )
+    try:
+        result = await store.run(scope, user_id, key, request_fingerprint(payload), execute)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e), headers={"Retry-After": "1"})
+    headers = {"Idempotent-Replayed": "true"} if result.replayed else None
+    return JSONBytesResponse(result.body, headers=headers)
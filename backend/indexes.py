@@ -0,0 +1,164 @@
+"""Declarative index registry and query-plan audit.
+
+Indexes are applied on app startup. Run this module directly to apply them
+or to audit that every service query shape is served by an index:
+
+    python indexes.py --apply
+    python indexes.py --audit
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="users_email", unique=True),
+        IndexModel([("id", ASCENDING)], name="users_id", unique=True),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], name="products_id", unique=True),
+        IndexModel([("category", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)], name="products_category_name"),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)], name="products_name"),
+        IndexModel([("price", ASCENDING), ("id", ASCENDING)], name="products_price"),
+        IndexModel([("rating", DESCENDING), ("id", ASCENDING)], name="products_rating"),
+        IndexModel([("updated_at", ASCENDING)], name="products_updated_at"),
+        IndexModel(
+            [("name", TEXT), ("description", TEXT), ("features", TEXT)],
+            name="products_text",
+            weights={"name": 6, "description": 2, "features": 1},
+        ),
+    ],
+    "categories": [
+        IndexModel([("id", ASCENDING)], name="categories_id", unique=True),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="carts_user_id", unique=True),
+        # Price/stock reconciliation finds the carts holding a product
+        IndexModel([("items.product_id", ASCENDING)], name="carts_items_product_id"),
+    ],
+    "orders": [
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="orders_user_history",
+        ),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="orders_id_user", unique=True),
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="orders_payment_pending",
+            partialFilterExpression={"payment_status": "pending"},
+        ),
+    ],
+    "payment_jobs": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="payment_jobs_due"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], name="idempotency_keys_ttl", expireAfterSeconds=0),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="rate_limits_ttl", expireAfterSeconds=0),
+    ],
+    "testimonials": [
+        IndexModel([("id", ASCENDING)], name="testimonials_id", unique=True),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING)], name="testimonials_active"),
+    ],
+}
+
+# Query shapes issued by the services: (origin, collection, filter, sort)
+QUERY_SHAPES = [
+    ("UserService.authenticate_user", "users", {"email": "user@example.com"}, None),
+    ("UserService.get_user_by_id", "users", {"id": "user-id"}, None),
+    ("ProductService.get_product_by_id", "products", {"id": "product-id"}, None),
+    ("ProductService.get_products (category)", "products", {"category": "Office Suite"}, [("name", 1), ("id", 1)]),
+    ("ProductService.get_products (price)", "products", {}, [("price", 1), ("id", 1)]),
+    ("ProductService.get_products (rating)", "products", {}, [("rating", -1), ("id", 1)]),
+    ("ProductService.get_products (search)", "products", {"$text": {"$search": "windows"}}, None),
+    ("CatalogCache poll", "products", {"updated_at": {"$gt": 0}}, None),
+    ("ProductService.catalog_change_key", "products", {}, [("updated_at", -1)]),
+    ("CartService.get_or_create_cart", "carts", {"user_id": "user-id"}, None),
+    ("CartService.reconcile_products", "carts", {"items": {"$elemMatch": {"product_id": "product-id", "$or": [{"price": {"$ne": 0}}]}}}, None),
+    ("OrderService.get_user_orders", "orders", {"user_id": "user-id"}, [("created_at", -1), ("id", -1)]),
+    ("OrderService.get_order_by_id", "orders", {"id": "order-id", "user_id": "user-id"}, None),
+    ("PaymentQueue.lease", "payment_jobs", {"status": {"$in": ["queued", "leased"]}, "run_at": {"$lte": 0}}, [("run_at", 1)]),
+    ("PaymentQueue.recover_orphans", "orders", {"payment_status": "pending", "created_at": {"$lt": 0}}, None),
+    ("TestimonialService.get_active_testimonials", "testimonials", {"is_active": True}, [("created_at", -1)]),
+]
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """Create every registered index; existing identical indexes are a no-op"""
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate data blocking a unique index; keep serving
+            logger.error("Failed to create indexes on %s: %s", collection_name, e)
+
+
+def plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+async def audit_query_shapes(db: AsyncIOMotorDatabase) -> List[dict]:
+    """Explain each service query shape and flag the ones that scan a collection"""
+    report = []
+    for origin, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        stages = plan_stages(winning_plan)
+        report.append({
+            "origin": origin,
+            "collection": collection_name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="create the registered indexes")
+    parser.add_argument("--audit", action="store_true", help="explain service queries and report COLLSCANs")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.apply or not args.audit:
+            await ensure_indexes(db)
+            print("Indexes applied")
+
+        if args.audit:
+            report = await audit_query_shapes(db)
+            for entry in report:
+                verdict = "COLLSCAN" if entry["collscan"] else "ok"
+                print(f"{verdict:9} {entry['origin']:45} {' <- '.join(entry['stages'])}")
+            if any(entry["collscan"] for entry in report):
+                return 1
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,136 @@
+"""Cross-process cache invalidation over a MongoDB capped collection.
+
+Every worker keeps in-process caches (catalog, categories, the catalog
+snapshot). Product edits reach every worker through the catalog change
+stream, but some writes do not: category counts rewritten by the worker
+that runs maintenance, imports run from the command line, and changes
+that polling cannot see. The process making such a write publishes a
+message on a topic; every other process tails the collection and hands
+the message to its subscribers.
+
+A capped collection is used rather than a change stream because tailable
+cursors also work on standalone servers. Messages are best effort:
+a process that falls too far behind (the collection wrapped) or whose
+cursor dies treats every topic as invalidated, and a restart may
+redeliver messages from the same second. Subscribers must be idempotent,
+which dropping a cache entry is.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_COLLECTION = os.getenv("INVALIDATION_COLLECTION", "cache_invalidations")
+INVALIDATION_CAPPED_BYTES = int(os.getenv("INVALIDATION_CAPPED_BYTES", str(1024 * 1024)))
+INVALIDATION_RETRY_SECONDS = float(os.getenv("INVALIDATION_RETRY_SECONDS", "1"))
+
+# Subscribers are called with the message key, or None for "everything"
+Subscriber = Callable[[Optional[str]], Any]
+
+
+class InvalidationBus:
+    def __init__(self,
+                 collection_name: str = INVALIDATION_COLLECTION,
+                 size_bytes: int = INVALIDATION_CAPPED_BYTES,
+                 retry_seconds: float = INVALIDATION_RETRY_SECONDS):
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.retry_seconds = retry_seconds
+        self.origin: Optional[str] = None
+        self._collection: Optional[AsyncIOMotorCollection] = None
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, topic: str, callback: Subscriber):
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, topic: str, callback: Subscriber):
+        callbacks = self._subscribers.get(topic, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    async def open(self, db: AsyncIOMotorDatabase):
+        """Create the capped collection if needed; enough for publishing"""
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # another process created it first
+        self._collection = db[self.collection_name]
+        # Chosen here rather than at import: preloaded workers share the import
+        self.origin = uuid.uuid4().hex
+        # A tailable cursor on an empty capped collection dies at once
+        if await self._collection.find_one({}, {"_id": 1}) is None:
+            await self._collection.insert_one(self._message("bus", None))
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Open the bus and follow messages from other processes until stop()"""
+        await self.open(db)
+        # Start from the newest message, so only later writes invalidate caches
+        newest = await self._collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        self._task = asyncio.create_task(self._follow(newest["_id"]))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._collection = None
+
+    def _message(self, topic: str, key: Optional[str]) -> dict:
+        return {"topic": topic, "key": key, "origin": self.origin, "at": datetime.utcnow()}
+
+    async def publish(self, topic: str, key: Optional[str] = None):
+        """Tell the other processes to drop ``key`` (or everything) under ``topic``"""
+        if self._collection is None:
+            return
+        try:
+            await self._collection.insert_one(self._message(topic, key))
+        except PyMongoError:
+            # The other processes converge when their caches expire
+            logger.exception("Failed to publish %s invalidation", topic)
+
+    async def _follow(self, resume_from: ObjectId):
+        # ObjectIds from different processes are only ordered to the second,
+        # so resume from the start of that second and tolerate redelivery
+        after = ObjectId.from_datetime(resume_from.generation_time)
+        restarted = False
+        while True:
+            cursor = self._collection.find({"_id": {"$gte": after}}, cursor_type=CursorType.TAILABLE_AWAIT)
+            if restarted:
+                # Messages may have been missed while there was no cursor
+                await self._dispatch_all()
+            try:
+                while cursor.alive:
+                    async for message in cursor:
+                        after = ObjectId.from_datetime(message["_id"].generation_time)
+                        if message.get("origin") != self.origin:
+                            await self._dispatch(message["topic"], message.get("key"))
+            except PyMongoError:
+                logger.exception("Invalidation bus cursor failed, reopening")
+            restarted = True
+            await asyncio.sleep(self.retry_seconds)
+
+    async def _dispatch(self, topic: str, key: Optional[str]):
+        for callback in list(self._subscribers.get(topic, ())):
+            try:
+                result = callback(key)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("Invalidation subscriber for %s failed", topic)
+
+    async def _dispatch_all(self):
+        for topic in list(self._subscribers):
+            await self._dispatch(topic, None)
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,235 @@
+"""Production entry point: a supervisor running several uvicorn workers.
+
+One process does its Python work (Pydantic, bcrypt, JSON) on one core, so
+the app scales by running WEB_WORKERS processes side by side:
+
+    python launcher.py --workers 4 --port 8001
+    python launcher.py --no-preload --reuse-port
+
+The supervisor binds the port once and forks the workers, which all accept
+on that socket. With --reuse-port each worker binds its own socket instead
+(Linux), and the kernel spreads connections evenly between them. With
+--preload (the default) the app is imported before forking, so a broken
+import fails once, up front, and workers share the imported code
+copy-on-write. Nothing that owns a thread, socket or event loop exists
+until the app lifespan runs, so forking after the import is safe.
+
+Each worker runs the lifespan itself: it opens and warms its own Mongo
+pool and caches before it starts accepting. Worker 0 also runs the
+database upkeep (see ServiceContainer.maintenance), and the invalidation
+bus keeps the other workers' caches coherent. /api/metrics and profiles
+describe the worker that served them. Set RATE_LIMIT_STORE=mongo so rate
+limits are shared.
+
+SIGTERM or SIGINT drains: workers stop accepting, finish in-flight
+requests (up to --graceful-timeout), run the lifespan shutdown and exit.
+Workers still running after --kill-timeout are killed; a second signal
+kills them at once. A worker that dies is restarted, with a growing delay
+if it keeps dying soon after starting.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import uvicorn
+from dotenv import load_dotenv
+from uvicorn.importer import import_from_string
+
+load_dotenv(Path(__file__).parent / '.env')
+
+WEB_APP = os.getenv("WEB_APP", "server:app")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8001"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "true").lower() == "true"
+WEB_REUSE_PORT = os.getenv("WEB_REUSE_PORT", "false").lower() == "true"
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_KILL_TIMEOUT = float(os.getenv("WEB_KILL_TIMEOUT", "45"))
+
+# A worker that lived this long is healthy; its next exit restarts at once
+STABLE_SECONDS = 10
+MAX_RESTART_DELAY_SECONDS = 30
+STARTUP_FAILURE = 3
+
+logger = logging.getLogger("launcher")
+
+
+def bind_socket(host: str, port: int, backlog: int, reuse_port: bool = False) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _drain_if_orphaned(supervisor_pid: int):
+    # A killed supervisor cannot forward SIGTERM, so drain on our own
+    while os.getppid() == supervisor_pid:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def run_worker(index: int, app, sock: Optional[socket.socket], options: argparse.Namespace):
+    # Own process group: a terminal's Ctrl-C reaches only the supervisor,
+    # which drains each worker with a single SIGTERM
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Read by the lifespan; worker 0 runs the database upkeep
+    os.environ["WORKER_INDEX"] = str(index)
+    threading.Thread(target=_drain_if_orphaned, args=(options.supervisor_pid,), daemon=True).start()
+
+    if sock is None:
+        sock = bind_socket(options.host, options.port, options.backlog, reuse_port=True)
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=options.log_level,
+        timeout_graceful_shutdown=options.graceful_timeout,
+    )
+    server = uvicorn.Server(config)
+    # Lifespan startup (pool and cache warm-up) completes before serve()
+    # starts accepting on the socket
+    server.run(sockets=[sock])
+    sys.exit(0 if server.started else STARTUP_FAILURE)
+
+
+class Supervisor:
+    def __init__(self, app, sock: Optional[socket.socket], options: argparse.Namespace):
+        self.app = app
+        self.sock = sock
+        self.options = options
+        self.workers: Dict[int, multiprocessing.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._context = multiprocessing.get_context("fork")
+        self.stopping = False
+        self.forced = False
+
+    def handle_signal(self, signum, frame):
+        if self.stopping:
+            self.forced = True
+        self.stopping = True
+
+    def spawn(self, index: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.app, self.sock, self.options),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self.workers[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info("Started worker %d (pid %d)", index, process.pid)
+
+    def _reap(self):
+        now = time.monotonic()
+        for index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self.workers[index]
+            lived = now - self._started_at[index]
+            failures = 0 if lived >= STABLE_SECONDS else self._failures.get(index, 0) + 1
+            self._failures[index] = failures
+            delay = min(MAX_RESTART_DELAY_SECONDS, 2 ** failures - 1)
+            logger.warning(
+                "Worker %d (pid %d) exited with code %s after %.1fs; restarting in %ds",
+                index, process.pid, process.exitcode, lived, delay
+            )
+            self._restart_at[index] = now + delay
+
+    def _respawn_due(self):
+        now = time.monotonic()
+        for index, due in list(self._restart_at.items()):
+            if due <= now:
+                del self._restart_at[index]
+                self.spawn(index)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        for index in range(self.options.workers):
+            self.spawn(index)
+
+        while not self.stopping:
+            wait([process.sentinel for process in self.workers.values()], timeout=1)
+            if self.stopping:
+                break
+            self._reap()
+            self._respawn_due()
+        return self.drain()
+
+    def drain(self) -> int:
+        workers: List[multiprocessing.Process] = [p for p in self.workers.values() if p.is_alive()]
+        logger.info("Draining %d workers", len(workers))
+        for process in workers:
+            os.kill(process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.options.kill_timeout
+        while not self.forced and time.monotonic() < deadline:
+            alive = [p for p in workers if p.is_alive()]
+            if not alive:
+                break
+            wait([p.sentinel for p in alive], timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+
+        for process in workers:
+            if process.is_alive():
+                logger.warning("Killing worker %s (pid %d), still running", process.name, process.pid)
+                process.kill()
+            process.join()
+        return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default=WEB_APP, help="import string of the ASGI app")
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=WEB_PRELOAD,
+                        help="import the app before forking the workers")
+    parser.add_argument("--reuse-port", action=argparse.BooleanOptionalAction, default=WEB_REUSE_PORT,
+                        help="give each worker its own SO_REUSEPORT socket")
+    parser.add_argument("--backlog", type=int, default=WEB_BACKLOG)
+    parser.add_argument("--graceful-timeout", type=int, default=WEB_GRACEFUL_TIMEOUT,
+                        help="seconds a worker waits for in-flight requests when draining")
+    parser.add_argument("--kill-timeout", type=float, default=WEB_KILL_TIMEOUT,
+                        help="seconds before workers that have not exited are killed")
+    parser.add_argument("--log-level", default="info")
+    options = parser.parse_args(argv)
+    options.supervisor_pid = os.getpid()
+
+    logging.basicConfig(
+        level=options.log_level.upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if options.workers > 1 and os.getenv("RATE_LIMIT_STORE", "memory") != "mongo":
+        logger.warning("Rate limits are per worker; set RATE_LIMIT_STORE=mongo to share them")
+
+    app = import_from_string(options.app) if options.preload else options.app
+    # With SO_REUSEPORT every worker binds its own socket after forking
+    sock = None if options.reuse_port else bind_socket(options.host, options.port, options.backlog)
+    logger.info(
+        "Serving %s on %s:%d with %d workers (preload %s)",
+        options.app, options.host, options.port, options.workers, "on" if options.preload else "off"
+    )
+    return Supervisor(app, sock, options).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Request and database metrics in Prometheus text format.
+
+A pymongo CommandListener attributes every command to the request that
+issued it through a context variable. Motor copies the context into its
+executor threads, so commands run on behalf of a request see that
+request's stats. Commands issued by background tasks (payment workers,
+catalog polling) are counted under route "background".
+
+MetricsMiddleware records per-route latency histograms and per-route DB
+command, byte and time totals. pymongo hands listeners decoded documents,
+so byte counts mean re-encoding them; only a sample of commands
+(METRICS_BYTE_SAMPLE_RATE) is measured and the totals are estimates. It
+can also report the request's DB time in a Server-Timing header
+(METRICS_SERVER_TIMING=true).
+"""
+import asyncio
+import bisect
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import bson
+from pymongo import monitoring
+
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() == "true"
+METRICS_LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("METRICS_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+# Fraction of commands and replies whose BSON size is measured; 0 disables byte counts
+METRICS_BYTE_SAMPLE_RATE = float(os.getenv("METRICS_BYTE_SAMPLE_RATE", "0.05"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BACKGROUND_ROUTE = "background"
+
+
+class RequestStats:
+    __slots__ = ("commands", "db_seconds", "bytes_sent", "bytes_received", "_lock")
+
+    def __init__(self):
+        self.commands = 0
+        self.db_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Concurrent queries of one request finish on different executor threads
+        self._lock = threading.Lock()
+
+    def add_command(self, bytes_sent: int):
+        with self._lock:
+            self.commands += 1
+            self.bytes_sent += bytes_sent
+
+    def add_reply(self, seconds: float, bytes_received: int):
+        with self._lock:
+            self.db_seconds += seconds
+            self.bytes_received += bytes_received
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteTotals:
+    __slots__ = ("commands", "db_seconds", "bytes_sent", "bytes_received")
+
+    def __init__(self):
+        self.commands = 0
+        self.db_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, stats: RequestStats):
+        self.commands += stats.commands
+        self.db_seconds += stats.db_seconds
+        self.bytes_sent += stats.bytes_sent
+        self.bytes_received += stats.bytes_received
+
+
+def _labels(**labels: str) -> str:
+    rendered = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + rendered + "}"
+
+
+def _render_histogram(lines: List[str], name: str, histogram: Histogram, **labels: str):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=repr(bound))} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+
+def render_password_hasher(stats: dict) -> str:
+    """PasswordHasher.stats() as Prometheus gauges and counters"""
+    lines: List[str] = []
+    for name, field, kind, help_text in (
+        ("password_hash_queue_depth", "queue_depth", "gauge", "Password operations waiting for a worker"),
+        ("password_hash_queue_depth_max", "max_queue_depth", "gauge", "Largest password queue depth observed"),
+        ("password_hash_in_flight", "in_flight", "gauge", "Password operations running"),
+        ("password_hash_completed_total", "completed", "counter", "Password operations completed"),
+        ("password_hash_rejected_total", "rejected", "counter", "Password operations rejected with a full queue"),
+        ("password_hash_seconds_total", "busy_seconds", "counter", "Time spent hashing and verifying passwords"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {stats[field]}")
+    return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    def __init__(self):
+        self.request_latency: Dict[Tuple[str, str, int], Histogram] = {}
+        self.route_db: Dict[Tuple[str, str], RouteTotals] = {}
+        self.background_db = RouteTotals()
+        # command name -> [count, failures, seconds]; updated from executor threads
+        self.commands: Dict[str, list] = {}
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_lag_max = 0.0
+        self._lock = threading.Lock()
+        self._loop_monitor: Optional[asyncio.Task] = None
+
+    def record_command(self, command_name: str, seconds: float, failed: bool):
+        with self._lock:
+            totals = self.commands.get(command_name)
+            if totals is None:
+                totals = self.commands[command_name] = [0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += failed
+            totals[2] += seconds
+
+    def record_background(self, commands: int = 0, bytes_sent: int = 0, seconds: float = 0.0, bytes_received: int = 0):
+        with self._lock:
+            self.background_db.commands += commands
+            self.background_db.bytes_sent += bytes_sent
+            self.background_db.db_seconds += seconds
+            self.background_db.bytes_received += bytes_received
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route, status)
+        histogram = self.request_latency.get(key)
+        if histogram is None:
+            histogram = self.request_latency[key] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+        totals = self.route_db.get((method, route))
+        if totals is None:
+            totals = self.route_db[(method, route)] = RouteTotals()
+        totals.add(stats)
+
+    async def _monitor_loop_lag(self, interval: float):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            # Anything past the requested sleep is time the loop was busy elsewhere
+            lag = max(0.0, time.perf_counter() - started - interval)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    def start_loop_monitor(self, interval: float = METRICS_LOOP_LAG_INTERVAL_SECONDS):
+        if self._loop_monitor is None or self._loop_monitor.done():
+            self._loop_monitor = asyncio.create_task(self._monitor_loop_lag(interval))
+
+    async def stop_loop_monitor(self):
+        if self._loop_monitor is not None:
+            self._loop_monitor.cancel()
+            await asyncio.gather(self._loop_monitor, return_exceptions=True)
+            self._loop_monitor = None
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        lines.append("# HELP http_request_duration_seconds Request latency by route")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route, status), histogram in sorted(self.request_latency.items()):
+            _render_histogram(lines, "http_request_duration_seconds", histogram,
+                              method=method, route=route, status=str(status))
+
+        route_totals = sorted(self.route_db.items())
+        route_totals.append((("", BACKGROUND_ROUTE), self.background_db))
+        for name, field, help_text in (
+            ("mongo_request_commands_total", "commands", "MongoDB commands issued, by route"),
+            ("mongo_request_seconds_total", "db_seconds", "Time spent in MongoDB commands, by route"),
+            ("mongo_request_sent_bytes_total", "bytes_sent", "Command bytes sent to MongoDB (sampled estimate), by route"),
+            ("mongo_request_received_bytes_total", "bytes_received", "Reply bytes received from MongoDB (sampled estimate), by route"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (method, route), totals in route_totals:
+                lines.append(f"{name}{_labels(method=method, route=route)} {getattr(totals, field)}")
+
+        with self._lock:
+            commands = sorted((name, list(totals)) for name, totals in self.commands.items())
+        lines.append("# HELP mongo_commands_total MongoDB commands by command name")
+        lines.append("# TYPE mongo_commands_total counter")
+        for name, (count, _, _) in commands:
+            lines.append(f"mongo_commands_total{_labels(command=name)} {count}")
+        lines.append("# HELP mongo_command_failures_total Failed MongoDB commands by command name")
+        lines.append("# TYPE mongo_command_failures_total counter")
+        for name, (_, failures, _) in commands:
+            lines.append(f"mongo_command_failures_total{_labels(command=name)} {failures}")
+        lines.append("# HELP mongo_command_seconds_total Time spent in MongoDB commands by command name")
+        lines.append("# TYPE mongo_command_seconds_total counter")
+        for name, (_, _, seconds) in commands:
+            lines.append(f"mongo_command_seconds_total{_labels(command=name)} {seconds}")
+
+        lines.append("# HELP event_loop_lag_seconds Delay of periodic event loop wake-ups")
+        lines.append("# TYPE event_loop_lag_seconds histogram")
+        _render_histogram(lines, "event_loop_lag_seconds", self.loop_lag)
+        lines.append("# HELP event_loop_lag_max_seconds Largest event loop lag observed")
+        lines.append("# TYPE event_loop_lag_max_seconds gauge")
+        lines.append(f"event_loop_lag_max_seconds {self.loop_lag_max}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _bson_size(document, sample_rate: float = METRICS_BYTE_SAMPLE_RATE) -> int:
+    """Estimated size of a command or reply, scaled up from a sample"""
+    # RawBSONDocument already knows its size; plain dicts have to be encoded
+    raw = getattr(document, "raw", None)
+    if raw is not None:
+        return len(raw)
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        return 0
+    try:
+        return round(len(bson.encode(document)) / sample_rate)
+    except Exception:
+        return 0
+
+
+class QueryAccountingListener(monitoring.CommandListener):
+    """Attributes MongoDB commands to the request running them"""
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        size = _bson_size(event.command)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.add_command(size)
+        else:
+            metrics.record_background(commands=1, bytes_sent=size)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, _bson_size(event.reply), failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, reply_size: int, failed: bool):
+        seconds = event.duration_micros / 1e6
+        metrics.record_command(event.command_name, seconds, failed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.add_reply(seconds, reply_size)
+        else:
+            metrics.record_background(seconds=seconds, bytes_received=reply_size)
+
+
+command_listener = QueryAccountingListener()
+
+
+class MetricsMiddleware:
+    def __init__(self, app, server_timing: bool = METRICS_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    timing = (
+                        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.commands} commands", '
+                        f"app;dur={elapsed_ms:.2f}"
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode()),
+                        # Lets cross-origin frontends read the timings
+                        (b"timing-allow-origin", b"*"),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_request_stats.reset(token)
+            route = scope.get("route")
+            # Route templates keep the label set bounded; unmatched paths share one label
+            route_path = getattr(route, "path", None) or "unmatched"
+            metrics.record_request(scope["method"], route_path, status, time.perf_counter() - started, stats)
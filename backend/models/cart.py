@@ -1,7 +1,12 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple
 from datetime import datetime
+from catalog_cache import CatalogCache
+from models.product import catalog_cache
+from slow_queries import query_origin
 import uuid
 
 class CartItem(BaseModel):
@@ -10,6 +15,16 @@ class CartItem(BaseModel):
     price: float
     name: str
     image: str
+    # Rest of the product snapshot, kept current by CartService.reconcile_products
+    category: str = ""
+    original_price: Optional[float] = None
+    description: str = ""
+    features: List[str] = []
+    in_stock: bool = True
+    rating: float = 0.0
+    reviews: int = 0
+    is_monthly: bool = False
+    subtotal: float = 0.0
 
 class CartItemResponse(BaseModel):
     id: str
@@ -25,17 +40,22 @@ class CartItemResponse(BaseModel):
     reviews: int
     isMonthly: bool
     quantity: int
+    subtotal: float
 
 class Cart(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     items: List[CartItem] = []
+    # Maintained on every write, so reading a cart never touches products
+    total: float = 0.0
+    item_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class CartResponse(BaseModel):
     cartItems: List[CartItemResponse]
     total: float
+    itemCount: int = 0
 
 class AddToCartRequest(BaseModel):
     productId: str
@@ -44,142 +64,285 @@ class AddToCartRequest(BaseModel):
 class UpdateCartRequest(BaseModel):
     quantity: int
 
+# Product fields copied onto a cart line
+LINE_SNAPSHOT_FIELDS = (
+    "name", "category", "price", "original_price", "description", "features",
+    "image", "in_stock", "rating", "reviews", "is_monthly",
+)
+
+# $set for emptying a cart
+EMPTY_CART = {"items": [], "total": 0.0, "item_count": 0}
+
+# Fields of a stored line other than its subtotal
+LINE_FIELDS = ("product_id", "quantity", *LINE_SNAPSHOT_FIELDS)
+
+# Pipeline stages deriving line subtotals, the total and the item count from
+# the lines. Every cart write ends with them, so the stored figures always
+# match the lines written in the same update. Amounts are stored unrounded
+# and rounded when a cart is read.
+TOTALS_STAGES = [
+    {"$set": {"items": {"$map": {
+        "input": {"$ifNull": ["$items", []]},
+        "as": "line",
+        "in": {
+            **{field: f"$$line.{field}" for field in LINE_FIELDS},
+            "subtotal": {"$multiply": ["$$line.price", "$$line.quantity"]},
+        },
+    }}}},
+    {"$set": {
+        "total": {"$sum": "$items.subtotal"},
+        "item_count": {"$sum": "$items.quantity"},
+    }},
+]
+
+def line_snapshot(product_doc: dict) -> dict:
+    return {field: product_doc[field] for field in LINE_SNAPSHOT_FIELDS if field in product_doc}
+
+def build_line(product_doc: dict, quantity: int) -> CartItem:
+    return CartItem(
+        product_id=product_doc["id"],
+        quantity=quantity,
+        subtotal=product_doc["price"] * quantity,
+        **line_snapshot(product_doc)
+    )
+
+def cart_totals(items: List[CartItem]) -> Tuple[float, int]:
+    """(total, item count) of a list of lines, as TOTALS_STAGES computes them"""
+    return sum(item.subtotal for item in items), sum(item.quantity for item in items)
+
+def _catalog_line(product_doc: dict, quantity) -> dict:
+    """Expression for product_doc's line at ``quantity`` (a number or an expression)"""
+    return {
+        "product_id": {"$literal": product_doc["id"]},
+        **{field: {"$literal": value} for field, value in line_snapshot(product_doc).items()},
+        "quantity": quantity,
+    }
+
+def _stored_line(quantity: int) -> dict:
+    """Expression for the current $$line with its quantity changed"""
+    return {**{field: f"$$line.{field}" for field in LINE_FIELDS}, "quantity": quantity}
+
+def _replace_line(product_id: str, line: dict) -> dict:
+    """Expression rewriting the line for product_id as ``line``, which may refer to $$line"""
+    return {"$map": {
+        "input": "$items",
+        "as": "line",
+        "in": {"$cond": [{"$eq": ["$$line.product_id", {"$literal": product_id}]}, line, "$$line"]},
+    }}
+
+def _without_lines(product_ids: List[str]) -> dict:
+    """Expression for the lines not holding any of product_ids"""
+    return {"$filter": {
+        "input": {"$ifNull": ["$items", []]},
+        "cond": {"$not": {"$in": ["$$this.product_id", {"$literal": product_ids}]}},
+    }}
+
+def _drifted(product_id: str, snapshot: dict) -> dict:
+    """Filter for carts holding product_id with a snapshot that differs from the catalog"""
+    return {"items": {"$elemMatch": {
+        "product_id": product_id,
+        "$or": [{field: {"$ne": value}} for field, value in snapshot.items()],
+    }}}
+
 class CartService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self, db: AsyncIOMotorDatabase, catalog: CatalogCache = catalog_cache):
         self.collection = db.carts
         self.products_collection = db.products
+        self.catalog = catalog
 
+    @query_origin
     async def get_or_create_cart(self, user_id: str) -> Cart:
         cart_doc = await self.collection.find_one({"user_id": user_id})
         if cart_doc:
             return Cart(**cart_doc)
-        
-        # Create new cart
+
+        # Create new cart; carts.user_id is unique, so a concurrent request
+        # that got there first makes this insert fail and we use its cart
         cart = Cart(user_id=user_id)
-        await self.collection.insert_one(cart.dict())
+        try:
+            await self.collection.insert_one(cart.dict())
+        except DuplicateKeyError:
+            cart_doc = await self.collection.find_one({"user_id": user_id})
+            return Cart(**cart_doc)
         return cart
 
+    @query_origin
     async def get_cart_with_products(self, user_id: str) -> CartResponse:
-        cart = await self.get_or_create_cart(user_id)
-        cart_items = []
-        total = 0.0
-
-        for item in cart.items:
-            # Get full product details
-            product_doc = await self.products_collection.find_one({"id": item.product_id})
-            if product_doc:
-                cart_item = CartItemResponse(
-                    id=product_doc["id"],
-                    name=product_doc["name"],
-                    category=product_doc["category"],
-                    price=product_doc["price"],
-                    originalPrice=product_doc.get("original_price"),
-                    description=product_doc["description"],
-                    features=product_doc.get("features", []),
-                    image=product_doc["image"],
-                    inStock=product_doc.get("in_stock", True),
-                    rating=product_doc.get("rating", 0.0),
-                    reviews=product_doc.get("reviews", 0),
-                    isMonthly=product_doc.get("is_monthly", False),
-                    quantity=item.quantity
-                )
-                cart_items.append(cart_item)
-                total += product_doc["price"] * item.quantity
-
-        return CartResponse(cartItems=cart_items, total=total)
+        # Lines carry their product snapshot and the cart its totals: one read
+        cart_doc = await self.collection.find_one({"user_id": user_id}, {"_id": 0})
+        if not cart_doc or not cart_doc.get("items"):
+            return CartResponse(cartItems=[], total=0.0)
+        if "item_count" not in cart_doc:
+            cart_doc = await self._backfill_totals(cart_doc)
 
+        cart = Cart(**cart_doc)
+        cart_items = [
+            CartItemResponse(
+                id=item.product_id,
+                name=item.name,
+                category=item.category,
+                price=item.price,
+                originalPrice=item.original_price,
+                description=item.description,
+                features=item.features,
+                image=item.image,
+                inStock=item.in_stock,
+                rating=item.rating,
+                reviews=item.reviews,
+                isMonthly=item.is_monthly,
+                quantity=item.quantity,
+                subtotal=round(item.subtotal, 2)
+            )
+            for item in cart.items
+        ]
+        # Amounts are stored unrounded
+        return CartResponse(cartItems=cart_items, total=round(cart.total, 2), itemCount=cart.item_count)
+
+    async def _backfill_totals(self, cart_doc: dict) -> dict:
+        """Give a cart written before totals were stored its snapshots and totals"""
+        products_by_id = await self.catalog.get_many(
+            self.products_collection,
+            [item["product_id"] for item in cart_doc.get("items", [])]
+        )
+        items = [
+            build_line(products_by_id[item["product_id"]], item["quantity"])
+            for item in cart_doc.get("items", [])
+            if item["product_id"] in products_by_id
+        ]
+        total, item_count = cart_totals(items)
+        updates = {"items": [item.dict() for item in items], "total": total, "item_count": item_count}
+        # A concurrent backfill that got there first wrote the same thing
+        await self.collection.update_one(
+            {"user_id": cart_doc["user_id"], "item_count": {"$exists": False}},
+            {"$set": updates}
+        )
+        return {**cart_doc, **updates}
+
+    @query_origin
     async def add_to_cart(self, user_id: str, product_id: str, quantity: int = 1) -> bool:
         # Get product details
-        product_doc = await self.products_collection.find_one({"id": product_id})
+        product_doc = await self.catalog.get(self.products_collection, product_id)
         if not product_doc:
             raise ValueError("Product not found")
 
-        cart = await self.get_or_create_cart(user_id)
-        
-        # Check if item already exists in cart
-        existing_item_index = None
-        for i, item in enumerate(cart.items):
-            if item.product_id == product_id:
-                existing_item_index = i
-                break
-
-        if existing_item_index is not None:
-            # Update quantity
-            cart.items[existing_item_index].quantity += quantity
-        else:
-            # Add new item
-            cart_item = CartItem(
-                product_id=product_id,
-                quantity=quantity,
-                price=product_doc["price"],
-                name=product_doc["name"],
-                image=product_doc["image"]
-            )
-            cart.items.append(cart_item)
-
-        cart.updated_at = datetime.utcnow()
-        
-        # Update in database
+        # One upsert: bump the line or append it, creating the cart if there is
+        # none. The line is rewritten from the catalog, so a line added before a
+        # price change is repriced. A concurrent upsert of the same new cart
+        # collides on the unique user_id index and is retried by the server.
+        new_cart = Cart(user_id=user_id)
+        in_cart = {"$in": [{"$literal": product_id}, {"$ifNull": ["$items.product_id", []]}]}
         await self.collection.update_one(
             {"user_id": user_id},
-            {"$set": cart.dict()}
+            [
+                {"$set": {
+                    "items": {"$cond": [
+                        in_cart,
+                        _replace_line(product_id, _catalog_line(product_doc, {"$add": ["$$line.quantity", quantity]})),
+                        {"$concatArrays": [
+                            {"$ifNull": ["$items", []]},
+                            {"$literal": [{"product_id": product_id, **line_snapshot(product_doc), "quantity": quantity}]},
+                        ]},
+                    ]},
+                    "id": {"$ifNull": ["$id", new_cart.id]},
+                    "created_at": {"$ifNull": ["$created_at", new_cart.created_at]},
+                    "updated_at": datetime.utcnow(),
+                }},
+                *TOTALS_STAGES,
+            ],
+            upsert=True
         )
-        
         return True
 
+    @query_origin
     async def update_cart_item(self, user_id: str, product_id: str, quantity: int) -> bool:
-        cart = await self.get_or_create_cart(user_id)
-        
         if quantity <= 0:
             # Remove item
-            cart.items = [item for item in cart.items if item.product_id != product_id]
-        else:
-            # Update quantity
-            for item in cart.items:
-                if item.product_id == product_id:
-                    item.quantity = quantity
-                    break
-            else:
-                return False  # Item not found
-
-        cart.updated_at = datetime.utcnow()
-        
-        # Update in database
-        await self.collection.update_one(
-            {"user_id": user_id},
-            {"$set": cart.dict()}
+            await self.remove_from_cart(user_id, product_id)
+            return True
+
+        result = await self.collection.update_one(
+            {"user_id": user_id, "items.product_id": product_id},
+            [
+                {"$set": {
+                    "items": _replace_line(product_id, _stored_line(quantity)),
+                    "updated_at": datetime.utcnow(),
+                }},
+                *TOTALS_STAGES,
+            ]
         )
-        
-        return True
+        return result.matched_count > 0
 
+    @query_origin
     async def remove_from_cart(self, user_id: str, product_id: str) -> bool:
-        cart = await self.get_or_create_cart(user_id)
-        
-        original_length = len(cart.items)
-        cart.items = [item for item in cart.items if item.product_id != product_id]
-        
-        if len(cart.items) == original_length:
-            return False  # Item not found
-        
-        cart.updated_at = datetime.utcnow()
-        
-        # Update in database
-        await self.collection.update_one(
-            {"user_id": user_id},
-            {"$set": cart.dict()}
+        return await self._remove_lines(user_id, [product_id])
+
+    @query_origin
+    async def remove_products(self, user_id: str, product_ids: Iterable[str]) -> bool:
+        """Drop the lines for product_ids, e.g. once they have been ordered"""
+        return await self._remove_lines(user_id, sorted(set(product_ids)))
+
+    async def _remove_lines(self, user_id: str, product_ids: List[str]) -> bool:
+        result = await self.collection.update_one(
+            {"user_id": user_id, "items.product_id": {"$in": product_ids}},
+            [
+                {"$set": {"items": _without_lines(product_ids), "updated_at": datetime.utcnow()}},
+                *TOTALS_STAGES,
+            ]
         )
-        
-        return True
+        return result.matched_count > 0
 
+    @query_origin
     async def clear_cart(self, user_id: str) -> bool:
-        cart = await self.get_or_create_cart(user_id)
-        cart.items = []
-        cart.updated_at = datetime.utcnow()
-        
-        # Update in database
         await self.collection.update_one(
             {"user_id": user_id},
-            {"$set": cart.dict()}
+            {"$set": {**EMPTY_CART, "updated_at": datetime.utcnow()}}
         )
-        
-        return True
\ No newline at end of file
+        return True
+
+    @query_origin
+    async def reconcile_products(self, product_ids: Iterable[Optional[str]]) -> int:
+        """Bring cart lines in line with the catalog after products change.
+
+        Lines whose snapshot drifted (price, stock, name...) are refreshed and
+        lines for deleted products dropped, one update_many per product over
+        the carts_items_product_id index; carts already current are not
+        touched. A None id (a change that could not be attributed) checks
+        every product held in a cart. Returns the number of carts modified.
+        """
+        product_ids = set(product_ids)
+        if None in product_ids:
+            product_ids.discard(None)
+            product_ids.update(await self.collection.distinct("items.product_id"))
+        if not product_ids:
+            return 0
+
+        products_by_id = await self.catalog.get_many(self.products_collection, list(product_ids))
+        now = datetime.utcnow()
+        operations = []
+        for product_id in sorted(product_ids):
+            product_doc = products_by_id.get(product_id)
+            if product_doc is None:
+                continue
+            snapshot = line_snapshot(product_doc)
+            operations.append(UpdateMany(
+                _drifted(product_id, snapshot),
+                [
+                    {"$set": {
+                        "items": _replace_line(product_id, _catalog_line(product_doc, "$$line.quantity")),
+                        "updated_at": now,
+                    }},
+                    *TOTALS_STAGES,
+                ]
+            ))
+
+        deleted = sorted(product_ids - set(products_by_id))
+        if deleted:
+            operations.append(UpdateMany(
+                {"items.product_id": {"$in": deleted}},
+                [{"$set": {"items": _without_lines(deleted), "updated_at": now}}, *TOTALS_STAGES]
+            ))
+
+        if not operations:
+            return 0
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.modified_count
@@ -1,7 +1,13 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import AsyncIterator, List, Optional, Dict, Any
 from datetime import datetime
+from catalog_cache import CatalogCache
+from cursors import encode_cursor, decode_cursor
+from models.cart import CartService
+from models.product import catalog_cache
+from payment_queue import PaymentQueue
+from slow_queries import query_origin
 import uuid
 
 class OrderItem(BaseModel):
@@ -12,6 +18,9 @@ class OrderItem(BaseModel):
     image: str
 
 class ShippingAddress(BaseModel):
+    # Stored documents use field names, API payloads use the camelCase aliases
+    model_config = ConfigDict(populate_by_name=True)
+
     first_name: str = Field(..., alias="firstName")
     last_name: str = Field(..., alias="lastName")
     email: str
@@ -52,54 +61,149 @@ class OrderResponse(BaseModel):
     paymentStatus: str
     createdAt: datetime
 
+class OrderSummaryResponse(BaseModel):
+    id: str
+    orderId: str
+    total: float
+    status: str
+    paymentStatus: str
+    itemCount: int
+    createdAt: datetime
+
+class PaymentStatusResponse(BaseModel):
+    orderId: str
+    status: str
+    paymentStatus: str
+    paymentReference: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    nextAttemptAt: Optional[datetime] = None
+
 class OrdersListResponse(BaseModel):
     orders: List[OrderResponse]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+class OrderSummariesListResponse(BaseModel):
+    orders: List[OrderSummaryResponse]
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+# Summary view leaves out line items and shipping addresses
+SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "order_id": 1,
+    "total": 1,
+    "status": 1,
+    "payment_status": 1,
+    "created_at": 1,
+    "item_count": {"$size": "$items"}
+}
+
+ORDER_HISTORY_SORT = [("created_at", -1), ("id", -1)]
+
+def order_response_from_doc(doc: dict) -> OrderResponse:
+    return OrderResponse(
+        id=doc["id"],
+        orderId=doc["order_id"],
+        items=doc["items"],
+        total=doc["total"],
+        status=doc["status"],
+        shippingAddress=ShippingAddress(**doc["shipping_address"]),
+        paymentMethod=doc["payment_method"],
+        paymentStatus=doc["payment_status"],
+        createdAt=doc["created_at"]
+    )
+
+def order_summary_from_doc(doc: dict) -> OrderSummaryResponse:
+    return OrderSummaryResponse(
+        id=doc["id"],
+        orderId=doc["order_id"],
+        total=doc["total"],
+        status=doc["status"],
+        paymentStatus=doc["payment_status"],
+        itemCount=doc["item_count"],
+        createdAt=doc["created_at"]
+    )
+
+def order_quantities(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Requested quantity per product id, merging repeated lines"""
+    quantities: Dict[str, int] = {}
+    for item in items:
+        product_id = item.get("id") or item.get("product_id")
+        quantity = item.get("quantity")
+        if not isinstance(product_id, str) or not product_id:
+            raise ValueError("Each order item needs a product id")
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError(f"Invalid quantity for product {product_id}")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        raise ValueError("Order has no items")
+    return quantities
 
 class OrderService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self,
+                 db: AsyncIOMotorDatabase,
+                 catalog: CatalogCache = catalog_cache,
+                 payments: Optional[PaymentQueue] = None):
         self.collection = db.orders
-        self.carts_collection = db.carts
+        self.carts = CartService(db, catalog)
+        self.products_collection = db.products
+        self.catalog = catalog
+        # Without a queue payments are settled inline, before the order is stored
+        self.payments = payments
 
+    @query_origin
     async def create_order(self, user_id: str, order_data: OrderCreate) -> OrderResponse:
-        # Calculate total from items
+        quantities = order_quantities(order_data.items)
+
+        # Prices, names and images come from the catalog, never from the client;
+        # every product is resolved in one batch
+        products_by_id = await self.catalog.get_many(self.products_collection, list(quantities))
+
         total = 0.0
         order_items = []
-        
-        for item_data in order_data.items:
-            order_item = OrderItem(
-                product_id=item_data["id"],
-                name=item_data["name"],
-                price=item_data["price"],
-                quantity=item_data["quantity"],
-                image=item_data["image"]
-            )
-            order_items.append(order_item)
-            total += item_data["price"] * item_data["quantity"]
-
-        # Create order
+        for product_id, quantity in quantities.items():
+            product_doc = products_by_id.get(product_id)
+            if product_doc is None:
+                raise ValueError(f"Product {product_id} not found")
+            if not product_doc.get("in_stock", True):
+                raise ValueError(f"{product_doc['name']} is out of stock")
+
+            order_items.append(OrderItem(
+                product_id=product_id,
+                name=product_doc["name"],
+                price=product_doc["price"],
+                quantity=quantity,
+                image=product_doc["image"]
+            ))
+            total += product_doc["price"] * quantity
+
         order = Order(
             user_id=user_id,
             items=order_items,
-            total=total,
+            total=round(total, 2),
             shipping_address=order_data.shipping_address,
             payment_method=order_data.payment_method,
             payment_details=order_data.payment_details
         )
 
-        # Save to database
-        await self.collection.insert_one(order.dict())
+        if self.payments is not None:
+            # Return a pending order at once; a payment worker settles it and
+            # removes the ordered lines from the cart, and clients poll the
+            # payment status
+            await self.collection.insert_one(order.dict())
+            await self.payments.enqueue(order.id, user_id)
+        else:
+            # Settle the payment before anything is written, so the order is
+            # stored once in its final state and no pending copy can be left behind
+            await self._process_payment(order)
+            await self.collection.insert_one(order.dict())
 
-        # Simulate payment processing
-        # In real implementation, this would integrate with Stripe/UPI
-        await self._process_payment(order)
-
-        # If payment successful, clear cart
         if order.payment_status == "completed":
-            await self.carts_collection.update_one(
-                {"user_id": user_id},
-                {"$set": {"items": [], "updated_at": datetime.utcnow()}}
-            )
+            # Same as the payment worker: only the ordered lines leave the cart
+            await self.carts.remove_products(user_id, quantities)
 
         return OrderResponse(
             id=order.id,
@@ -113,42 +217,87 @@ class OrderService:
             createdAt=order.created_at
         )
 
-    async def get_user_orders(self, user_id: str) -> OrdersListResponse:
-        cursor = self.collection.find({"user_id": user_id}).sort("created_at", -1)
-        orders_docs = await cursor.to_list(length=None)
-        
-        orders = []
-        for doc in orders_docs:
-            order_response = OrderResponse(
-                id=doc["id"],
-                orderId=doc["order_id"],
-                items=doc["items"],
-                total=doc["total"],
-                status=doc["status"],
-                shippingAddress=ShippingAddress(**doc["shipping_address"]),
-                paymentMethod=doc["payment_method"],
-                paymentStatus=doc["payment_status"],
-                createdAt=doc["created_at"]
-            )
-            orders.append(order_response)
-
-        return OrdersListResponse(orders=orders, total=len(orders))
+    def _history_cursor(self, user_id: str, cursor: Optional[str], summary: bool):
+        query: Dict[str, Any] = {"user_id": user_id}
+        if cursor:
+            position = decode_cursor(cursor)
+            try:
+                created_at = datetime.fromisoformat(position["t"])
+                last_id = position["id"]
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Invalid cursor")
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": last_id}}
+            ]
+        projection = SUMMARY_PROJECTION if summary else {"_id": 0}
+        return self.collection.find(query, projection).sort(ORDER_HISTORY_SORT)
 
+    @query_origin
+    async def get_user_orders(self,
+                              user_id: str,
+                              limit: Optional[int] = None,
+                              cursor: Optional[str] = None,
+                              summary: bool = False):
+        to_response = order_summary_from_doc if summary else order_response_from_doc
+        list_response = OrderSummariesListResponse if summary else OrdersListResponse
+
+        if limit is None and cursor is None:
+            # Unpaginated history, kept for existing clients
+            orders_docs = await self._history_cursor(user_id, None, summary).to_list(length=None)
+            orders = [to_response(doc) for doc in orders_docs]
+            return list_response(orders=orders, total=len(orders))
+
+        limit = limit or 20
+        # Read one extra document to learn whether another page exists
+        db_cursor = self._history_cursor(user_id, cursor, summary).limit(limit + 1)
+        orders_docs = await db_cursor.to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(orders_docs) > limit:
+            orders_docs = orders_docs[:limit]
+            last = orders_docs[-1]
+            next_cursor = encode_cursor({"t": last["created_at"].isoformat(), "id": last["id"]})
+
+        return list_response(
+            orders=[to_response(doc) for doc in orders_docs],
+            next_cursor=next_cursor
+        )
+
+    @query_origin
+    async def stream_user_orders(self, user_id: str, summary: bool = False) -> AsyncIterator[bytes]:
+        """Yield the order history as NDJSON lines while the cursor produces them"""
+        to_response = order_summary_from_doc if summary else order_response_from_doc
+        async for doc in self._history_cursor(user_id, None, summary).batch_size(100):
+            yield to_response(doc).model_dump_json().encode() + b"\n"
+
+    @query_origin
     async def get_order_by_id(self, user_id: str, order_id: str) -> Optional[OrderResponse]:
         doc = await self.collection.find_one({"id": order_id, "user_id": user_id})
         if not doc:
             return None
 
-        return OrderResponse(
-            id=doc["id"],
+        return order_response_from_doc(doc)
+
+    @query_origin
+    async def get_payment_status(self, user_id: str, order_id: str) -> Optional[PaymentStatusResponse]:
+        doc = await self.collection.find_one(
+            {"id": order_id, "user_id": user_id},
+            {"_id": 0, "order_id": 1, "status": 1, "payment_status": 1, "payment_reference": 1, "payment_error": 1}
+        )
+        if not doc:
+            return None
+
+        job = await self.payments.get_job(order_id) if self.payments is not None else None
+        waiting = job is not None and job["status"] == "queued"
+        return PaymentStatusResponse(
             orderId=doc["order_id"],
-            items=doc["items"],
-            total=doc["total"],
             status=doc["status"],
-            shippingAddress=ShippingAddress(**doc["shipping_address"]),
-            paymentMethod=doc["payment_method"],
             paymentStatus=doc["payment_status"],
-            createdAt=doc["created_at"]
+            paymentReference=doc.get("payment_reference"),
+            error=doc.get("payment_error") or (job or {}).get("last_error"),
+            attempts=job["attempts"] if job else 0,
+            nextAttemptAt=job["run_at"] if waiting else None
         )
 
     async def _process_payment(self, order: Order):
@@ -161,13 +310,3 @@ class OrderService:
         order.payment_status = "completed"
         order.status = "completed"
         order.updated_at = datetime.utcnow()
-        
-        # Update in database
-        await self.collection.update_one(
-            {"id": order.id},
-            {"$set": {
-                "payment_status": order.payment_status,
-                "status": order.status,
-                "updated_at": order.updated_at
-            }}
-        )
\ No newline at end of file
@@ -1,7 +1,18 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
+from bisect import bisect_right
+from catalog_cache import CatalogCache, CatalogEntry
+from search_index import SearchIndex
+from cursors import encode_cursor, decode_cursor
+from bulk_upsert import upsert_batch
+from invalidation_bus import InvalidationBus, invalidation_bus
+from slow_queries import query_origin
+from ttl_cache import TTLCache
+import fast_json
+import time
 import uuid
 
 class Product(BaseModel):
@@ -36,9 +47,10 @@ class ProductResponse(BaseModel):
 
 class ProductsListResponse(BaseModel):
     products: List[ProductResponse]
-    total: int
-    page: int
-    total_pages: int
+    total: Optional[int] = None
+    page: Optional[int] = None
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 class Category(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -56,149 +68,470 @@ class CategoryResponse(BaseModel):
     icon: str
     count: int
 
+def product_response_from_doc(doc: dict) -> ProductResponse:
+    return ProductResponse(
+        id=doc["id"],
+        name=doc["name"],
+        category=doc["category"],
+        price=doc["price"],
+        originalPrice=doc.get("original_price"),
+        description=doc["description"],
+        features=doc.get("features", []),
+        image=doc["image"],
+        inStock=doc.get("in_stock", True),
+        rating=doc.get("rating", 0.0),
+        reviews=doc.get("reviews", 0),
+        isMonthly=doc.get("is_monthly", False)
+    )
+
+def product_from_record(data: dict) -> Product:
+    """Build a Product from a camelCase catalog record (mock data or feed)"""
+    return Product(
+        id=data["id"],
+        name=data["name"],
+        category=data["category"],
+        price=data["price"],
+        original_price=data.get("originalPrice"),
+        description=data["description"],
+        features=data.get("features", []),
+        image=data["image"],
+        in_stock=data.get("inStock", True),
+        rating=data.get("rating", 0.0),
+        reviews=data.get("reviews", 0),
+        is_monthly=data.get("isMonthly", False)
+    )
+
+def category_from_record(data: dict) -> Category:
+    return Category(
+        id=data["id"],
+        name=data["name"],
+        description=data["description"],
+        icon=data["icon"]
+    )
+
+# Projection producing ProductResponse-shaped documents straight from Mongo
+PRODUCT_RESPONSE_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "category": 1,
+    "price": 1,
+    "originalPrice": {"$ifNull": ["$original_price", None]},
+    "description": 1,
+    "features": {"$ifNull": ["$features", []]},
+    "image": 1,
+    "inStock": {"$ifNull": ["$in_stock", True]},
+    "rating": {"$ifNull": ["$rating", 0.0]},
+    "reviews": {"$ifNull": ["$reviews", 0]},
+    "isMonthly": {"$ifNull": ["$is_monthly", False]}
+}
+
+def product_json_from_response(response: ProductResponse) -> bytes:
+    return response.model_dump_json().encode()
+
+# Shared by every ProductService and CartService in the process
+catalog_cache = CatalogCache(product_response_from_doc, product_json_from_response)
+
+SORT_OPTIONS = {
+    "name": ("name", 1),
+    "price-low": ("price", 1),
+    "price-high": ("price", -1),
+    "rating": ("rating", -1),
+}
+
+# Cursor mode caches counts per query shape instead of counting every page;
+# searches are free text, so the number of shapes kept is bounded
+COUNT_CACHE_TTL_SECONDS = 60
+COUNT_CACHE_SIZE = 1000
+_count_cache = TTLCache(maxsize=COUNT_CACHE_SIZE, ttl_seconds=COUNT_CACHE_TTL_SECONDS)
+
+def check_cursor(cursor_data: dict, sort: str):
+    """Reject cursor fields that cannot position the requested sort"""
+    if sort == "relevance":
+        offset = cursor_data.get("o", 0)
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise ValueError("Invalid cursor")
+    elif "id" in cursor_data or "v" in cursor_data:
+        sort_field, _ = SORT_OPTIONS[sort]
+        value = cursor_data.get("v")
+        value_types = str if sort_field == "name" else (int, float)
+        if (not isinstance(cursor_data.get("id"), str)
+                or not isinstance(value, value_types) or isinstance(value, bool)):
+            raise ValueError("Invalid cursor")
+
+def sort_key(sort: str):
+    """Key ordering catalog entries like the Mongo sort, with id as tie-breaker"""
+    sort_field, sort_direction = SORT_OPTIONS.get(sort, SORT_OPTIONS["name"])
+    if sort_field == "name":
+        return lambda e: (e.doc["name"], e.doc["id"])
+    return lambda e: (sort_direction * e.doc.get(sort_field, 0), e.doc["id"])
+
+class ProductPage:
+    """One page of products, rendered either as a model or as JSON bytes.
+
+    Items are cached CatalogEntry objects or documents already shaped by
+    PRODUCT_RESPONSE_PROJECTION; both are trusted, so to_json splices
+    their serialized forms together without validating them again.
+    """
+
+    def __init__(self,
+                 items: list,
+                 total: Optional[int] = None,
+                 page: Optional[int] = None,
+                 total_pages: Optional[int] = None,
+                 next_cursor: Optional[str] = None):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.total_pages = total_pages
+        self.next_cursor = next_cursor
+
+    def _meta(self) -> dict:
+        return {
+            "total": self.total,
+            "page": self.page,
+            "total_pages": self.total_pages,
+            "next_cursor": self.next_cursor
+        }
+
+    def to_response(self) -> ProductsListResponse:
+        products = [
+            item.response if isinstance(item, CatalogEntry) else ProductResponse(**item)
+            for item in self.items
+        ]
+        return ProductsListResponse(products=products, **self._meta())
+
+    def to_json(self) -> bytes:
+        products = [
+            item.json if isinstance(item, CatalogEntry) else fast_json.dumps(item)
+            for item in self.items
+        ]
+        meta = fast_json.dumps(self._meta())
+        return b'{"products":[' + b",".join(products) + b"]," + meta[1:]
+
 class ProductService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self,
+                 db: AsyncIOMotorDatabase,
+                 catalog: CatalogCache = catalog_cache,
+                 bus: InvalidationBus = invalidation_bus):
         self.collection = db.products
         self.categories_collection = db.categories
+        self.catalog = catalog
+        # Tells other worker processes about writes their caches cannot see
+        self.bus = bus
+        # (expires_at, catalog version, categories, etag tag, last modified)
+        self._categories: Optional[tuple] = None
 
     async def get_products(self, 
                           category: Optional[str] = None,
                           search: Optional[str] = None,
-                          sort: str = "name",
+                          sort: Optional[str] = None,
                           page: int = 1,
-                          limit: int = 20) -> ProductsListResponse:
+                          limit: int = 20,
+                          cursor: Optional[str] = None,
+                          paginate: str = "page",
+                          include_total: bool = False) -> ProductsListResponse:
+        page_result = await self.get_product_page(category, search, sort, page, limit, cursor, paginate, include_total)
+        return page_result.to_response()
+
+    @query_origin
+    async def get_product_page(self,
+                               category: Optional[str] = None,
+                               search: Optional[str] = None,
+                               sort: Optional[str] = None,
+                               page: int = 1,
+                               limit: int = 20,
+                               cursor: Optional[str] = None,
+                               paginate: str = "page",
+                               include_total: bool = False) -> ProductPage:
+        # Search results default to relevance order, plain listings to name
+        if not sort:
+            sort = "relevance" if search else "name"
+        if sort not in SORT_OPTIONS and not (sort == "relevance" and search):
+            sort = "name"
+
+        cursor_data = None
+        if cursor is not None or paginate == "cursor":
+            cursor_data = decode_cursor(cursor) if cursor else {"s": sort}
+            if cursor_data.get("s") != sort:
+                raise ValueError("Cursor does not match the requested sort")
+            check_cursor(cursor_data, sort)
+
+        entries = await self.catalog.all_entries(self.collection)
+        if entries is not None:
+            return self._list_from_catalog(category, search, sort, page, limit, cursor_data, include_total)
+
+        if cursor_data is not None:
+            return await self._list_by_cursor(category, search, sort, limit, cursor_data, include_total)
+
+        # Fetch the page and the total count in a single round trip
+        skip = (page - 1) * limit
+        pipeline = [
+            {"$match": self._build_query(category, search)},
+            {"$facet": {
+                "products": [
+                    {"$sort": self._build_sort(sort, search)},
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$project": PRODUCT_RESPONSE_PROJECTION}
+                ],
+                "total": [{"$count": "count"}]
+            }}
+        ]
+        result = (await self.collection.aggregate(pipeline).to_list(length=1))[0]
+        total = result["total"][0]["count"] if result["total"] else 0
+        total_pages = (total + limit - 1) // limit
         
-        # Build query
+        return ProductPage(
+            result["products"],
+            total=total,
+            page=page,
+            total_pages=total_pages
+        )
+
+    def _build_query(self, category: Optional[str], search: Optional[str]) -> dict:
         query = {}
         if category:
             query["category"] = category
         if search:
-            query["$or"] = [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"description": {"$regex": search, "$options": "i"}}
-            ]
+            query["$text"] = {"$search": search}
+        return query
 
-        # Count total documents
-        total = await self.collection.count_documents(query)
-        
-        # Build sort
-        sort_field = "name"
-        sort_direction = 1
-        if sort == "price-low":
-            sort_field = "price"
-            sort_direction = 1
-        elif sort == "price-high":
-            sort_field = "price"
-            sort_direction = -1
-        elif sort == "rating":
-            sort_field = "rating"
-            sort_direction = -1
-
-        # Get products with pagination
-        skip = (page - 1) * limit
-        cursor = self.collection.find(query).sort(sort_field, sort_direction).skip(skip).limit(limit)
-        products_docs = await cursor.to_list(length=limit)
-        
-        # Convert to response format
-        products = []
-        for doc in products_docs:
-            product_response = ProductResponse(
-                id=doc["id"],
-                name=doc["name"],
-                category=doc["category"],
-                price=doc["price"],
-                originalPrice=doc.get("original_price"),
-                description=doc["description"],
-                features=doc.get("features", []),
-                image=doc["image"],
-                inStock=doc.get("in_stock", True),
-                rating=doc.get("rating", 0.0),
-                reviews=doc.get("reviews", 0),
-                isMonthly=doc.get("is_monthly", False)
+    def _build_sort(self, sort: str, search: Optional[str]) -> dict:
+        if sort == "relevance" and search:
+            return {"score": {"$meta": "textScore"}, "id": 1}
+        sort_field, sort_direction = SORT_OPTIONS.get(sort, SORT_OPTIONS["name"])
+        return {sort_field: sort_direction, "id": 1}
+
+    async def _list_by_cursor(self,
+                              category: Optional[str],
+                              search: Optional[str],
+                              sort: str,
+                              limit: int,
+                              cursor_data: dict,
+                              include_total: bool) -> ProductPage:
+        query = self._build_query(category, search)
+        skip = 0
+        if sort == "relevance":
+            # Text scores cannot be range-queried, so relevance pages by offset
+            skip = cursor_data.get("o", 0)
+        elif "id" in cursor_data:
+            sort_field, sort_direction = SORT_OPTIONS[sort]
+            operator = "$gt" if sort_direction > 0 else "$lt"
+            query = {"$and": [query, {"$or": [
+                {sort_field: {operator: cursor_data["v"]}},
+                {sort_field: cursor_data["v"], "id": {"$gt": cursor_data["id"]}}
+            ]}]}
+
+        # Read one extra document to learn whether another page exists
+        pipeline = [{"$match": query}, {"$sort": self._build_sort(sort, search)}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        pipeline += [{"$limit": limit + 1}, {"$project": PRODUCT_RESPONSE_PROJECTION}]
+        docs = await self.collection.aggregate(pipeline).to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            if sort == "relevance":
+                next_cursor = encode_cursor({"s": sort, "o": skip + limit})
+            else:
+                sort_field, _ = SORT_OPTIONS[sort]
+                last = docs[-1]
+                next_cursor = encode_cursor({"s": sort, "v": last.get(sort_field, 0), "id": last["id"]})
+
+        total = await self._approximate_count(category, search) if include_total else None
+        return ProductPage(docs, total=total, next_cursor=next_cursor)
+
+    async def _approximate_count(self, category: Optional[str], search: Optional[str]) -> int:
+        shape = (category, search)
+        count = _count_cache.get(shape)
+        if count is not None:
+            return count
+        count = await self.collection.count_documents(self._build_query(category, search))
+        _count_cache.set(shape, count)
+        return count
+
+    def _sorted_entries(self, sort: str) -> List[CatalogEntry]:
+        return self.catalog.derived(f"sort:{sort}", lambda entries: sorted(entries, key=sort_key(sort)))
+
+    def _list_from_catalog(self,
+                           category: Optional[str],
+                           search: Optional[str],
+                           sort: str,
+                           page: int,
+                           limit: int,
+                           cursor_data: Optional[dict] = None,
+                           include_total: bool = False) -> ProductPage:
+        if search:
+            index = self.catalog.derived("search", lambda entries: SearchIndex(e.doc for e in entries))
+            hits = index.search(search)
+            if sort == "relevance":
+                entries = [self.catalog.peek(product_id) for product_id, _ in hits]
+            else:
+                hit_ids = {product_id for product_id, _ in hits}
+                entries = [e for e in self._sorted_entries(sort) if e.doc["id"] in hit_ids]
+        else:
+            entries = self._sorted_entries(sort)
+
+        if category:
+            entries = [e for e in entries if e.doc["category"] == category]
+
+        total = len(entries)
+
+        if cursor_data is not None:
+            if sort == "relevance":
+                start = cursor_data.get("o", 0)
+            elif "id" in cursor_data:
+                sort_field, sort_direction = SORT_OPTIONS[sort]
+                value = cursor_data["v"] if sort_field == "name" else sort_direction * cursor_data["v"]
+                start = bisect_right(entries, (value, cursor_data["id"]), key=sort_key(sort))
+            else:
+                start = 0
+
+            page_entries = entries[start:start + limit]
+            next_cursor = None
+            if start + limit < total:
+                if sort == "relevance":
+                    next_cursor = encode_cursor({"s": sort, "o": start + limit})
+                else:
+                    sort_field, _ = SORT_OPTIONS[sort]
+                    last = page_entries[-1].doc
+                    next_cursor = encode_cursor({"s": sort, "v": last.get(sort_field, 0), "id": last["id"]})
+
+            return ProductPage(
+                page_entries,
+                total=total if include_total else None,
+                next_cursor=next_cursor
             )
-            products.append(product_response)
 
-        total_pages = (total + limit - 1) // limit
-        
-        return ProductsListResponse(
-            products=products,
+        skip = (page - 1) * limit
+
+        return ProductPage(
+            entries[skip:skip + limit],
             total=total,
             page=page,
-            total_pages=total_pages
+            total_pages=(total + limit - 1) // limit
         )
 
+    @query_origin
     async def get_product_by_id(self, product_id: str) -> Optional[ProductResponse]:
-        doc = await self.collection.find_one({"id": product_id})
-        if not doc:
+        return await self.catalog.get_response(self.collection, product_id)
+
+    @query_origin
+    async def get_product_entry(self, product_id: str) -> Optional[CatalogEntry]:
+        return await self.catalog.get_entry(self.collection, product_id)
+
+    @query_origin
+    async def get_all_product_json(self) -> List[bytes]:
+        """Every product as serialized JSON, ordered by name"""
+        if await self.catalog.all_entries(self.collection) is not None:
+            return [entry.json for entry in self._sorted_entries("name")]
+
+        cursor = self.collection.find({}, {"_id": 0}).sort([("name", 1), ("id", 1)])
+        return [
+            product_json_from_response(product_response_from_doc(doc))
+            async for doc in cursor
+        ]
+
+    @query_origin
+    async def catalog_validators(self) -> Optional[Tuple[str, Optional[datetime]]]:
+        """(version tag, last modified) for listings, or None if the catalog is not cached"""
+        if await self.catalog.all_entries(self.collection) is None:
             return None
-        
-        return ProductResponse(
-            id=doc["id"],
-            name=doc["name"],
-            category=doc["category"],
-            price=doc["price"],
-            originalPrice=doc.get("original_price"),
-            description=doc["description"],
-            features=doc.get("features", []),
-            image=doc["image"],
-            inStock=doc.get("in_stock", True),
-            rating=doc.get("rating", 0.0),
-            reviews=doc.get("reviews", 0),
-            isMonthly=doc.get("is_monthly", False)
-        )
+        return self.catalog.fingerprint()
+
+    @query_origin
+    async def catalog_change_key(self) -> str:
+        """A key that changes with the catalog, also when it is too large to cache"""
+        validators = await self.catalog_validators()
+        if validators is not None:
+            return validators[0]
+        # Same shape as CatalogCache.fingerprint: newest updated_at (indexed) and the count
+        newest = await self.collection.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
+        count = await self.collection.estimated_document_count()
+        stamp = newest["updated_at"].isoformat() if newest and newest.get("updated_at") else "-"
+        return f"{stamp}:{count}"
 
     async def get_categories(self) -> List[CategoryResponse]:
-        cursor = self.categories_collection.find({})
+        categories, _, _ = await self.get_categories_with_validators()
+        return categories
+
+    @query_origin
+    async def get_categories_with_validators(self) -> Tuple[List[CategoryResponse], str, Optional[datetime]]:
+        # Cached until the catalog changes (counts follow products) or the TTL lapses
+        cached = self._categories
+        if cached is not None and cached[0] > time.monotonic() and cached[1] == self.catalog.version:
+            return cached[2], cached[3], cached[4]
+
+        version = self.catalog.version
+        # Counts are materialized on the category documents by refresh_category_counts
+        cursor = self.categories_collection.find({}, {"_id": 0})
         categories_docs = await cursor.to_list(length=None)
-        
-        categories = []
-        for doc in categories_docs:
-            # Count products in this category
-            count = await self.collection.count_documents({"category": doc["name"]})
-            
-            category_response = CategoryResponse(
+
+        categories = [
+            CategoryResponse(
                 id=doc["id"],
                 name=doc["name"],
                 description=doc["description"],
                 icon=doc["icon"],
-                count=count
+                count=doc.get("count", 0)
             )
-            categories.append(category_response)
-        
-        return categories
+            for doc in categories_docs
+        ]
+        stamps = [doc["updated_at"] for doc in categories_docs if doc.get("updated_at")]
+        last_modified = max(stamps) if stamps else None
+        tag = ",".join(f"{c.id}:{c.count}" for c in categories) + f"@{last_modified}"
 
+        self._categories = (time.monotonic() + self.catalog.ttl_seconds, version, categories, tag, last_modified)
+        return categories, tag, last_modified
+
+    @query_origin
+    async def count_products_by_category(self) -> dict:
+        pipeline = [{"$group": {"_id": "$category", "count": {"$sum": 1}}}]
+        return {doc["_id"]: doc["count"] async for doc in self.collection.aggregate(pipeline)}
+
+    @query_origin
+    async def refresh_category_counts(self):
+        """Recompute the materialized product count on every category"""
+        counts = await self.count_products_by_category()
+        cursor = self.categories_collection.find({}, {"_id": 0, "id": 1, "name": 1, "count": 1})
+        categories_docs = await cursor.to_list(length=None)
+
+        now = datetime.utcnow()
+        updates = [
+            UpdateOne(
+                {"id": doc["id"]},
+                {"$set": {"count": counts.get(doc["name"], 0), "updated_at": now}}
+            )
+            for doc in categories_docs
+            if doc.get("count") != counts.get(doc["name"], 0)
+        ]
+        if updates:
+            await self.categories_collection.bulk_write(updates, ordered=False)
+            self._categories = None
+            await self.bus.publish("categories")
+
+    def invalidate_categories(self):
+        self._categories = None
+
+    @query_origin
     async def seed_products(self, products_data: List[dict]):
         """Seed products from mock data"""
-        for product_data in products_data:
-            # Check if product already exists
-            existing = await self.collection.find_one({"id": product_data["id"]})
-            if not existing:
-                product = Product(
-                    id=product_data["id"],
-                    name=product_data["name"],
-                    category=product_data["category"],
-                    price=product_data["price"],
-                    original_price=product_data.get("originalPrice"),
-                    description=product_data["description"],
-                    features=product_data.get("features", []),
-                    image=product_data["image"],
-                    in_stock=product_data.get("inStock", True),
-                    rating=product_data.get("rating", 0.0),
-                    reviews=product_data.get("reviews", 0),
-                    is_monthly=product_data.get("isMonthly", False)
-                )
-                await self.collection.insert_one(product.dict())
+        # Insert missing products in one bulk write; existing ones are kept
+        docs = [product_from_record(product_data).dict() for product_data in products_data]
+        await upsert_batch(self.collection, docs, overwrite=False)
 
+        self.catalog.invalidate()
+        await self.bus.publish("catalog")
+        await self.refresh_category_counts()
+
+    @query_origin
     async def seed_categories(self, categories_data: List[dict]):
         """Seed categories from mock data"""
-        for category_data in categories_data:
-            # Check if category already exists
-            existing = await self.categories_collection.find_one({"id": category_data["id"]})
-            if not existing:
-                category = Category(
-                    id=category_data["id"],
-                    name=category_data["name"],
-                    description=category_data["description"],
-                    icon=category_data["icon"]
-                )
-                await self.categories_collection.insert_one(category.dict())
\ No newline at end of file
+        docs = [category_from_record(category_data).dict() for category_data in categories_data]
+        await upsert_batch(self.categories_collection, docs, overwrite=False)
+        self._categories = None
+        await self.bus.publish("categories")
+
+        await self.refresh_category_counts()
@@ -2,6 +2,8 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel, Field
 from typing import List
 from datetime import datetime
+from bulk_upsert import upsert_batch
+from slow_queries import query_origin
 
 class Testimonial(BaseModel):
     id: int
@@ -22,10 +24,21 @@ class TestimonialResponse(BaseModel):
     rating: int
     avatar: str
 
+def testimonial_from_record(data: dict) -> Testimonial:
+    return Testimonial(
+        id=data["id"],
+        name=data["name"],
+        role=data["role"],
+        content=data["content"],
+        rating=data["rating"],
+        avatar=data["avatar"]
+    )
+
 class TestimonialService:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.testimonials
 
+    @query_origin
     async def get_active_testimonials(self) -> List[TestimonialResponse]:
         cursor = self.collection.find({"is_active": True}).sort("created_at", -1)
         testimonials_docs = await cursor.to_list(length=None)
@@ -44,18 +57,8 @@ class TestimonialService:
         
         return testimonials
 
+    @query_origin
     async def seed_testimonials(self, testimonials_data: List[dict]):
         """Seed testimonials from mock data"""
-        for testimonial_data in testimonials_data:
-            # Check if testimonial already exists
-            existing = await self.collection.find_one({"id": testimonial_data["id"]})
-            if not existing:
-                testimonial = Testimonial(
-                    id=testimonial_data["id"],
-                    name=testimonial_data["name"],
-                    role=testimonial_data["role"],
-                    content=testimonial_data["content"],
-                    rating=testimonial_data["rating"],
-                    avatar=testimonial_data["avatar"]
-                )
-                await self.collection.insert_one(testimonial.dict())
\ No newline at end of file
+        docs = [testimonial_from_record(testimonial_data).dict() for testimonial_data in testimonials_data]
+        await upsert_batch(self.collection, docs, overwrite=False)
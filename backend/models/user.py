@@ -1,11 +1,23 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional
 from datetime import datetime
-from passlib.context import CryptContext
+from password_hasher import password_hasher
+from ttl_cache import TTLCache
+from slow_queries import query_origin
+import os
 import uuid
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = password_hasher.context
+
+# Opt-in cache of user documents by id; 0 seconds (the default) disables it
+USER_PROFILE_CACHE_SECONDS = float(os.getenv("USER_PROFILE_CACHE_SECONDS", "0"))
+USER_PROFILE_CACHE_SIZE = int(os.getenv("USER_PROFILE_CACHE_SIZE", "10000"))
+profile_cache = TTLCache(
+    maxsize=USER_PROFILE_CACHE_SIZE if USER_PROFILE_CACHE_SECONDS > 0 else 0,
+    ttl_seconds=USER_PROFILE_CACHE_SECONDS
+)
 
 class UserCreate(BaseModel):
     name: str = Field(..., min_length=2, max_length=100)
@@ -32,6 +44,7 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+    # Synchronous helpers; request handlers go through password_hasher instead
     @staticmethod
     def hash_password(password: str) -> str:
         return pwd_context.hash(password)
@@ -44,6 +57,7 @@ class UserService:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.users
 
+    @query_origin
     async def create_user(self, user_data: UserCreate) -> User:
         # Check if user already exists
         existing_user = await self.collection.find_one({"email": user_data.email})
@@ -51,33 +65,57 @@ class UserService:
             raise ValueError("User with this email already exists")
         
         # Hash password and create user
-        hashed_password = User.hash_password(user_data.password)
+        hashed_password = await password_hasher.hash(user_data.password)
         user = User(
             name=user_data.name,
             email=user_data.email,
             password=hashed_password
         )
         
-        await self.collection.insert_one(user.dict())
+        try:
+            await self.collection.insert_one(user.dict())
+        except DuplicateKeyError:
+            # Concurrent registration with the same email; users.email is unique
+            raise ValueError("User with this email already exists")
         return user
 
+    @query_origin
     async def authenticate_user(self, email: str, password: str) -> Optional[User]:
         user_doc = await self.collection.find_one({"email": email})
         if not user_doc:
             return None
         
         user = User(**user_doc)
-        if not User.verify_password(password, user.password):
+        valid, new_hash = await password_hasher.verify_and_update(password, user.password)
+        if not valid:
             return None
+
+        if new_hash:
+            # Work factor changed since this hash was made; upgrade it transparently
+            user.password = new_hash
+            user.updated_at = datetime.utcnow()
+            await self.collection.update_one(
+                {"id": user.id},
+                {"$set": {"password": user.password, "updated_at": user.updated_at}}
+            )
+            profile_cache.pop(user.id)
         
         return user
 
+    @query_origin
     async def get_user_by_id(self, user_id: str) -> Optional[User]:
+        user = profile_cache.get(user_id)
+        if user is not None:
+            return user
+
         user_doc = await self.collection.find_one({"id": user_id})
         if user_doc:
-            return User(**user_doc)
+            user = User(**user_doc)
+            profile_cache.set(user_id, user)
+            return user
         return None
 
+    @query_origin
     async def get_user_by_email(self, email: str) -> Optional[User]:
         user_doc = await self.collection.find_one({"email": email})
         if user_doc:
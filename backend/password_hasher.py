@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # thread or process
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_CONCURRENCY = int(os.getenv("PASSWORD_HASH_MAX_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+# One context per work factor; module level so process pool workers build their own
+_contexts: Dict[int, CryptContext] = {}
+
+
+def get_context(rounds: int) -> CryptContext:
+    context = _contexts.get(rounds)
+    if context is None:
+        context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        _contexts[rounds] = context
+    return context
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    # bcrypt hashes look like $2b$12$<salt+digest>
+    parts = hashed_password.split("$")
+    if len(parts) >= 4 and parts[2].isdigit():
+        return int(parts[2])
+    return None
+
+
+def _hash(password: str, rounds: int) -> str:
+    return get_context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    context = get_context(rounds)
+    if not context.verify(password, hashed_password):
+        return False, None
+    if hash_rounds(hashed_password) != rounds:
+        return True, context.hash(password)
+    return True, None
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded executor so it never blocks the event loop.
+
+    At most ``max_concurrency`` hashes run at once; callers beyond that wait,
+    and once ``max_queue`` callers are waiting new work is rejected with
+    PasswordHasherBusy instead of piling up behind a login burst.
+    """
+
+    def __init__(self,
+                 rounds: int = BCRYPT_ROUNDS,
+                 executor: str = PASSWORD_HASH_EXECUTOR,
+                 workers: int = PASSWORD_HASH_WORKERS,
+                 max_concurrency: int = PASSWORD_HASH_MAX_CONCURRENCY,
+                 max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.rounds = rounds
+        self.executor_kind = executor
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def context(self) -> CryptContext:
+        return get_context(self.rounds)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                # bcrypt releases the GIL, so threads hash in parallel
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("Too many concurrent password operations")
+
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.busy_seconds += time.perf_counter() - started
+            self.completed += 1
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a new hash if its work factor is outdated"""
+        return await self._run(_verify_and_update, password, hashed_password, self.rounds)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": self.busy_seconds,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
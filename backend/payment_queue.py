@@ -0,0 +1,315 @@
+"""Durable payment processing queue.
+
+Order placement stores a pending order and enqueues a job in
+``payment_jobs``; worker tasks lease due jobs, charge the gateway and settle
+the order. Failed attempts are retried with exponential backoff, and jobs
+that keep failing are dead-lettered (status ``dead``) for an operator.
+
+Job states: queued -> leased -> done | dead (and leased -> queued on retry).
+A job's ``run_at`` is when it may next be leased; while leased it is the
+lease expiry, so a job held by a crashed worker becomes due again. A job is
+leased at most ``max_attempts`` times: one whose last attempt raised or
+never finished is dead-lettered by the recovery pass, which also enqueues
+orders whose job was never written.
+"""
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from models.cart import CartService
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+PAYMENT_LEASE_SECONDS = float(os.getenv("PAYMENT_LEASE_SECONDS", "30"))
+PAYMENT_RETRY_BASE_SECONDS = float(os.getenv("PAYMENT_RETRY_BASE_SECONDS", "2"))
+PAYMENT_RETRY_MAX_SECONDS = float(os.getenv("PAYMENT_RETRY_MAX_SECONDS", "300"))
+PAYMENT_POLL_SECONDS = float(os.getenv("PAYMENT_POLL_SECONDS", "1"))
+PAYMENT_GATEWAY_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_GATEWAY_TIMEOUT_SECONDS", "10"))
+# Orders left pending this long without a job (crash between the two inserts) are re-enqueued
+PAYMENT_ORPHAN_SECONDS = float(os.getenv("PAYMENT_ORPHAN_SECONDS", "60"))
+
+FAKE_GATEWAY_LATENCY_MS = float(os.getenv("FAKE_GATEWAY_LATENCY_MS", "50"))
+FAKE_GATEWAY_FAILURE_RATE = float(os.getenv("FAKE_GATEWAY_FAILURE_RATE", "0"))
+
+
+class PaymentDeclined(Exception):
+    """The gateway refused the payment; retrying will not help"""
+
+
+class PaymentGatewayError(Exception):
+    """Transient gateway failure (timeout, 5xx); the charge is retried"""
+
+
+class FakePaymentGateway:
+    """Local stand-in for Stripe/UPI with configurable latency and failures.
+
+    Charges are keyed on the order id the way a real gateway's idempotency
+    key works, so a retried job never charges twice.
+    """
+
+    def __init__(self,
+                 latency_ms: float = FAKE_GATEWAY_LATENCY_MS,
+                 failure_rate: float = FAKE_GATEWAY_FAILURE_RATE,
+                 decline_methods: tuple = ()):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.decline_methods = decline_methods
+        self.charges = {}
+
+    async def charge(self, order: dict) -> str:
+        await asyncio.sleep(self.latency_ms / 1000)
+        if order["id"] in self.charges:
+            return self.charges[order["id"]]
+        if random.random() < self.failure_rate:
+            raise PaymentGatewayError("Gateway unavailable")
+        if order["payment_method"] in self.decline_methods:
+            raise PaymentDeclined(f"{order['payment_method']} payment declined")
+        reference = f"PAY-{uuid.uuid4().hex[:12].upper()}"
+        self.charges[order["id"]] = reference
+        return reference
+
+
+def retry_delay(attempts: int,
+                base_seconds: float = PAYMENT_RETRY_BASE_SECONDS,
+                max_seconds: float = PAYMENT_RETRY_MAX_SECONDS) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** (attempts - 1)))
+
+
+class PaymentQueue:
+    def __init__(self,
+                 db: AsyncIOMotorDatabase,
+                 gateway=None,
+                 workers: int = PAYMENT_WORKERS,
+                 max_attempts: int = PAYMENT_MAX_ATTEMPTS,
+                 lease_seconds: float = PAYMENT_LEASE_SECONDS,
+                 poll_seconds: float = PAYMENT_POLL_SECONDS,
+                 retry_base_seconds: float = PAYMENT_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = PAYMENT_RETRY_MAX_SECONDS,
+                 gateway_timeout_seconds: float = PAYMENT_GATEWAY_TIMEOUT_SECONDS):
+        self.jobs = db.payment_jobs
+        self.orders = db.orders
+        self.carts = CartService(db)
+        self.gateway = gateway or FakePaymentGateway()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.gateway_timeout_seconds = gateway_timeout_seconds
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def enqueue(self, order_id: str, user_id: str):
+        now = datetime.utcnow()
+        # Keyed on the order id, so enqueueing twice is harmless
+        await self.jobs.update_one(
+            {"_id": order_id},
+            {"$setOnInsert": {
+                "order_id": order_id,
+                "user_id": user_id,
+                "status": "queued",
+                "attempts": 0,
+                "run_at": now,
+                "last_error": None,
+                "created_at": now,
+                "updated_at": now,
+            }},
+            upsert=True
+        )
+        self._wakeup.set()
+
+    async def get_job(self, order_id: str) -> Optional[dict]:
+        return await self.jobs.find_one({"_id": order_id})
+
+    def start(self, recover: bool = False):
+        for number in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work(f"{os.getpid()}-{number}")))
+        if recover:
+            self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def recover_orphans(self) -> int:
+        """Enqueue pending orders whose job insert never happened"""
+        cutoff = datetime.utcnow() - timedelta(seconds=PAYMENT_ORPHAN_SECONDS)
+        cursor = self.orders.find(
+            {"payment_status": "pending", "created_at": {"$lt": cutoff}},
+            {"_id": 0, "id": 1, "user_id": 1}
+        )
+        orders = await cursor.to_list(None)
+        if not orders:
+            return 0
+        # One lookup for the whole batch instead of one per order
+        queued = {job["_id"] async for job in self.jobs.find(
+            {"_id": {"$in": [order["id"] for order in orders]}}, {"_id": 1}
+        )}
+        recovered = 0
+        for order in orders:
+            if order["id"] not in queued:
+                await self.enqueue(order["id"], order["user_id"])
+                recovered += 1
+        return recovered
+
+    async def dead_letter_exhausted(self) -> int:
+        """Dead-letter jobs whose last allowed lease expired without an outcome"""
+        cursor = self.jobs.find({
+            "status": "leased",
+            "run_at": {"$lte": datetime.utcnow()},
+            "attempts": {"$gte": self.max_attempts},
+        })
+        dead = 0
+        async for job in cursor:
+            await self._dead_letter(job, job.get("last_error") or "Lease expired on the last attempt")
+            dead += 1
+        return dead
+
+    async def _recover(self):
+        while True:
+            try:
+                recovered = await self.recover_orphans()
+                dead = await self.dead_letter_exhausted()
+                if recovered or dead:
+                    logger.info("Re-enqueued %d orphaned payments, dead-lettered %d stuck jobs", recovered, dead)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Payment recovery pass failed")
+            await asyncio.sleep(PAYMENT_ORPHAN_SECONDS)
+
+    async def lease(self, worker: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {
+                "status": {"$in": ["queued", "leased"]},
+                "run_at": {"$lte": now},
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {
+                    "status": "leased",
+                    "worker": worker,
+                    "lease_id": uuid.uuid4().hex,
+                    "run_at": now + timedelta(seconds=self.lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _work(self, worker: str):
+        while True:
+            try:
+                job = await self.lease(worker)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to lease a payment job")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Payment job %s failed unexpectedly", job["_id"])
+                try:
+                    await self._retry_or_dead_letter(job, str(e) or type(e).__name__)
+                except Exception:
+                    # The lease runs out and the job is retried or dead-lettered then
+                    logger.exception("Failed to reschedule payment job %s", job["_id"])
+
+    async def process(self, job: dict):
+        order = await self.orders.find_one({"id": job["order_id"]}, {"_id": 0})
+        if order is None:
+            await self._finish(job, "dead", "Order not found")
+            return
+        if order["payment_status"] != "pending":
+            # Settled by an earlier attempt whose job update was lost
+            await self._finish(job, "done")
+            return
+
+        try:
+            reference = await asyncio.wait_for(self.gateway.charge(order), self.gateway_timeout_seconds)
+        except PaymentDeclined as e:
+            await self._settle(order, "failed", error=str(e))
+            await self._finish(job, "done", str(e))
+        except (PaymentGatewayError, asyncio.TimeoutError) as e:
+            await self._retry_or_dead_letter(job, str(e) or "Gateway timeout", order)
+        else:
+            await self._settle(order, "completed", reference=reference)
+            await self._finish(job, "done")
+
+    async def _settle(self, order: dict, outcome: str, reference: Optional[str] = None, error: Optional[str] = None):
+        now = datetime.utcnow()
+        updates = {"status": outcome, "payment_status": outcome, "updated_at": now}
+        if reference:
+            updates["payment_reference"] = reference
+        if error:
+            updates["payment_error"] = error
+        settled = await self.orders.update_one(
+            {"id": order["id"], "payment_status": "pending"},
+            {"$set": updates}
+        )
+        if settled.modified_count and outcome == "completed":
+            # Only the ordered lines: the cart may have been filled again
+            # while the payment was pending
+            await self.carts.remove_products(order["user_id"], [item["product_id"] for item in order["items"]])
+
+    async def _finish(self, job: dict, status: str, error: Optional[str] = None):
+        await self.jobs.update_one(
+            {"_id": job["_id"], "lease_id": job["lease_id"]},
+            {"$set": {"status": status, "last_error": error, "updated_at": datetime.utcnow()},
+             "$unset": {"lease_id": "", "worker": ""}}
+        )
+
+    async def _retry_or_dead_letter(self, job: dict, error: str, order: Optional[dict] = None):
+        if job["attempts"] >= self.max_attempts:
+            await self._dead_letter(job, error, order)
+        else:
+            await self._retry(job, error)
+
+    async def _dead_letter(self, job: dict, error: str, order: Optional[dict] = None):
+        logger.error("Payment for order %s dead-lettered after %d attempts: %s",
+                     job["order_id"], job["attempts"], error)
+        if order is None:
+            order = await self.orders.find_one({"id": job["order_id"]}, {"_id": 0})
+        if order is not None:
+            await self._settle(order, "failed", error=error)
+        await self._finish(job, "dead", error)
+
+    async def _retry(self, job: dict, error: str):
+        now = datetime.utcnow()
+        await self.jobs.update_one(
+            {"_id": job["_id"], "lease_id": job["lease_id"]},
+            {"$set": {
+                "status": "queued",
+                "last_error": error,
+                "run_at": now + timedelta(seconds=retry_delay(job["attempts"], self.retry_base_seconds, self.retry_max_seconds)),
+                "updated_at": now,
+            }, "$unset": {"lease_id": "", "worker": ""}}
+        )
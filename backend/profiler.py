@@ -0,0 +1,245 @@
+"""Opt-in sampling profiler for live requests.
+
+Off by default: unless PROFILER_ENABLED=true the middleware is not even
+installed. When enabled, a PROFILER_SAMPLE_RATE fraction of requests is
+profiled, plus any request from an admin that sends the
+``X-Debug-Profile: 1`` header.
+
+While a profiled request is in flight, a sampler thread looks at the event
+loop thread every PROFILER_INTERVAL_MS. If the request's code is running,
+the sample is its stack. If the request is suspended, the sample is the
+await chain it is parked on, ending in an ``[await ...]`` frame, so time
+spent waiting on Mongo or the bcrypt pool shows up too. Samples from other
+requests sharing the loop are not attributed to it. The sampler needs the
+GIL, so CPU-bound stretches are sampled at most once per interpreter
+switch interval (5ms by default); it is meant for requests that are slow.
+
+Each profile is written as collapsed stacks (``frame;frame;frame count``,
+readable by speedscope and flamegraph.pl) to PROFILER_DIR, which keeps the
+newest PROFILER_MAX_FILES files. A ranked per-route summary of the hottest
+functions is served at /api/admin/profiles.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from auth import decode_token
+
+logger = logging.getLogger(__name__)
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_HEADER = os.getenv("PROFILER_HEADER", "x-debug-profile").lower().encode()
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "2"))
+PROFILER_DIR = Path(os.getenv("PROFILER_DIR", "/tmp/bgs-profiles"))
+PROFILER_MAX_FILES = int(os.getenv("PROFILER_MAX_FILES", "200"))
+PROFILER_MAX_DEPTH = 128
+
+Stack = Tuple[str, ...]
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    def __init__(self, method: str, route: str, task: asyncio.Task, marker):
+        self.method = method
+        self.route = route
+        self.task = task
+        # Frame of the middleware coroutine; only frames below it belong to the request
+        self.marker = marker
+        self.samples: Counter = Counter()
+        self.started = time.time()
+
+    def running_stack(self, frame) -> Optional[Stack]:
+        labels = []
+        while frame is not None and len(labels) < PROFILER_MAX_DEPTH:
+            if frame is self.marker:
+                return tuple(reversed(labels))
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        return None
+
+    def awaiting_stack(self) -> Optional[Stack]:
+        labels: List[str] = []
+        awaitable = self.task.get_coro()
+        inside = False
+        while awaitable is not None and len(labels) < PROFILER_MAX_DEPTH:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                if inside:
+                    labels.append(f"[await {type(awaitable).__name__}]")
+                break
+            if inside:
+                labels.append(frame_label(frame.f_code))
+            elif frame is self.marker:
+                inside = True
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return tuple(labels) if inside and labels else None
+
+    def sample(self, loop_frame):
+        try:
+            stack = self.running_stack(loop_frame) if loop_frame is not None else None
+            if stack is None:
+                stack = self.awaiting_stack()
+        except (AttributeError, RuntimeError, ValueError):
+            # The loop moved on while we were walking; skip this tick
+            return
+        if stack:
+            self.samples[stack] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RouteProfile:
+    def __init__(self):
+        self.requests = 0
+        self.samples = 0
+        self.self_samples: Counter = Counter()
+        self.inclusive_samples: Counter = Counter()
+
+    def add(self, session: ProfileSession):
+        self.requests += 1
+        for stack, count in session.samples.items():
+            self.samples += count
+            self.self_samples[stack[-1]] += count
+            for label in set(stack):
+                self.inclusive_samples[label] += count
+
+    def top(self, limit: int) -> dict:
+        return {
+            "requests": self.requests,
+            "samples": self.samples,
+            "self": [{"function": f, "samples": n, "share": round(n / self.samples, 4)}
+                     for f, n in self.self_samples.most_common(limit)],
+            "inclusive": [{"function": f, "samples": n, "share": round(n / self.samples, 4)}
+                          for f, n in self.inclusive_samples.most_common(limit)],
+        }
+
+
+class SamplingProfiler:
+    def __init__(self,
+                 interval_ms: float = PROFILER_INTERVAL_MS,
+                 directory: Path = PROFILER_DIR,
+                 max_files: int = PROFILER_MAX_FILES):
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.max_files = max_files
+        self.routes: Dict[Tuple[str, str], RouteProfile] = {}
+        self._sessions: List[ProfileSession] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread_id: Optional[int] = None
+
+    def begin(self, method: str, route: str, marker) -> ProfileSession:
+        session = ProfileSession(method, route, asyncio.current_task(), marker)
+        with self._lock:
+            self._loop_thread_id = threading.get_ident()
+            self._sessions.append(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample_forever, name="request-profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    async def end(self, session: ProfileSession, route: str):
+        with self._lock:
+            self._sessions.remove(session)
+        session.route = route
+        if not session.samples:
+            return
+        profile = self.routes.get((session.method, route))
+        if profile is None:
+            profile = self.routes[(session.method, route)] = RouteProfile()
+        profile.add(session)
+        # The sampler no longer touches the session, so a worker thread can
+        # write it and stat the directory for rotation off the event loop
+        try:
+            await asyncio.to_thread(self._write, session)
+        except OSError:
+            logger.exception("Failed to write request profile")
+
+    def _sample_forever(self):
+        # Runs only while profiled requests are in flight
+        while True:
+            time.sleep(self.interval)
+            # Sampling under the lock keeps end() from reading a session mid-update
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                loop_frame = sys._current_frames().get(self._loop_thread_id)
+                for session in self._sessions:
+                    session.sample(loop_frame)
+
+    def _write(self, session: ProfileSession):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(session.started))
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{session.method}{session.route}").strip("_")
+        path = self.directory / f"{stamp}-{int(session.started * 1000) % 1000:03d}-{slug}-{id(session):x}.collapsed"
+        path.write_text(session.collapsed())
+
+        profiles = sorted(self.directory.glob("*.collapsed"), key=lambda p: p.stat().st_mtime)
+        for old in profiles[:max(0, len(profiles) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+    def summary(self, limit: int = 20) -> dict:
+        return {
+            f"{method} {route}": profile.top(limit)
+            for (method, route), profile in sorted(self.routes.items())
+        }
+
+
+profiler = SamplingProfiler()
+
+
+def _is_admin_request(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            claims = decode_token(token.strip()) if scheme.lower() == "bearer" else None
+            return bool(claims) and claims.get("role") == "admin"
+    return False
+
+
+class ProfilerMiddleware:
+    """Installed only when PROFILER_ENABLED=true"""
+
+    def __init__(self,
+                 app,
+                 profiler: SamplingProfiler = profiler,
+                 sample_rate: float = PROFILER_SAMPLE_RATE,
+                 header: bytes = PROFILER_HEADER):
+        self.app = app
+        self.profiler = profiler
+        self.sample_rate = sample_rate
+        self.header = header
+
+    def _wants_profile(self, scope) -> bool:
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        for name, value in scope["headers"]:
+            if name == self.header and value not in (b"", b"0"):
+                return _is_admin_request(scope)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        session = self.profiler.begin(scope["method"], scope["path"], sys._getframe())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            await self.profiler.end(session, route)
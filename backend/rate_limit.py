@@ -0,0 +1,250 @@
+"""Admission control for the expensive endpoints.
+
+Login and registration hash passwords and checkout writes orders, so they
+are guarded by token buckets keyed on the client IP and, where a bearer
+token is present, on the user. A cap on concurrently running guarded
+requests sheds load with a 503 before they can starve catalog browsing,
+which is never limited.
+
+Buckets live in process memory; set RATE_LIMIT_STORE=mongo to share them
+between workers through the ``rate_limits`` collection.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from auth import decode_token
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Guarded requests allowed to run at once across all guarded routes
+RATE_LIMIT_MAX_INFLIGHT = int(os.getenv("RATE_LIMIT_MAX_INFLIGHT", "64"))
+# Only enable behind a proxy that sets X-Forwarded-For
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+
+class Limit:
+    __slots__ = ("key", "per_minute", "burst")
+
+    def __init__(self, key: str, per_minute: float, burst: int):
+        # key is "ip" or "user"; "user" falls back to the IP for anonymous requests
+        self.key = key
+        self.per_minute = per_minute
+        self.burst = burst
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+
+# (method, path) -> limits that all have to admit the request
+RATE_LIMIT_RULES: Dict[Tuple[str, str], List[Limit]] = {
+    ("POST", "/api/auth/login"): [Limit("ip", 10, 10)],
+    ("POST", "/api/auth/register"): [Limit("ip", 5, 5)],
+    ("POST", "/api/orders"): [Limit("user", 10, 5), Limit("ip", 30, 10)],
+    ("POST", "/api/cart/add"): [Limit("user", 120, 30)],
+}
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [tokens, last refill (monotonic)]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0.0
+        return False, (1 - bucket[0]) / rate
+
+    async def give(self, key: str, burst: int):
+        """Return a token taken for a request that was rejected by another limit"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(burst, bucket[0] + 1)
+
+
+class MongoBucketStore:
+    """Buckets shared by every worker, refilled and taken in one atomic update"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.rate_limits
+
+    async def take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        now = datetime.utcnow()
+        # Idle buckets are full again after burst / rate seconds; the TTL index drops them
+        expires_at = now + timedelta(seconds=burst / rate)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]},
+                    "updated_at": now,
+                    "expires_at": expires_at,
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["allowed"]:
+            return True, 0.0
+        return False, (1 - doc["tokens"]) / rate
+
+    async def give(self, key: str, burst: int):
+        await self.collection.update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [burst, {"$add": ["$tokens", 1]}]}}}]
+        )
+
+
+class RateLimiter:
+    def __init__(self,
+                 rules: Dict[Tuple[str, str], List[Limit]] = RATE_LIMIT_RULES,
+                 max_inflight: int = RATE_LIMIT_MAX_INFLIGHT,
+                 trust_forwarded: bool = RATE_LIMIT_TRUST_FORWARDED):
+        self.rules = rules
+        self.max_inflight = max_inflight
+        self.trust_forwarded = trust_forwarded
+        self.local_store = MemoryBucketStore()
+        self.store = self.local_store
+        self.inflight = 0
+        self.limited = 0
+        self.shed = 0
+
+    def use_store(self, store):
+        self.store = store
+
+    def reset_store(self):
+        self.store = self.local_store
+
+    def client_ip(self, scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def user_id(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    # decode_token is cached, so this costs a dict lookup per request
+                    claims = decode_token(token.strip())
+                    return claims["sub"] if claims else None
+        return None
+
+    async def check(self, scope, limits: List[Limit]) -> Tuple[bool, float]:
+        route = f"{scope['method']} {scope['path']}"
+        ip = self.client_ip(scope)
+        user_id = None
+        taken = []
+        for limit in limits:
+            if limit.key == "user":
+                user_id = user_id or self.user_id(scope)
+            identity = f"user:{user_id}" if limit.key == "user" and user_id else f"ip:{ip}"
+            key = f"{route}|{identity}"
+            store = self.store
+            try:
+                allowed, wait = await store.take(key, limit.rate, limit.burst)
+            except Exception:
+                # The shared store being down must not take checkout with it
+                logger.exception("Rate limit store failed; using the local buckets")
+                store = self.local_store
+                allowed, wait = await store.take(key, limit.rate, limit.burst)
+            if not allowed:
+                # A rejected request costs nothing: the limits that admitted it get their token back
+                await self._refund(taken)
+                return False, wait
+            taken.append((store, key, limit.burst))
+        return True, 0.0
+
+    async def _refund(self, taken: list):
+        for store, key, burst in taken:
+            try:
+                await store.give(key, burst)
+            except Exception:
+                logger.exception("Failed to refund a rate limit token")
+
+
+# Shared by the middleware and the service container, which attaches the Mongo store
+rate_limiter = RateLimiter()
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float):
+    body = fast_json.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter = rate_limiter, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.limiter = limiter
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limits = self.limiter.rules.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if limits is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        if limiter.inflight >= limiter.max_inflight:
+            limiter.shed += 1
+            await _reject(send, 503, "Server busy, please retry", 1)
+            return
+
+        # Take the slot before awaiting the bucket store, so requests that
+        # arrive while others are being checked still see the cap
+        limiter.inflight += 1
+        try:
+            allowed, retry_after = await limiter.check(scope, limits)
+            if not allowed:
+                limiter.limited += 1
+                await _reject(send, 429, "Too many requests", retry_after)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            limiter.inflight -= 1
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from auth import require_role
+from profiler import PROFILER_ENABLED, profiler
+from slow_queries import slow_query_log
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_role("admin"))])
+
+@router.get("/profiles", response_model=dict)
+async def get_profile_summary(limit: int = Query(20, ge=1, le=200)):
+    """Hottest functions per route across the sampled requests"""
+    return {"enabled": PROFILER_ENABLED, "routes": profiler.summary(limit)}
+
+@router.get("/slow-queries", response_model=dict)
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order: str = Query("total_ms", pattern="^(total_ms|max_ms|count)$"),
+    recent: int = Query(20, ge=0, le=200)
+):
+    """Slowest MongoDB query shapes with their origins and captured explain plans"""
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "shapes": slow_query_log.top(limit, order),
+        "recent": slow_query_log.recent_entries(recent) if recent else [],
+    }
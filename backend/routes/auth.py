@@ -1,23 +1,21 @@
 from fastapi import APIRouter, HTTPException, status, Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from container import ServiceContainer, get_services
 from models.user import UserService, UserCreate, UserLogin, UserResponse
-from auth import create_access_token, get_current_user_id
+from auth import create_user_access_token, get_current_user_id
+from password_hasher import PasswordHasherBusy
 from datetime import timedelta
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
-async def get_user_service(db: AsyncIOMotorDatabase = Depends(lambda: None)) -> UserService:
-    # This will be injected in the main server file
-    return UserService(db)
+async def get_user_service(services: ServiceContainer = Depends(get_services)) -> UserService:
+    return services.users
 
 @router.post("/register", response_model=dict)
 async def register(user_data: UserCreate, user_service: UserService = Depends(get_user_service)):
     try:
         user = await user_service.create_user(user_data)
         access_token_expires = timedelta(minutes=30)
-        access_token = create_access_token(
-            data={"sub": user.id}, expires_delta=access_token_expires
-        )
+        access_token = create_user_access_token(user, expires_delta=access_token_expires)
         
         user_response = UserResponse(
             id=user.id,
@@ -37,10 +35,23 @@ async def register(user_data: UserCreate, user_service: UserService = Depends(ge
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
+    except PasswordHasherBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
 
 @router.post("/login", response_model=dict)
 async def login(login_data: UserLogin, user_service: UserService = Depends(get_user_service)):
-    user = await user_service.authenticate_user(login_data.email, login_data.password)
+    try:
+        user = await user_service.authenticate_user(login_data.email, login_data.password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -48,9 +59,7 @@ async def login(login_data: UserLogin, user_service: UserService = Depends(get_u
         )
     
     access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     user_response = UserResponse(
         id=user.id,
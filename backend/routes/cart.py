@@ -1,13 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from fastapi import APIRouter, HTTPException, status, Depends, Header
+from typing import Optional
+from container import ServiceContainer, get_idempotency_store, get_services
+from idempotency import IdempotencyStore, idempotent_response
+import fast_json
 from models.cart import CartService, CartResponse, AddToCartRequest, UpdateCartRequest
 from auth import get_current_user_id
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
-async def get_cart_service(db: AsyncIOMotorDatabase = Depends(lambda: None)) -> CartService:
-    # This will be injected in the main server file
-    return CartService(db)
+async def get_cart_service(services: ServiceContainer = Depends(get_services)) -> CartService:
+    return services.carts
 
 @router.get("", response_model=CartResponse)
 async def get_cart(
@@ -19,10 +21,12 @@ async def get_cart(
 @router.post("/add", response_model=dict)
 async def add_to_cart(
     request: AddToCartRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user_id: str = Depends(get_current_user_id),
-    cart_service: CartService = Depends(get_cart_service)
+    cart_service: CartService = Depends(get_cart_service),
+    idempotency: IdempotencyStore = Depends(get_idempotency_store)
 ):
-    try:
+    async def add() -> dict:
         success = await cart_service.add_to_cart(
             current_user_id, 
             request.productId, 
@@ -35,6 +39,22 @@ async def add_to_cart(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to add item to cart"
             )
+
+    async def add_once() -> bytes:
+        return fast_json.dumps(await add())
+
+    try:
+        if idempotency_key is None:
+            return await add()
+        # A retried add must not increment the quantity twice
+        return await idempotent_response(
+            idempotency,
+            "cart-add",
+            current_user_id,
+            idempotency_key,
+            request.model_dump(mode="json"),
+            add_once
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, Request
+from starlette.responses import Response
+from catalog_snapshot import CatalogSnapshot
+from conditional import CATALOG_CACHE_CONTROL, is_not_modified, not_modified
+from container import ServiceContainer, get_services
+
+router = APIRouter(prefix="/catalog", tags=["catalog"])
+
+async def get_catalog_snapshot(services: ServiceContainer = Depends(get_services)) -> CatalogSnapshot:
+    return services.catalog_snapshot
+
+def accepts_gzip(request: Request) -> bool:
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = params.strip()
+            try:
+                return not quality.startswith("q=") or float(quality[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+@router.get("/snapshot")
+async def get_catalog_snapshot_bundle(
+    request: Request,
+    snapshot: CatalogSnapshot = Depends(get_catalog_snapshot)
+):
+    """All products, categories with counts and active testimonials in one bundle"""
+    bundle = await snapshot.get()
+    gzipped = accepts_gzip(request)
+    etag = bundle.gzip_etag if gzipped else bundle.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CATALOG_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+        "X-Catalog-Version": bundle.version,
+    }
+    if is_not_modified(request, etag):
+        return not_modified(headers)
+
+    # Both encodings are stored ready-made; nothing is serialized or compressed here
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(bundle.gzipped, media_type="application/json", headers=headers)
+    return Response(bundle.body, media_type="application/json", headers=headers)
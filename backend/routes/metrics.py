@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import metrics, render_password_hasher
+from password_hasher import password_hasher
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, database, event loop and password hashing metrics"""
+    body = metrics.render() + render_password_hasher(password_hasher.stats())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,35 +1,77 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from models.order import OrderService, OrderCreate, OrderResponse, OrdersListResponse
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+from container import ServiceContainer, get_idempotency_store, get_services
+from idempotency import IdempotencyStore, idempotent_response
+from models.order import OrderService, OrderCreate, OrderResponse, OrdersListResponse, OrderSummariesListResponse, PaymentStatusResponse
 from auth import get_current_user_id
+from typing import Optional, Union
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-async def get_order_service(db: AsyncIOMotorDatabase = Depends(lambda: None)) -> OrderService:
-    # This will be injected in the main server file
-    return OrderService(db)
+async def get_order_service(services: ServiceContainer = Depends(get_services)) -> OrderService:
+    return services.orders
 
 @router.post("", response_model=OrderResponse)
 async def create_order(
     order_data: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user_id: str = Depends(get_current_user_id),
-    order_service: OrderService = Depends(get_order_service)
+    order_service: OrderService = Depends(get_order_service),
+    idempotency: IdempotencyStore = Depends(get_idempotency_store)
 ):
     try:
-        order = await order_service.create_order(current_user_id, order_data)
-        return order
+        if idempotency_key is None:
+            return await order_service.create_order(current_user_id, order_data)
+
+        async def place_order() -> bytes:
+            order = await order_service.create_order(current_user_id, order_data)
+            return order.model_dump_json().encode()
+
+        return await idempotent_response(
+            idempotency,
+            "orders",
+            current_user_id,
+            idempotency_key,
+            order_data.model_dump(mode="json"),
+            place_order
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
 
-@router.get("", response_model=OrdersListResponse)
+@router.get("", response_model=Union[OrdersListResponse, OrderSummariesListResponse])
 async def get_user_orders(
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Page size; omit for the full history"),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor from the previous page"),
+    view: str = Query("full", pattern="^(full|summary)$", description="full, or summary without items and addresses"),
+    current_user_id: str = Depends(get_current_user_id),
+    order_service: OrderService = Depends(get_order_service)
+):
+    try:
+        return await order_service.get_user_orders(
+            current_user_id,
+            limit=limit,
+            cursor=cursor,
+            summary=view == "summary"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+@router.get("/stream")
+async def stream_user_orders(
+    view: str = Query("full", pattern="^(full|summary)$", description="full, or summary without items and addresses"),
     current_user_id: str = Depends(get_current_user_id),
     order_service: OrderService = Depends(get_order_service)
 ):
-    return await order_service.get_user_orders(current_user_id)
+    return StreamingResponse(
+        order_service.stream_user_orders(current_user_id, summary=view == "summary"),
+        media_type="application/x-ndjson"
+    )
 
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(
@@ -43,4 +85,18 @@ async def get_order(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
-    return order
\ No newline at end of file
+    return order
+
+@router.get("/{order_id}/payment", response_model=PaymentStatusResponse)
+async def get_payment_status(
+    order_id: str,
+    current_user_id: str = Depends(get_current_user_id),
+    order_service: OrderService = Depends(get_order_service)
+):
+    payment_status = await order_service.get_payment_status(current_user_id, order_id)
+    if not payment_status:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found"
+        )
+    return payment_status
@@ -1,44 +1,87 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from container import ServiceContainer, get_services
 from models.product import ProductService, ProductsListResponse, ProductResponse, CategoryResponse
+from fast_json import JSONBytesResponse
+from conditional import caching_headers, is_not_modified, make_etag, not_modified, query_key
 from typing import Optional, List
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-async def get_product_service(db: AsyncIOMotorDatabase = Depends(lambda: None)) -> ProductService:
-    # This will be injected in the main server file
-    return ProductService(db)
+async def get_product_service(services: ServiceContainer = Depends(get_services)) -> ProductService:
+    return services.products
 
 @router.get("", response_model=ProductsListResponse)
 async def get_products(
+    request: Request,
     category: Optional[str] = Query(None, description="Filter by category"),
     search: Optional[str] = Query(None, description="Search in name and description"),
-    sort: str = Query("name", description="Sort by: name, price-low, price-high, rating"),
+    sort: Optional[str] = Query(None, description="Sort by: relevance, name, price-low, price-high, rating (default: relevance when searching, otherwise name)"),
     page: int = Query(1, ge=1, description="Page number"),
     limit: int = Query(20, ge=1, le=100, description="Items per page"),
+    paginate: str = Query("page", pattern="^(page|cursor)$", description="Pagination mode: page or cursor"),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor from the previous page (implies cursor mode)"),
+    include_total: bool = Query(False, description="Cursor mode only: include an approximate total"),
     product_service: ProductService = Depends(get_product_service)
 ):
-    return await product_service.get_products(
-        category=category,
-        search=search,
-        sort=sort,
-        page=page,
-        limit=limit
-    )
+    # Answer revalidations from the in-memory catalog version alone
+    headers = {}
+    validators = await product_service.catalog_validators()
+    if validators is not None:
+        version, last_modified = validators
+        etag = make_etag("products", version, query_key(request))
+        headers = caching_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(headers)
+
+    try:
+        page_result = await product_service.get_product_page(
+            category=category,
+            search=search,
+            sort=sort,
+            page=page,
+            limit=limit,
+            cursor=cursor,
+            paginate=paginate,
+            include_total=include_total
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    # Catalog items are pre-serialized; skip response_model re-validation
+    return JSONBytesResponse(page_result.to_json(), headers=headers)
 
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: str,
+    request: Request,
     product_service: ProductService = Depends(get_product_service)
 ):
-    product = await product_service.get_product_by_id(product_id)
-    if not product:
+    entry = await product_service.get_product_entry(product_id)
+    if entry is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
-    return product
+
+    last_modified = entry.doc.get("updated_at")
+    etag = make_etag("product", product_id, str(last_modified))
+    headers = caching_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(headers)
+    return JSONBytesResponse(entry.json, headers=headers)
 
 @router.get("/categories/all", response_model=List[CategoryResponse])
-async def get_categories(product_service: ProductService = Depends(get_product_service)):
-    return await product_service.get_categories()
\ No newline at end of file
+async def get_categories(
+    request: Request,
+    response: Response,
+    product_service: ProductService = Depends(get_product_service)
+):
+    categories, version, last_modified = await product_service.get_categories_with_validators()
+    etag = make_etag("categories", version)
+    headers = caching_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return categories
\ No newline at end of file
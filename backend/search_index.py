@@ -0,0 +1,126 @@
+import math
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Longest suffixes first so "ations" wins over "s"
+SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ied", "ers", "er", "ed", "es", "ly", "s")
+MIN_STEM_LENGTH = 3
+
+# Field weights applied to term frequencies
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+FEATURES_WEIGHT = 0.5
+
+# Score multiplier for terms reached through prefix expansion
+PREFIX_WEIGHT = 0.7
+MAX_PREFIX_EXPANSIONS = 50
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def stem(token: str) -> str:
+    """Light suffix-stripping stemmer, enough to fold plurals and verb forms"""
+    if len(token) <= MIN_STEM_LENGTH or token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            token = token[:-len(suffix)]
+            if suffix in ("ies", "ied"):
+                token += "y"
+            break
+    if token.endswith("e") and len(token) > MIN_STEM_LENGTH:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index over product names, descriptions and features.
+
+    Ranking is BM25 over field-weighted term frequencies. Every query token
+    must match (exactly after stemming, or as a prefix of an indexed term).
+    """
+
+    def __init__(self, docs: Iterable[dict]):
+        self.ids: List[str] = []
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        lengths = []
+
+        for doc in docs:
+            index = len(self.ids)
+            self.ids.append(doc["id"])
+            frequencies: Dict[str, float] = defaultdict(float)
+            for text, weight in (
+                (doc.get("name", ""), NAME_WEIGHT),
+                (doc.get("description", ""), DESCRIPTION_WEIGHT),
+                (" ".join(doc.get("features", [])), FEATURES_WEIGHT),
+            ):
+                for token in tokenize(text):
+                    frequencies[stem(token)] += weight
+            for term, frequency in frequencies.items():
+                self.postings[term][index] = frequency
+            lengths.append(sum(frequencies.values()))
+
+        self.postings = dict(self.postings)
+        self.vocabulary = sorted(self.postings)
+        self.lengths = lengths
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """Map a query token to the indexed terms it matches and their weights"""
+        stemmed = stem(token)
+        terms = {}
+        if stemmed in self.postings:
+            terms[stemmed] = 1.0
+
+        for prefix in {stemmed, token}:
+            start = bisect_left(self.vocabulary, prefix)
+            for term in self.vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+                if not term.startswith(prefix):
+                    break
+                terms.setdefault(term, PREFIX_WEIGHT)
+        return terms
+
+    def _bm25(self, term: str, index: int, frequency: float) -> float:
+        df = len(self.postings[term])
+        idf = math.log(1 + (len(self.ids) - df + 0.5) / (df + 0.5))
+        length_ratio = self.lengths[index] / self.average_length if self.average_length else 1.0
+        norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio)
+        return idf * frequency * (BM25_K1 + 1) / norm
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """Return (product_id, score) pairs for all matches, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores: Dict[int, float] = {}
+        for position, token in enumerate(tokens):
+            token_scores: Dict[int, float] = {}
+            for term, weight in self._expand(token).items():
+                for index, frequency in self.postings[term].items():
+                    score = weight * self._bm25(term, index, frequency)
+                    if score > token_scores.get(index, 0.0):
+                        token_scores[index] = score
+
+            if position == 0:
+                scores = token_scores
+            else:
+                scores = {
+                    index: score + token_scores[index]
+                    for index, score in scores.items()
+                    if index in token_scores
+                }
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.ids[item[0]]))
+        return [(self.ids[index], score) for index, score in ranked]
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
@@ -14,13 +15,39 @@ from datetime import datetime
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Imported after load_dotenv so module-level settings see .env values
+from container import ServiceContainer, get_db
+from rate_limit import RateLimitMiddleware
+from metrics import MetricsMiddleware
+from profiler import PROFILER_ENABLED, ProfilerMiddleware
+from routes.admin import router as admin_router
+from routes.auth import router as auth_router
+from routes.cart import router as cart_router
+from routes.catalog import router as catalog_router
+from routes.metrics import router as metrics_router
+from routes.orders import router as orders_router
+from routes.products import router as products_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled MongoDB client and long-lived services for the whole app.
+    # launcher.py sets WORKER_INDEX after forking, so it is read here rather
+    # than at import; only the first worker runs the database upkeep
+    services = ServiceContainer(
+        os.environ['MONGO_URL'],
+        os.environ['DB_NAME'],
+        maintenance=os.environ.get('WORKER_INDEX', '0') == '0'
+    )
+    app.state.services = services
+    await services.start()
+    try:
+        yield
+    finally:
+        await services.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -41,20 +68,35 @@ async def root():
     return {"message": "Hello World"}
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
+async def get_status_checks(db: AsyncIOMotorDatabase = Depends(get_db)):
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+api_router.include_router(auth_router)
+api_router.include_router(products_router)
+api_router.include_router(cart_router)
+api_router.include_router(orders_router)
+api_router.include_router(catalog_router)
+api_router.include_router(metrics_router)
+api_router.include_router(admin_router)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Not installed at all unless enabled, so it costs nothing by default
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Added before CORS so throttled responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -63,13 +105,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so latency covers the whole stack including throttled requests
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
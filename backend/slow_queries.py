@@ -0,0 +1,251 @@
+"""Slow MongoDB command log with one-off explain capture.
+
+Commands slower than SLOW_QUERY_MS are logged with their normalized shape
+(field names and operators kept, values replaced by "?"), the service
+method that issued them and their duration. The first time a shape is
+slow, it is explained with ``executionStats`` in the background; later
+occurrences only update its counters. GET /api/admin/slow-queries lists
+the worst shapes.
+
+Service methods are tagged with @query_origin; the tag travels in a
+context variable, which Motor copies into the thread that runs the command.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+
+from indexes import plan_stages
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_RECENT = int(os.getenv("SLOW_QUERY_RECENT", "200"))
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", "1000"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+
+# Commands that can be explained, mapped to the field holding their filter
+EXPLAINABLE = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "update": "updates",
+    "delete": "deletes",
+}
+# Session and cluster bookkeeping that explain must not repeat
+DRIVER_FIELDS = ("lsid", "$clusterTime", "$db", "$readPreference", "txnNumber", "signature", "autocommit", "startTransaction")
+
+current_query_origin: ContextVar[Optional[str]] = ContextVar("current_query_origin", default=None)
+
+
+def query_origin(func):
+    """Attribute the Mongo commands issued by a service method to it"""
+    name = func.__qualname__
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            token = current_query_origin.set(name)
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            finally:
+                current_query_origin.reset(token)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_query_origin.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_query_origin.reset(token)
+    return wrapper
+
+
+def normalize(value: Any) -> Any:
+    """Keep the structure of a filter/pipeline and drop its values"""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        # Lists of stages or clauses keep their shape; value lists ($in) collapse
+        if value and all(isinstance(item, dict) for item in value):
+            return [normalize(item) for item in value]
+        return "?"
+    return "?"
+
+
+def command_shape(command_name: str, command: dict) -> Optional[dict]:
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        return None
+    shape: Dict[str, Any] = {"command": command_name, "collection": collection}
+    if command_name in ("update", "delete"):
+        statements = command.get(EXPLAINABLE[command_name]) or []
+        shape["filter"] = [normalize(statement.get("q", {})) for statement in statements[:1]]
+    elif command_name in EXPLAINABLE:
+        shape["filter"] = normalize(command.get(EXPLAINABLE[command_name], {}))
+    for key in ("sort", "projection", "hint"):
+        if key in command:
+            # Sort directions are part of the shape, not values
+            shape[key] = dict(command[key]) if key == "sort" else normalize(command[key])
+    if command.get("skip"):
+        shape["skip"] = "?"
+    return shape
+
+
+def summarize_explain(explain: dict) -> dict:
+    planner = explain.get("queryPlanner") or {}
+    stats = explain.get("executionStats") or {}
+    if not planner and explain.get("stages"):
+        # Aggregations nest the find explain in their first stage
+        first = explain["stages"][0].get("$cursor", {})
+        planner = first.get("queryPlanner") or {}
+        stats = first.get("executionStats") or {}
+    stages = plan_stages(planner.get("winningPlan", {})) if planner else []
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "n_returned": stats.get("nReturned"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+class ShapeStats:
+    def __init__(self, shape_key: str, shape: dict):
+        self.shape_key = shape_key
+        self.shape = shape
+        self.origins: Dict[str, int] = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        self.explain: Optional[dict] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "shape": self.shape,
+            "origins": dict(sorted(self.origins.items(), key=lambda item: -item[1])),
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "last_seen": self.last_seen,
+            "explain": self.explain,
+        }
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self,
+                 threshold_ms: float = SLOW_QUERY_MS,
+                 recent_size: int = SLOW_QUERY_RECENT,
+                 max_shapes: int = SLOW_QUERY_MAX_SHAPES,
+                 explain: bool = SLOW_QUERY_EXPLAIN):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.explain_enabled = explain
+        self.shapes: Dict[str, ShapeStats] = {}
+        self.recent: deque = deque(maxlen=recent_size)
+        # (connection, request id) -> (command, origin, database) while in flight
+        self._pending: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, client, loop: asyncio.AbstractEventLoop):
+        """Give the log a client and loop to run explains on"""
+        self._client = client
+        self._loop = loop
+
+    def detach(self):
+        self._client = None
+        self._loop = None
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name == "explain":
+            return
+        self._pending[(event.connection_id, event.request_id)] = (
+            event.command, current_query_origin.get(), event.database_name
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event)
+
+    def _finish(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+        command, origin, database = pending
+        self.record(event.command_name, command, origin or "unknown", database, duration_ms)
+
+    def record(self, command_name: str, command: dict, origin: str, database: str, duration_ms: float):
+        shape = command_shape(command_name, command) or {"command": command_name}
+        shape_key = json.dumps(shape, sort_keys=True, default=str)
+        now = time.time()
+
+        with self._lock:
+            stats = self.shapes.get(shape_key)
+            is_new = stats is None
+            if is_new:
+                if len(self.shapes) >= self.max_shapes:
+                    # Forget the shape seen longest ago
+                    oldest = min(self.shapes.values(), key=lambda s: s.last_seen)
+                    del self.shapes[oldest.shape_key]
+                stats = self.shapes[shape_key] = ShapeStats(shape_key, shape)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.last_seen = now
+            stats.origins[origin] = stats.origins.get(origin, 0) + 1
+            self.recent.append({"at": now, "origin": origin, "duration_ms": round(duration_ms, 3), "shape": shape})
+
+        logger.warning("Slow %s on %s: %.1fms from %s %s", command_name, shape.get("collection", "?"),
+                       duration_ms, origin, shape_key)
+
+        if is_new and self.explain_enabled and command_name in EXPLAINABLE and self._loop is not None:
+            explained = {k: v for k, v in command.items() if k not in DRIVER_FIELDS}
+            # The listener runs on Motor's executor threads; explain from the loop
+            self._loop.call_soon_threadsafe(self._schedule_explain, stats, database, explained)
+
+    def _schedule_explain(self, stats: ShapeStats, database: str, command: dict):
+        asyncio.ensure_future(self._explain(stats, database, command))
+
+    async def _explain(self, stats: ShapeStats, database: str, command: dict):
+        client = self._client
+        if client is None:
+            return
+        try:
+            explain = await client[database].command({"explain": command, "verbosity": "executionStats"})
+        except Exception as e:
+            stats.explain = {"error": str(e)}
+            return
+        stats.explain = summarize_explain(explain)
+
+    def top(self, limit: int = 20, order: str = "total_ms") -> List[dict]:
+        with self._lock:
+            shapes = sorted(self.shapes.values(), key=lambda s: getattr(s, order), reverse=True)[:limit]
+            return [s.as_dict() for s in shapes]
+
+    def recent_entries(self, limit: int = 50) -> List[dict]:
+        with self._lock:
+            return list(self.recent)[-limit:][::-1]
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,94 @@
+"""CPU cost of rendering a product listing: response_model path vs fast path.
+
+The baseline mirrors what FastAPI did per request before the fast path:
+build a ProductResponse per document, wrap them in ProductsListResponse,
+re-validate through the route's response_model and JSON-encode the result.
+The fast path splices the JSON bytes cached on each catalog entry.
+
+    python tests/bench_catalog_serialization.py [--products 100] [--requests 2000]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from catalog_cache import CatalogCache  # noqa: E402
+from models.product import (  # noqa: E402
+    ProductPage,
+    ProductsListResponse,
+    product_json_from_response,
+    product_response_from_doc,
+)
+
+
+def make_docs(count: int) -> list:
+    return [
+        {
+            "id": f"product-{i}",
+            "name": f"Product {i}",
+            "category": "Office Suite",
+            "price": 1000.0 + i,
+            "original_price": 1500.0 + i,
+            "description": "Genuine lifetime license with instant digital delivery. " * 3,
+            "features": ["Lifetime license", "Instant delivery", "Free support", "Genuine key"],
+            "image": f"https://example.com/images/{i}.jpg",
+            "in_stock": True,
+            "rating": 4.5,
+            "reviews": 100 + i,
+            "is_monthly": False,
+        }
+        for i in range(count)
+    ]
+
+
+async def baseline(docs: list, field) -> bytes:
+    products = [product_response_from_doc(doc) for doc in docs]
+    content = ProductsListResponse(products=products, total=len(docs), page=1, total_pages=1)
+    encoded = await serialize_response(field=field, response_content=content)
+    return JSONResponse(encoded).body
+
+
+def fast_path(entries: list) -> bytes:
+    return ProductPage(entries, total=len(entries), page=1, total_pages=1).to_json()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    docs = make_docs(args.products)
+    cache = CatalogCache(product_response_from_doc, product_json_from_response, max_entries=args.products)
+    entries = [cache._store(dict(doc)) for doc in docs]
+    field = create_response_field(name="response", type_=ProductsListResponse, mode="serialization")
+
+    # Both paths must produce the same document
+    assert json.loads(await baseline(docs, field)) == json.loads(fast_path(entries))
+
+    started = time.process_time()
+    for _ in range(args.requests):
+        await baseline(docs, field)
+    baseline_cpu = (time.process_time() - started) / args.requests
+
+    started = time.process_time()
+    for _ in range(args.requests):
+        fast_path(entries)
+    fast_cpu = (time.process_time() - started) / args.requests
+
+    print(f"{args.products} products, {args.requests} renders")
+    print(f"response_model path: {baseline_cpu * 1e6:9.1f} us CPU/request")
+    print(f"fast path:           {fast_cpu * 1e6:9.1f} us CPU/request")
+    print(f"saving:              {(baseline_cpu - fast_cpu) * 1e6:9.1f} us ({baseline_cpu / fast_cpu:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,329 @@
+"""Endpoint latency and throughput benchmark.
+
+Seeds a synthetic catalog, users, carts and orders, drives the FastAPI app
+in-process with concurrent async clients and reports throughput and
+p50/p95/p99 latency per endpoint as JSON. With a baseline file, runs whose
+p95 or throughput are worse than the baseline by more than the threshold
+are reported as regressions and the script exits with status 1.
+
+Runs against a local mongod (--mongo-url, a throwaway database is created
+and dropped) or, with --backend memory, against mongomock-motor when it is
+installed. Numbers from the two backends are not comparable; keep one
+baseline per backend and machine.
+
+    python tests/bench_endpoints.py --mongo-url mongodb://localhost:27017
+    python tests/bench_endpoints.py --backend memory --write-baseline tests/benchmarks/memory.json
+    python tests/bench_endpoints.py --backend memory --baseline tests/benchmarks/memory.json --threshold 0.25
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# The benchmark measures the handlers, not admission control
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from auth import create_user_access_token  # noqa: E402
+from container import ServiceContainer  # noqa: E402
+from models.cart import Cart, build_line, cart_totals  # noqa: E402
+from models.order import Order, OrderItem, ShippingAddress  # noqa: E402
+from models.product import catalog_cache, category_from_record, product_from_record  # noqa: E402
+from models.user import User  # noqa: E402
+from password_hasher import password_hasher  # noqa: E402
+
+# Per-request access logs would dominate the output
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+CATEGORIES = ["Office Suite", "Operating System", "Antivirus", "Design", "Developer Tools", "Utilities"]
+ENDPOINTS = ["GET /api/products", "GET /api/cart", "POST /api/cart/add", "POST /api/orders"]
+
+SHIPPING_ADDRESS = {
+    "firstName": "Bench", "lastName": "Mark", "email": "bench@example.com", "phone": "9999999999",
+    "address": "1 Load Street", "city": "Chennai", "state": "TN", "pincode": "600001",
+}
+
+
+class BenchConfig:
+    def __init__(self,
+                 products: int = 500,
+                 users: int = 50,
+                 cart_items: int = 3,
+                 orders_per_user: int = 20,
+                 concurrency: int = 20,
+                 requests: int = 500,
+                 seed: int = 42):
+        self.products = products
+        self.users = users
+        self.cart_items = cart_items
+        self.orders_per_user = orders_per_user
+        self.concurrency = concurrency
+        self.requests = requests
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def synthetic_products(count: int, rng: random.Random) -> List[dict]:
+    return [
+        {
+            "id": f"bench-{i}",
+            "name": f"Bench Product {i:05d}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "price": round(rng.uniform(199, 49999), 2),
+            "originalPrice": round(rng.uniform(50000, 99999), 2),
+            "description": "Genuine lifetime license with instant digital delivery and free support.",
+            "features": ["Lifetime license", "Instant delivery", "Free support"],
+            "image": f"https://example.com/images/{i}.jpg",
+            "inStock": True,
+            "rating": round(rng.uniform(3, 5), 1),
+            "reviews": rng.randint(0, 5000),
+        }
+        for i in range(count)
+    ]
+
+
+async def seed(services: ServiceContainer, config: BenchConfig, rng: random.Random) -> List[dict]:
+    """Write the synthetic data set; returns the users with their bearer tokens"""
+    db = services.db
+    products = [product_from_record(p).dict() for p in synthetic_products(config.products, rng)]
+    await db.products.insert_many(products)
+    await db.categories.insert_many([
+        category_from_record({"id": str(i), "name": name, "description": name, "icon": "box"}).dict()
+        for i, name in enumerate(CATEGORIES)
+    ])
+    await services.products.refresh_category_counts()
+    catalog_cache.invalidate()
+
+    # One hash for everyone: bcrypt cost is not what this benchmark measures
+    password = password_hasher.context.hash("benchmark")
+    users, carts, orders = [], [], []
+    now = datetime.utcnow()
+    for i in range(config.users):
+        user = User(name=f"Bench User {i}", email=f"bench{i}@example.com", password=password)
+        users.append({"id": user.id, "token": create_user_access_token(user)})
+
+        picked = rng.sample(products, min(config.cart_items, len(products)))
+        lines = [build_line(p, 1) for p in picked]
+        total, item_count = cart_totals(lines)
+        carts.append(Cart(user_id=user.id, items=lines, total=total, item_count=item_count).dict())
+        for n in range(config.orders_per_user):
+            items = [
+                OrderItem(product_id=p["id"], name=p["name"], price=p["price"], quantity=1, image=p["image"])
+                for p in rng.sample(products, min(2, len(products)))
+            ]
+            created_at = now - timedelta(hours=n)
+            orders.append(Order(
+                user_id=user.id,
+                items=items,
+                total=sum(item.price for item in items),
+                status="completed",
+                payment_status="completed",
+                shipping_address=ShippingAddress(**SHIPPING_ADDRESS),
+                payment_method="card",
+                created_at=created_at,
+                updated_at=created_at,
+            ).dict())
+        await db.users.insert_one(user.dict())
+
+    await db.carts.insert_many(carts)
+    if orders:
+        await db.orders.insert_many(orders)
+    return users
+
+
+def request_factories(users: List[dict], config: BenchConfig, rng: random.Random) -> Dict[str, Callable]:
+    sorts = ["name", "price-low", "price-high", "rating"]
+    pages = max(1, config.products // 20)
+
+    def auth(user):
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    def products(client: httpx.AsyncClient):
+        params = {"limit": 20, "page": rng.randint(1, pages), "sort": rng.choice(sorts)}
+        if rng.random() < 0.3:
+            params["category"] = rng.choice(CATEGORIES)
+        return client.get("/api/products", params=params)
+
+    def cart(client: httpx.AsyncClient):
+        return client.get("/api/cart", headers=auth(rng.choice(users)))
+
+    def cart_add(client: httpx.AsyncClient):
+        product_id = f"bench-{rng.randrange(config.products)}"
+        return client.post("/api/cart/add", json={"productId": product_id, "quantity": 1}, headers=auth(rng.choice(users)))
+
+    def order(client: httpx.AsyncClient):
+        items = [{"id": f"bench-{rng.randrange(config.products)}", "quantity": rng.randint(1, 3)} for _ in range(2)]
+        body = {"items": items, "shippingAddress": SHIPPING_ADDRESS, "paymentMethod": "card", "paymentDetails": {}}
+        return client.post("/api/orders", json=body, headers=auth(rng.choice(users)))
+
+    return dict(zip(ENDPOINTS, [products, cart, cart_add, order]))
+
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> dict:
+    ordered = sorted(latencies)
+    cuts = statistics.quantiles(ordered, n=100) if len(ordered) > 1 else ordered * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+    }
+
+
+async def drive(client: httpx.AsyncClient,
+                make_request: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]],
+                total: int,
+                concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await make_request(client)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def memory_client():
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        return None
+    return AsyncMongoMockClient()
+
+
+async def run(config: BenchConfig, backend: str = "mongod", mongo_url: Optional[str] = None) -> dict:
+    rng = random.Random(config.seed)
+    db_name = f"benchmark_{uuid.uuid4().hex[:8]}"
+
+    if backend == "memory":
+        client = memory_client()
+        if client is None:
+            raise RuntimeError("--backend memory needs mongomock-motor installed")
+        services = ServiceContainer("", db_name, client=client)
+    else:
+        services = ServiceContainer(mongo_url or os.environ["MONGO_URL"], db_name)
+
+    app = server.app
+    app.state.services = services
+    try:
+        users = await seed(services, config, rng)
+        if backend != "memory":
+            # Indexes, warm-up, change stream and payment workers, as in production
+            await services.start()
+
+        transport = httpx.ASGITransport(app=app)
+        results = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for endpoint, make_request in request_factories(users, config, rng).items():
+                # Warm caches and code paths before measuring
+                await drive(client, make_request, config.concurrency, config.concurrency)
+                results[endpoint] = await drive(client, make_request, config.requests, config.concurrency)
+    finally:
+        if backend != "memory":
+            await services.client.drop_database(db_name)
+            await services.close()
+        catalog_cache.invalidate()
+
+    return {
+        "backend": backend,
+        "config": config.as_dict(),
+        "created_at": datetime.utcnow().isoformat(),
+        "endpoints": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Describe every endpoint whose p95 or throughput regressed past the threshold"""
+    regressions = []
+    for endpoint, before in baseline.get("endpoints", {}).items():
+        after = report["endpoints"].get(endpoint)
+        if after is None:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+        if after["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{endpoint}: throughput {before['rps']} -> {after['rps']} req/s")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{endpoint}: errors {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"backend: {report['backend']}, config: {report['config']}")
+    print(f"{'endpoint':22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for endpoint, stats in report["endpoints"].items():
+        print(
+            f"{endpoint:22} {stats['rps']:9.1f} {stats['p50_ms']:9.2f} "
+            f"{stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f} {stats['errors']:7d}"
+        )
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mongod", "memory"], default="mongod")
+    parser.add_argument("--mongo-url", help="defaults to MONGO_URL")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--orders-per-user", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="compare against this report")
+    parser.add_argument("--write-baseline", type=Path, help="store the report as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    config = BenchConfig(
+        products=args.products,
+        users=args.users,
+        orders_per_user=args.orders_per_user,
+        concurrency=args.concurrency,
+        requests=args.requests,
+    )
+    report = await run(config, backend=args.backend, mongo_url=args.mongo_url)
+    print_report(report)
+
+    for path in filter(None, [args.output, args.write_baseline]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,94 @@
+"""Fixtures running the app against an in-memory MongoDB (mongomock-motor).
+
+The services are built without ServiceContainer.start(), like the memory
+backend of the benchmark: mongomock has no change streams or capped
+collections, and requests do not need the background tasks.
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Admission control is tested on its own middleware, not on every request
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+from auth import create_user_access_token  # noqa: E402
+from container import ServiceContainer  # noqa: E402
+from models.product import _count_cache, catalog_cache  # noqa: E402
+from models.user import User  # noqa: E402
+
+CATEGORIES = ["Office Suite", "Antivirus", "Design"]
+
+SHIPPING_ADDRESS = {
+    "firstName": "Test", "lastName": "User", "email": "test@example.com", "phone": "9999999999",
+    "address": "1 Test Street", "city": "Chennai", "state": "TN", "pincode": "600001",
+}
+
+
+def product_record(i: int, price: float, **overrides) -> dict:
+    record = {
+        "id": f"p{i}",
+        "name": f"Product {i:03d}",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "price": price,
+        "description": "Genuine lifetime license",
+        "image": f"https://example.com/{i}.jpg",
+        "rating": round(3 + (i % 20) / 10, 1),
+    }
+    record.update(overrides)
+    return record
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def services():
+    services = ServiceContainer("", f"test_{uuid.uuid4().hex[:8]}", client=AsyncMongoMockClient())
+    server.app.state.services = services
+    catalog_cache.invalidate()
+    _count_cache.clear()
+    yield services
+    catalog_cache.invalidate()
+    _count_cache.clear()
+
+
+@pytest.fixture
+async def client(services):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def catalog(services):
+    """25 products priced 10.5, 11.0, ... with a few price ties"""
+    records = [product_record(i, 10.0 + (i % 10) / 2) for i in range(1, 26)]
+    await services.products.seed_categories([
+        {"id": str(i), "name": name, "description": name, "icon": "box"} for i, name in enumerate(CATEGORIES)
+    ])
+    await services.products.seed_products(records)
+    catalog_cache.invalidate()
+    return {record["id"]: record for record in records}
+
+
+async def user_headers(services: ServiceContainer) -> dict:
+    """Store a new user and return bearer headers for it"""
+    user = User(name="Test User", email=f"{uuid.uuid4().hex[:8]}@example.com", password="not-a-real-hash")
+    await services.db.users.insert_one(user.dict())
+    return {"Authorization": f"Bearer {create_user_access_token(user)}"}
+
+
+@pytest.fixture
+async def auth_headers(services):
+    return await user_headers(services)
@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+import auth
+from auth import create_access_token, decode_token, token_cache
+from ttl_cache import TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def jwt_decodes(monkeypatch):
+    calls = []
+    decode = auth.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    token_cache.clear()
+    yield calls
+    token_cache.clear()
+
+
+def test_verified_claims_are_cached(jwt_decodes):
+    token = create_access_token({"sub": "u1", "name": "Test", "role": "customer"})
+    assert decode_token(token)["sub"] == "u1"
+    assert decode_token(token)["role"] == "customer"
+    assert jwt_decodes == [token]
+
+
+def test_rejected_tokens_are_not_cached(jwt_decodes):
+    token = create_access_token({"sub": "u1"})
+    forged = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert decode_token(forged) is None
+    assert decode_token(forged) is None
+    assert decode_token(create_access_token({"name": "no subject"})) is None
+    assert len(jwt_decodes) == 3
+    assert len(token_cache) == 0
+
+
+def test_cached_claims_expire_with_the_token(jwt_decodes):
+    token = create_access_token({"sub": "u1"}, expires_delta=timedelta(seconds=1))
+    assert decode_token(token) is not None
+    expires_at, _ = token_cache._data[token]
+    assert expires_at == decode_token(token)["exp"]
+
+
+def test_ttl_cache_evicts_oldest_and_expired():
+    cache = TTLCache(maxsize=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+    cache.set("d", 4, expires_at=time.time() - 1)
+    assert cache.get("d") is None
+    assert "d" not in cache._data
+
+
+async def test_role_is_checked_from_claims(client, services, auth_headers):
+    assert (await client.get("/api/admin/profiles", headers=auth_headers)).status_code == 403
+
+    admin = create_access_token({"sub": "admin-1", "name": "Admin", "role": "admin"})
+    response = await client.get("/api/admin/profiles", headers={"Authorization": f"Bearer {admin}"})
+    assert response.status_code == 200
+
+
+async def test_invalid_token_is_unauthorized(client, services):
+    response = await client.get("/api/cart", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
@@ -0,0 +1,125 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def get_cart(client, headers) -> dict:
+    response = await client.get("/api/cart", headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_add_update_remove_keep_stored_totals(client, services, catalog, auth_headers):
+    for product_id, quantity in [("p1", 2), ("p2", 1), ("p1", 1)]:
+        response = await client.post("/api/cart/add", json={"productId": product_id, "quantity": quantity},
+                                     headers=auth_headers)
+        assert response.status_code == 200
+
+    cart = await get_cart(client, auth_headers)
+    assert [(item["id"], item["quantity"], item["subtotal"]) for item in cart["cartItems"]] == [
+        ("p1", 3, 31.5), ("p2", 1, 11.0)
+    ]
+    assert cart["total"] == 42.5
+    assert cart["itemCount"] == 4
+
+    response = await client.put("/api/cart/update/p2", json={"quantity": 4}, headers=auth_headers)
+    assert response.status_code == 200
+    cart = await get_cart(client, auth_headers)
+    assert (cart["total"], cart["itemCount"]) == (75.5, 7)
+
+    response = await client.delete("/api/cart/remove/p1", headers=auth_headers)
+    assert response.status_code == 200
+    cart = await get_cart(client, auth_headers)
+    assert [item["id"] for item in cart["cartItems"]] == ["p2"]
+    assert (cart["total"], cart["itemCount"]) == (44.0, 4)
+
+    stored = await services.db.carts.find_one({}, {"_id": 0})
+    assert (stored["total"], stored["item_count"]) == (44.0, 4)
+    assert stored["items"][0]["subtotal"] == 44.0
+
+
+async def test_missing_items_are_rejected(client, catalog, auth_headers):
+    response = await client.post("/api/cart/add", json={"productId": "nope", "quantity": 1}, headers=auth_headers)
+    assert response.status_code == 404
+    response = await client.delete("/api/cart/remove/p1", headers=auth_headers)
+    assert response.status_code == 404
+
+
+async def test_clear_empties_cart(client, catalog, auth_headers):
+    await client.post("/api/cart/add", json={"productId": "p1", "quantity": 1}, headers=auth_headers)
+    response = await client.delete("/api/cart/clear", headers=auth_headers)
+    assert response.status_code == 200
+    cart = await get_cart(client, auth_headers)
+    assert cart["cartItems"] == []
+    assert (cart["total"], cart["itemCount"]) == (0, 0)
+
+
+async def test_add_reprices_line_after_price_change(client, services, catalog, auth_headers):
+    await client.post("/api/cart/add", json={"productId": "p3", "quantity": 1}, headers=auth_headers)
+    await services.db.products.update_one({"id": "p3"}, {"$set": {"price": 20.0}})
+    services.carts.catalog.invalidate("p3")
+
+    await client.post("/api/cart/add", json={"productId": "p3", "quantity": 1}, headers=auth_headers)
+    cart = await get_cart(client, auth_headers)
+    assert [(item["quantity"], item["price"], item["subtotal"]) for item in cart["cartItems"]] == [(2, 20.0, 40.0)]
+    assert (cart["total"], cart["itemCount"]) == (40.0, 2)
+
+
+async def test_reconcile_reprices_and_drops_lines(client, services, catalog, auth_headers):
+    await client.post("/api/cart/add", json={"productId": "p3", "quantity": 2}, headers=auth_headers)
+    await client.post("/api/cart/add", json={"productId": "p4", "quantity": 1}, headers=auth_headers)
+    await services.db.products.update_one({"id": "p3"}, {"$set": {"price": 20.0, "in_stock": False}})
+    await services.db.products.delete_one({"id": "p4"})
+    services.carts.catalog.invalidate()
+
+    assert await services.carts.reconcile_products(["p3", "p4"]) == 2
+    assert await services.carts.reconcile_products(["p3"]) == 0
+    cart = await get_cart(client, auth_headers)
+    assert [(item["id"], item["subtotal"], item["inStock"]) for item in cart["cartItems"]] == [("p3", 40.0, False)]
+    assert (cart["total"], cart["itemCount"]) == (40.0, 2)
+
+
+async def test_legacy_cart_gets_totals(client, services, catalog, auth_headers):
+    cart = await get_cart(client, auth_headers)
+    user_id = (await services.db.users.find_one({}))["id"]
+    await services.db.carts.insert_one({"id": "legacy", "user_id": user_id, "items": [
+        {"product_id": "p1", "quantity": 2, "price": 1.0, "name": "Old name", "image": "old.jpg"}
+    ]})
+
+    cart = await get_cart(client, auth_headers)
+    assert (cart["total"], cart["itemCount"]) == (21.0, 2)
+    assert cart["cartItems"][0]["name"] == "Product 001"
+
+
+class RecordingCollection:
+    """Delegates to a collection and records the methods called on it"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self._collection, name)
+
+
+async def test_mutations_are_single_writes(client, services, catalog, auth_headers):
+    recording = services.carts.collection = RecordingCollection(services.carts.collection)
+    requests = [
+        ("post", "/api/cart/add", {"productId": "p1", "quantity": 1}),
+        ("post", "/api/cart/add", {"productId": "p1", "quantity": 1}),
+        ("put", "/api/cart/update/p1", {"quantity": 5}),
+        ("delete", "/api/cart/remove/p1", None),
+    ]
+    for method, path, body in requests:
+        recording.calls.clear()
+        response = await client.request(method, path, json=body, headers=auth_headers)
+        assert response.status_code == 200
+        assert recording.calls == ["update_one"], (path, recording.calls)
+
+
+async def test_only_absent_lines_are_not_found(client, catalog, auth_headers):
+    await client.post("/api/cart/add", json={"productId": "p1", "quantity": 1}, headers=auth_headers)
+    assert (await client.put("/api/cart/update/p2", json={"quantity": 2}, headers=auth_headers)).status_code == 404
+    assert (await client.put("/api/cart/update/p1", json={"quantity": 1}, headers=auth_headers)).status_code == 200
+    assert (await client.delete("/api/cart/remove/p2", headers=auth_headers)).status_code == 404
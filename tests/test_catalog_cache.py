@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure
+
+from catalog_cache import CatalogCache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def products():
+    return AsyncMongoMockClient().db.products
+
+
+def product(i: int, updated_at=None, **fields) -> dict:
+    doc = {"id": f"p{i}", **fields}
+    if updated_at is not None:
+        doc["updated_at"] = updated_at
+    return doc
+
+
+async def wait_until(predicate, timeout: float = 1.0):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+@pytest.fixture
+async def polling():
+    tasks = []
+
+    def start(cache: CatalogCache, collection):
+        tasks.append(asyncio.create_task(cache._poll(collection)))
+
+    yield start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def test_poll_applies_updates_and_deletes(products, polling):
+    now = datetime.utcnow()
+    await products.insert_many([product(i, now) for i in range(3)])
+    cache = CatalogCache(lambda doc: doc, poll_seconds=0.01)
+    changes = []
+    cache.add_listener(lambda product_id, doc: changes.append(product_id))
+    assert len(await cache.all_entries(products)) == 3
+    polling(cache, products)
+
+    await products.update_one({"id": "p0"}, {"$set": {"name": "Renamed", "updated_at": now + timedelta(seconds=1)}})
+    await wait_until(lambda: "p0" in changes)
+    assert cache.peek("p0").doc["name"] == "Renamed"
+
+    await products.delete_one({"id": "p1"})
+    await wait_until(lambda: None in changes)
+    assert sorted(entry.doc["id"] for entry in await cache.all_entries(products)) == ["p0", "p2"]
+
+
+async def test_poll_starts_without_high_water_mark(products, polling):
+    cache = CatalogCache(lambda doc: doc, poll_seconds=0.01)
+    assert await cache.all_entries(products) == []
+    polling(cache, products)
+
+    await products.insert_one(product(1))
+    await wait_until(lambda: cache.peek("p1") is not None)
+
+
+async def test_watch_reopens_after_stream_errors():
+    opened = []
+
+    class LostHistory:
+        def watch(self, **kwargs):
+            opened.append(kwargs)
+            raise OperationFailure("Resume point no longer in the oplog", code=286)
+
+    cache = CatalogCache(lambda doc: doc, poll_seconds=0.01)
+    task = asyncio.create_task(cache.watch(LostHistory()))
+    try:
+        await wait_until(lambda: len(opened) >= 3)
+        assert not task.done()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def test_refreshed_entry_invalidates_derived_views(products):
+    await products.insert_one(product(1, price=10.0))
+    cache = CatalogCache(lambda doc: doc, ttl_seconds=0)
+
+    def prices(entries):
+        return [entry.doc["price"] for entry in entries]
+
+    await cache.get(products, "p1")
+    assert cache.derived("prices", prices) == [10.0]
+
+    # A zero TTL makes every lookup refetch the product
+    await products.update_one({"id": "p1"}, {"$set": {"price": 12.0}})
+    await cache.get(products, "p1")
+    assert cache.derived("prices", prices) == [12.0]
+
+    await products.delete_one({"id": "p1"})
+    assert await cache.get(products, "p1") is None
+    assert cache.derived("prices", prices) == []
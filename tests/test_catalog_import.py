@@ -0,0 +1,106 @@
+import io
+import json
+
+import pytest
+
+import catalog_import
+from bulk_upsert import upsert_batch
+from catalog_import import import_records, iter_csv, iter_json_array, iter_ndjson
+from tests.conftest import CATEGORIES, product_record
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size: int = -1) -> str:
+        self.reads += 1
+        return super().read(size)
+
+
+def test_json_array_elements_span_read_chunks(monkeypatch):
+    monkeypatch.setattr(catalog_import, "READ_CHUNK_SIZE", 7)
+    records = [{"id": f"p{i}", "features": ["a", "b"], "name": "x" * i} for i in range(20)]
+    assert list(iter_json_array(io.StringIO(json.dumps(records, indent=2)))) == records
+    assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+
+
+@pytest.mark.parametrize("text", ['{"id": "p1"}', '[{"id": "p1"}, {"id": ', '[{"id": "p1"}'])
+def test_json_array_rejects_bad_documents(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text)))
+
+
+def test_malformed_element_stops_buffering(monkeypatch):
+    monkeypatch.setattr(catalog_import, "READ_CHUNK_SIZE", 16)
+    monkeypatch.setattr(catalog_import, "MAX_RECORD_SIZE", 64)
+    stream = CountingReader('[{"id": "p1"}, {"id": oops}, ' + ", ".join(['{"id": "p2"}'] * 1000) + "]")
+    records = iter_json_array(stream)
+    assert next(records) == {"id": "p1"}
+    with pytest.raises(ValueError, match="Invalid JSON array element"):
+        next(records)
+    assert stream.reads < 10
+
+
+def test_ndjson_reports_bad_line():
+    stream = io.StringIO('{"id": "p1"}\n\n{"id": "p2"}\n{"id":\n')
+    records = iter_ndjson(stream)
+    assert [next(records), next(records)] == [{"id": "p1"}, {"id": "p2"}]
+    with pytest.raises(ValueError, match="line 4"):
+        next(records)
+
+
+def test_csv_splits_lists_and_drops_empty_cells():
+    stream = io.StringIO("id,name,features,originalPrice\np1,Suite,Word| Excel |,\np2,Guard,,19.5\n")
+    assert list(iter_csv(stream)) == [
+        {"id": "p1", "name": "Suite", "features": ["Word", "Excel"]},
+        {"id": "p2", "name": "Guard", "originalPrice": "19.5"},
+    ]
+
+
+async def test_upsert_batch_only_rewrites_changed_documents(services):
+    collection = services.db.imported
+    first = await upsert_batch(collection, [{"id": "a", "v": 1}, {"id": "b", "v": 1}])
+    assert (first.inserted, first.changed, first.unchanged) == (2, 0, 0)
+    stamped = (await collection.find_one({"id": "a"}))["updated_at"]
+
+    second = await upsert_batch(collection, [{"id": "a", "v": 1}, {"id": "b", "v": 2}, {"id": "c", "v": 1}])
+    assert (second.inserted, second.changed, second.unchanged) == (1, 1, 1)
+    assert second.diffs == [("b", ["v"])]
+    assert (await collection.find_one({"id": "a"}))["updated_at"] == stamped
+    assert (await collection.find_one({"id": "b"}))["v"] == 2
+
+
+async def test_insert_only_dry_run_matches_real_run(services):
+    collection = services.db.imported
+    await collection.insert_one({"id": "a", "v": 1})
+    docs = [{"id": "a", "v": 2}, {"id": "b", "v": 1}, {"id": "b", "v": 1}]
+
+    dry = await upsert_batch(collection, docs, overwrite=False, dry_run=True)
+    assert await collection.count_documents({}) == 1
+    real = await upsert_batch(collection, docs, overwrite=False)
+    assert (dry.inserted, dry.unchanged) == (real.inserted, real.unchanged) == (1, 2)
+    assert (await collection.find_one({"id": "a"}))["v"] == 1
+
+
+async def test_import_products_in_batches(services):
+    await services.products.seed_categories([
+        {"id": str(i), "name": name, "description": name, "icon": "box"} for i, name in enumerate(CATEGORIES)
+    ])
+    records = [product_record(i, 10.0) for i in range(1, 8)]
+
+    dry = await import_records(services.db, "products", records, batch_size=3, dry_run=True)
+    assert (dry.batches, dry.records, dry.inserted) == (3, 7, 7)
+    assert await services.db.products.count_documents({}) == 0
+
+    report = await import_records(services.db, "products", records, batch_size=3)
+    assert (report.inserted, report.changed) == (7, 0)
+    counts = {doc["name"]: doc["count"] async for doc in services.db.categories.find({})}
+    assert counts == {"Office Suite": 2, "Antivirus": 3, "Design": 2}
+
+    records[0]["price"] = 12.0
+    report = await import_records(services.db, "products", records, batch_size=3)
+    assert (report.inserted, report.changed, report.unchanged) == (0, 1, 6)
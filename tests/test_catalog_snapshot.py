@@ -0,0 +1,48 @@
+import pytest
+
+from models.product import catalog_cache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_snapshot_etag_per_encoding(client, catalog):
+    gzipped = await client.get("/api/catalog/snapshot", headers={"Accept-Encoding": "gzip"})
+    plain = await client.get("/api/catalog/snapshot", headers={"Accept-Encoding": "identity"})
+    assert gzipped.status_code == plain.status_code == 200
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert gzipped.json() == plain.json()
+    assert len(plain.json()["products"]) == len(catalog)
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+
+    response = await client.get("/api/catalog/snapshot", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["etag"]
+    })
+    assert response.status_code == 304
+    # A cached identity body does not satisfy a gzip request, nor the reverse
+    response = await client.get("/api/catalog/snapshot", headers={
+        "Accept-Encoding": "identity", "If-None-Match": gzipped.headers["etag"]
+    })
+    assert response.status_code == 200
+
+
+async def test_snapshot_rebuilt_after_catalog_change(client, services, catalog):
+    first = await client.get("/api/catalog/snapshot", headers={"Accept-Encoding": "identity"})
+    again = await client.get("/api/catalog/snapshot", headers={"Accept-Encoding": "identity"})
+    assert again.headers["etag"] == first.headers["etag"]
+    assert services.catalog_snapshot.builds == 1
+
+    await services.products.seed_products([dict(catalog["p1"], id="p99", name="Product 099")])
+    catalog_cache.invalidate()
+    response = await client.get("/api/catalog/snapshot", headers={"Accept-Encoding": "identity"})
+    assert response.headers["etag"] != first.headers["etag"]
+    assert "p99" in {product["id"] for product in response.json()["products"]}
+
+
+async def test_snapshot_cached_for_large_catalog(client, services, catalog, monkeypatch):
+    # Too large for the in-memory catalog: the bundle is keyed on a cheap change key
+    monkeypatch.setattr(catalog_cache, "max_entries", 5)
+    first = await client.get("/api/catalog/snapshot")
+    await client.get("/api/catalog/snapshot")
+    assert services.catalog_snapshot.builds == 1
+    assert len(first.json()["products"]) == len(catalog)
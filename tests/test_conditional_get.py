@@ -0,0 +1,38 @@
+import pytest
+
+from models.product import catalog_cache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_listing_revalidates_with_etag(client, services, catalog):
+    response = await client.get("/api/products", params={"limit": 5})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = await client.get("/api/products", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # Another query string is another representation
+    response = await client.get("/api/products", params={"limit": 6}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    await services.products.seed_products([dict(catalog["p1"], id="p99", name="Product 099")])
+    catalog_cache.invalidate()
+    response = await client.get("/api/products", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+async def test_product_and_categories_revalidate(client, catalog):
+    response = await client.get("/api/products/p2")
+    assert response.status_code == 200
+    response = await client.get("/api/products/p2", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+    response = await client.get("/api/products/categories/all")
+    assert response.status_code == 200
+    assert sum(category["count"] for category in response.json()) == len(catalog)
+    response = await client.get("/api/products/categories/all", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
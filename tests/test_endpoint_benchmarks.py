@@ -0,0 +1,61 @@
+"""Latency regression gate for the main endpoints.
+
+Opt in with RUN_BENCHMARKS=1. BENCHMARK_BACKEND picks ``mongod`` (the
+default, using MONGO_URL) or ``memory``. Every run fails on request errors.
+Runs compare against BENCHMARK_BASELINE_DIR/<backend>.json (default
+tests/benchmarks) and fail when a p95 or throughput figure regresses by
+more than BENCHMARK_THRESHOLD. Baselines are machine-specific, so one is
+only written when BENCHMARK_WRITE_BASELINE=1.
+"""
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.skipif(os.getenv("RUN_BENCHMARKS") != "1", reason="set RUN_BENCHMARKS=1 to run benchmarks")
+
+BASELINE_DIR = Path(os.getenv("BENCHMARK_BASELINE_DIR", Path(__file__).parent / "benchmarks"))
+WRITE_BASELINE = os.getenv("BENCHMARK_WRITE_BASELINE") == "1"
+THRESHOLD = float(os.getenv("BENCHMARK_THRESHOLD", "0.25"))
+
+
+def mongod_available(url: str) -> bool:
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    client = MongoClient(url, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+def test_endpoints_within_baseline():
+    backend = os.getenv("BENCHMARK_BACKEND", "mongod")
+    if backend == "memory":
+        pytest.importorskip("mongomock_motor")
+    elif not mongod_available(os.getenv("MONGO_URL", "mongodb://localhost:27017")):
+        pytest.skip("no mongod reachable at MONGO_URL")
+
+    from tests.bench_endpoints import BenchConfig, compare, print_report, run
+
+    config = BenchConfig(products=300, users=20, orders_per_user=10, concurrency=10, requests=200)
+    report = asyncio.run(run(config, backend=backend))
+    print_report(report)
+    assert all(stats["errors"] == 0 for stats in report["endpoints"].values()), report["endpoints"]
+
+    baseline_path = BASELINE_DIR / f"{backend}.json"
+    if WRITE_BASELINE:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        return
+    if not baseline_path.exists():
+        pytest.skip(f"no baseline at {baseline_path}; set BENCHMARK_WRITE_BASELINE=1 to record one")
+
+    regressions = compare(report, json.loads(baseline_path.read_text()), THRESHOLD)
+    assert not regressions, "\n".join(regressions)
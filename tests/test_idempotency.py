@@ -0,0 +1,57 @@
+import pytest
+
+from idempotency import IdempotencyStore
+from tests.conftest import SHIPPING_ADDRESS
+
+pytestmark = pytest.mark.anyio
+
+
+def order_body(**overrides) -> dict:
+    body = {
+        "items": [{"id": "p1", "quantity": 2}],
+        "shippingAddress": SHIPPING_ADDRESS,
+        "paymentMethod": "card",
+        "paymentDetails": {},
+    }
+    body.update(overrides)
+    return body
+
+
+async def test_order_replayed_once(client, services, catalog, auth_headers):
+    headers = dict(auth_headers, **{"Idempotency-Key": "order-1"})
+    first = await client.post("/api/orders", json=order_body(), headers=headers)
+    second = await client.post("/api/orders", json=order_body(), headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+    assert second.headers["idempotent-replayed"] == "true"
+    assert second.json() == first.json()
+    assert await services.db.orders.count_documents({}) == 1
+
+
+async def test_key_reused_with_different_payload(client, catalog, auth_headers):
+    headers = dict(auth_headers, **{"Idempotency-Key": "order-2"})
+    assert (await client.post("/api/orders", json=order_body(), headers=headers)).status_code == 200
+    response = await client.post("/api/orders", json=order_body(paymentMethod="upi"), headers=headers)
+    assert response.status_code == 422
+
+
+async def test_cart_add_replayed_from_mongo(client, services, catalog, auth_headers):
+    headers = dict(auth_headers, **{"Idempotency-Key": "add-1"})
+    body = {"productId": "p1", "quantity": 1}
+    assert (await client.post("/api/cart/add", json=body, headers=headers)).status_code == 200
+
+    # A fresh store has nothing cached in process, as in another worker
+    services.idempotency = IdempotencyStore(services.db)
+    response = await client.post("/api/cart/add", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["idempotent-replayed"] == "true"
+
+    cart = (await client.get("/api/cart", headers=auth_headers)).json()
+    assert cart["itemCount"] == 1
+
+
+async def test_invalid_key_rejected(client, catalog, auth_headers):
+    headers = dict(auth_headers, **{"Idempotency-Key": "k" * 256})
+    response = await client.post("/api/cart/add", json={"productId": "p1"}, headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,30 @@
+import pytest
+
+from password_hasher import PasswordHasherBusy, password_hasher
+
+pytestmark = pytest.mark.anyio
+
+
+def samples(text: str) -> dict:
+    return {
+        name: float(value)
+        for name, value in (line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+    }
+
+
+async def test_password_hasher_is_exported(client, monkeypatch):
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+    before = samples((await client.get("/api/metrics")).text)
+
+    await password_hasher.hash("correct horse")
+    monkeypatch.setattr(password_hasher, "max_queue", 0)
+    with pytest.raises(PasswordHasherBusy):
+        await password_hasher.hash("battery staple")
+
+    response = await client.get("/api/metrics")
+    assert response.status_code == 200
+    assert "# TYPE password_hash_queue_depth gauge" in response.text
+    after = samples(response.text)
+    assert after["password_hash_completed_total"] - before["password_hash_completed_total"] == 1
+    assert after["password_hash_rejected_total"] - before["password_hash_rejected_total"] == 1
+    assert after["password_hash_in_flight"] == after["password_hash_queue_depth"] == 0
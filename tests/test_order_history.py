@@ -0,0 +1,90 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from cursors import encode_cursor
+from tests.conftest import SHIPPING_ADDRESS, user_headers
+
+pytestmark = pytest.mark.anyio
+
+# The summary view counts items with $size in the find projection (MongoDB 4.4+)
+needs_expression_projection = pytest.mark.skip(reason="mongomock cannot evaluate $size in a find projection")
+
+
+@pytest.fixture
+async def history(client, services, catalog, auth_headers):
+    """Seven orders, newest first, with two pairs sharing a created_at"""
+    ids = []
+    for i in range(1, 8):
+        body = {"items": [{"id": f"p{i}", "quantity": i}], "shippingAddress": SHIPPING_ADDRESS,
+                "paymentMethod": "card", "paymentDetails": {}}
+        response = await client.post("/api/orders", json=body, headers=auth_headers)
+        assert response.status_code == 200
+        ids.append(response.json()["id"])
+
+    start = datetime(2026, 1, 1)
+    stamps = [start, start + timedelta(minutes=1), start + timedelta(minutes=1), start + timedelta(minutes=2),
+              start + timedelta(minutes=3), start + timedelta(minutes=3), start + timedelta(minutes=4)]
+    for order_id, created_at in zip(ids, stamps):
+        await services.db.orders.update_one({"id": order_id}, {"$set": {"created_at": created_at}})
+    return [order_id for _, order_id in sorted(zip(stamps, ids), reverse=True)]
+
+
+async def test_unpaginated_history_is_newest_first(client, auth_headers, history):
+    body = (await client.get("/api/orders", headers=auth_headers)).json()
+    assert [order["id"] for order in body["orders"]] == history
+    assert (body["total"], body["next_cursor"]) == (7, None)
+
+
+@pytest.mark.parametrize("view", ["full", pytest.param("summary", marks=needs_expression_projection)])
+async def test_cursor_pages_cover_history_once(client, auth_headers, history, view):
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 3, "view": view}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/api/orders", params=params, headers=auth_headers)
+        assert response.status_code == 200
+        body = response.json()
+        ids += [order["id"] for order in body["orders"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == history
+    assert pages == 3
+
+
+@needs_expression_projection
+async def test_summary_view_leaves_out_lines(client, auth_headers, history):
+    body = (await client.get("/api/orders", params={"limit": 1, "view": "summary"}, headers=auth_headers)).json()
+    (order,) = body["orders"]
+    assert order["itemCount"] == 1
+    assert "items" not in order and "shippingAddress" not in order
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor({"t": "yesterday", "id": "x"}), encode_cursor({"id": "x"})])
+async def test_malformed_cursor_is_bad_request(client, auth_headers, history, cursor):
+    response = await client.get("/api/orders", params={"cursor": cursor}, headers=auth_headers)
+    assert response.status_code == 400
+
+
+async def test_stream_yields_ndjson_history(client, services, auth_headers, history):
+    await client.post("/api/orders", headers=await user_headers(services), json={
+        "items": [{"id": "p1", "quantity": 1}], "shippingAddress": SHIPPING_ADDRESS,
+        "paymentMethod": "card", "paymentDetails": {},
+    })
+
+    response = await client.get("/api/orders/stream", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [order["id"] for order in lines] == history
+    assert lines[0]["items"][0]["product_id"] == "p7"
+
+
+@needs_expression_projection
+async def test_stream_summary_view(client, auth_headers, history):
+    response = await client.get("/api/orders/stream", params={"view": "summary"}, headers=auth_headers)
+    assert [json.loads(line)["itemCount"] for line in response.text.splitlines()] == [1] * 7
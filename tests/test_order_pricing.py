@@ -0,0 +1,65 @@
+import pytest
+
+from tests.conftest import SHIPPING_ADDRESS
+
+pytestmark = pytest.mark.anyio
+
+
+def order_body(*items) -> dict:
+    return {"items": list(items), "shippingAddress": SHIPPING_ADDRESS, "paymentMethod": "card", "paymentDetails": {}}
+
+
+async def test_prices_come_from_the_catalog(client, services, catalog, auth_headers):
+    body = order_body(
+        {"id": "p1", "quantity": 2, "price": 0.01, "name": "Free stuff", "image": "evil.jpg"},
+        {"id": "p2", "quantity": 1, "price": 0.01},
+        {"id": "p1", "quantity": 1, "price": 0.01},
+    )
+    response = await client.post("/api/orders", json=body, headers=auth_headers)
+    assert response.status_code == 200
+    order = response.json()
+    assert [(item["product_id"], item["quantity"], item["price"], item["name"]) for item in order["items"]] == [
+        ("p1", 3, 10.5, "Product 001"), ("p2", 1, 11.0, "Product 002")
+    ]
+    assert order["total"] == 42.5
+    assert (await services.db.orders.find_one({"id": order["id"]}))["total"] == 42.5
+
+
+@pytest.mark.parametrize("items", [
+    [],
+    [{"id": "p1", "quantity": 0}],
+    [{"id": "p1", "quantity": 1.5}],
+    [{"id": "p1", "quantity": True}],
+    [{"quantity": 1}],
+    [{"id": "p1", "quantity": 1}, {"id": "missing", "quantity": 1}],
+])
+async def test_invalid_orders_store_nothing(client, services, catalog, auth_headers, items):
+    response = await client.post("/api/orders", json=order_body(*items), headers=auth_headers)
+    assert response.status_code == 400
+    assert await services.db.orders.count_documents({}) == 0
+    assert await services.db.payment_jobs.count_documents({}) == 0
+
+
+async def test_out_of_stock_product_is_rejected(client, services, catalog, auth_headers):
+    await services.db.products.update_one({"id": "p2"}, {"$set": {"in_stock": False}})
+    services.orders.catalog.invalidate("p2")
+    response = await client.post("/api/orders", json=order_body({"id": "p2", "quantity": 1}), headers=auth_headers)
+    assert response.status_code == 400
+    assert "out of stock" in response.json()["detail"]
+
+
+async def test_inline_payment_stores_final_order_once(client, services, catalog, auth_headers, monkeypatch):
+    services.orders.payments = None
+    inserts = []
+    insert_one = services.orders.collection.insert_one
+
+    async def recording_insert(doc, *args, **kwargs):
+        inserts.append(dict(doc))
+        return await insert_one(doc, *args, **kwargs)
+
+    monkeypatch.setattr(services.orders.collection, "insert_one", recording_insert)
+    response = await client.post("/api/orders", json=order_body({"id": "p1", "quantity": 1}), headers=auth_headers)
+    assert response.status_code == 200
+    assert [(doc["status"], doc["payment_status"]) for doc in inserts] == [("completed", "completed")]
+    stored = await services.db.orders.find_one({"id": response.json()["id"]})
+    assert stored["payment_status"] == "completed"
@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from payment_queue import PAYMENT_ORPHAN_SECONDS, FakePaymentGateway, PaymentDeclined, PaymentQueue
+from tests.conftest import SHIPPING_ADDRESS
+
+pytestmark = pytest.mark.anyio
+
+
+def order_body(*items) -> dict:
+    return {
+        "items": [{"id": product_id, "quantity": quantity} for product_id, quantity in items],
+        "shippingAddress": SHIPPING_ADDRESS,
+        "paymentMethod": "card",
+        "paymentDetails": {},
+    }
+
+
+class FlakyGateway(FakePaymentGateway):
+    """Raises the queued errors one per charge, then charges normally"""
+
+    def __init__(self, *errors):
+        super().__init__(latency_ms=0)
+        self.errors = list(errors)
+
+    async def charge(self, order: dict) -> str:
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super().charge(order)
+
+
+@pytest.fixture
+def queue(services):
+    queue = PaymentQueue(services.db, gateway=FakePaymentGateway(latency_ms=0), workers=0,
+                         max_attempts=2, retry_base_seconds=0)
+    services.orders.payments = queue
+    return queue
+
+
+async def place_order(client, headers, *items) -> dict:
+    response = await client.post("/api/orders", json=order_body(*items), headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def cart_lines(client, headers) -> list:
+    cart = (await client.get("/api/cart", headers=headers)).json()
+    return [(item["id"], item["quantity"]) for item in cart["cartItems"]]
+
+
+async def fill_cart(client, headers, *items):
+    for product_id, quantity in items:
+        await client.post("/api/cart/add", json={"productId": product_id, "quantity": quantity}, headers=headers)
+
+
+async def test_settled_order_leaves_later_lines_in_cart(client, services, catalog, auth_headers, queue):
+    await fill_cart(client, auth_headers, ("p1", 2))
+    order = await place_order(client, auth_headers, ("p1", 2))
+    assert order["paymentStatus"] == "pending"
+    await fill_cart(client, auth_headers, ("p2", 1))
+
+    await queue.process(await queue.lease("w"))
+    job = await queue.get_job(order["id"])
+    stored = await services.db.orders.find_one({"id": order["id"]})
+    assert (job["status"], job["attempts"], stored["payment_status"]) == ("done", 1, "completed")
+    assert await cart_lines(client, auth_headers) == [("p2", 1)]
+
+
+async def test_inline_payment_trims_cart_the_same_way(client, services, catalog, auth_headers):
+    services.orders.payments = None
+    await fill_cart(client, auth_headers, ("p1", 2), ("p2", 1))
+    order = await place_order(client, auth_headers, ("p1", 2))
+    assert order["paymentStatus"] == "completed"
+    assert await cart_lines(client, auth_headers) == [("p2", 1)]
+
+
+async def test_gateway_error_is_retried(client, services, catalog, auth_headers, queue):
+    queue.gateway = FlakyGateway(asyncio.TimeoutError())
+    order = await place_order(client, auth_headers, ("p1", 1))
+
+    await queue.process(await queue.lease("w"))
+    job = await queue.get_job(order["id"])
+    assert (job["status"], job["last_error"]) == ("queued", "Gateway timeout")
+
+    await queue.process(await queue.lease("w"))
+    assert (await queue.get_job(order["id"]))["status"] == "done"
+    assert (await services.db.orders.find_one({"id": order["id"]}))["payment_status"] == "completed"
+
+
+async def test_decline_fails_order_without_retry(client, services, catalog, auth_headers, queue):
+    queue.gateway = FlakyGateway(PaymentDeclined("card payment declined"))
+    await fill_cart(client, auth_headers, ("p1", 1))
+    order = await place_order(client, auth_headers, ("p1", 1))
+
+    await queue.process(await queue.lease("w"))
+    assert (await queue.get_job(order["id"]))["status"] == "done"
+    assert (await services.db.orders.find_one({"id": order["id"]}))["payment_status"] == "failed"
+    assert await cart_lines(client, auth_headers) == [("p1", 1)]
+
+
+async def test_poison_job_is_dead_lettered(client, services, catalog, auth_headers, queue):
+    order = await place_order(client, auth_headers, ("p1", 1))
+
+    async def explode(job):
+        raise RuntimeError("boom")
+
+    queue.process = explode
+    queue.workers = 1
+    queue.start()
+    try:
+        for _ in range(100):
+            if (await queue.get_job(order["id"]))["status"] == "dead":
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await queue.stop()
+
+    job = await queue.get_job(order["id"])
+    assert (job["status"], job["attempts"], job["last_error"]) == ("dead", 2, "boom")
+    assert (await services.db.orders.find_one({"id": order["id"]}))["payment_status"] == "failed"
+
+
+async def test_expired_last_lease_is_dead_lettered(client, services, catalog, auth_headers, queue):
+    order = await place_order(client, auth_headers, ("p1", 1))
+    await services.db.payment_jobs.update_one({"_id": order["id"]}, {"$set": {
+        "status": "leased", "attempts": 2, "lease_id": "crashed", "run_at": datetime.utcnow() - timedelta(seconds=1),
+    }})
+
+    assert await queue.lease("w") is None
+    assert await queue.dead_letter_exhausted() == 1
+    assert (await queue.get_job(order["id"]))["status"] == "dead"
+    assert (await services.db.orders.find_one({"id": order["id"]}))["payment_status"] == "failed"
+
+
+async def test_orphaned_orders_are_enqueued(client, services, catalog, auth_headers, queue):
+    orders = [await place_order(client, auth_headers, ("p1", 1)) for _ in range(3)]
+    await services.db.orders.update_many({}, {"$set": {
+        "created_at": datetime.utcnow() - timedelta(seconds=PAYMENT_ORPHAN_SECONDS + 1)
+    }})
+    await services.db.payment_jobs.delete_one({"_id": orders[1]["id"]})
+
+    assert await queue.recover_orphans() == 1
+    assert await queue.recover_orphans() == 0
+    assert (await queue.get_job(orders[1]["id"]))["status"] == "queued"
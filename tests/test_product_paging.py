@@ -0,0 +1,61 @@
+import pytest
+
+from cursors import encode_cursor
+from models.product import catalog_cache
+
+pytestmark = pytest.mark.anyio
+
+SORTED = {
+    "name": lambda p: (p["name"], p["id"]),
+    "price-low": lambda p: (p["price"], p["id"]),
+    "price-high": lambda p: (-p["price"], p["id"]),
+    "rating": lambda p: (-p["rating"], p["id"]),
+}
+
+
+async def page_through(client, sort: str, limit: int = 7, **params) -> list:
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, sort=sort, limit=limit, paginate="cursor")
+        if cursor:
+            query["cursor"] = cursor
+        response = await client.get("/api/products", params=query)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        ids += [product["id"] for product in body["products"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids
+        assert pages < 10
+
+
+@pytest.mark.parametrize("sort", sorted(SORTED))
+async def test_cursor_pages_cover_catalog_in_order(client, catalog, sort):
+    expected = [p["id"] for p in sorted(catalog.values(), key=SORTED[sort])]
+    assert await page_through(client, sort) == expected
+
+
+@pytest.mark.parametrize("sort", ["price-low", "rating"])
+async def test_cursor_pages_from_mongo(client, catalog, sort, monkeypatch):
+    # A catalog over max_entries is paged by keyset queries instead of from memory
+    monkeypatch.setattr(catalog_cache, "max_entries", 5)
+    expected = [p["id"] for p in sorted(catalog.values(), key=SORTED[sort])]
+    assert await page_through(client, sort) == expected
+
+
+async def test_cursor_pages_filtered_by_category(client, catalog):
+    expected = [p["id"] for p in sorted(catalog.values(), key=SORTED["name"]) if p["category"] == "Design"]
+    assert await page_through(client, "name", limit=3, category="Design") == expected
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    encode_cursor({"s": "price-low", "v": "cheap", "id": "p1"}),
+    encode_cursor({"s": "price-low", "v": 10.5}),
+    encode_cursor({"s": "name", "v": "Product 001"}),
+    encode_cursor({"s": "rating"}),
+])
+async def test_malformed_cursor_is_bad_request(client, catalog, cursor):
+    response = await client.get("/api/products", params={"sort": "price-low", "cursor": cursor})
+    assert response.status_code == 400
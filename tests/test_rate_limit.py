@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from rate_limit import Limit, RateLimiter, RateLimitMiddleware
+from tests.conftest import user_headers
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def limited_client(services):
+    # Slow refill, so a spent token does not come back during the test
+    limiter = RateLimiter(rules={("POST", "/api/cart/add"): [Limit("ip", 0.6, 3), Limit("user", 0.6, 1)]})
+    app = RateLimitMiddleware(server.app, limiter=limiter, enabled=True)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+async def add(client, headers) -> httpx.Response:
+    return await client.post("/api/cart/add", json={"productId": "p1"}, headers=headers)
+
+
+async def test_rejects_over_limit(limited_client, catalog, auth_headers):
+    assert (await add(limited_client, auth_headers)).status_code == 200
+    response = await add(limited_client, auth_headers)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    # Unguarded routes are never limited
+    assert (await limited_client.get("/api/cart", headers=auth_headers)).status_code == 200
+
+
+async def test_rejection_does_not_spend_other_limits(limited_client, services, catalog, auth_headers):
+    assert (await add(limited_client, auth_headers)).status_code == 200
+    for _ in range(5):
+        assert (await add(limited_client, auth_headers)).status_code == 429
+
+    # The rejected requests gave their IP tokens back, so two more users fit
+    for _ in range(2):
+        assert (await add(limited_client, await user_headers(services))).status_code == 200
+    assert (await add(limited_client, await user_headers(services))).status_code == 429
+
+
+async def test_inflight_cap_counts_requests_being_checked(services, catalog, auth_headers):
+    limiter = RateLimiter(rules={("POST", "/api/cart/add"): [Limit("ip", 100, 100)]}, max_inflight=1)
+    checking, release = asyncio.Event(), asyncio.Event()
+    check = limiter.check
+
+    async def slow_check(scope, limits):
+        checking.set()
+        await release.wait()
+        return await check(scope, limits)
+
+    limiter.check = slow_check
+    app = RateLimitMiddleware(server.app, limiter=limiter, enabled=True)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = asyncio.create_task(add(client, auth_headers))
+        await checking.wait()
+        assert (await asyncio.wait_for(add(client, auth_headers), 1)).status_code == 503
+        release.set()
+        assert (await first).status_code == 200
+
+    assert (limiter.inflight, limiter.shed) == (0, 1)
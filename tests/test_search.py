@@ -0,0 +1,69 @@
+import pytest
+
+from search_index import SearchIndex, stem
+from tests.conftest import product_record
+
+pytestmark = pytest.mark.anyio
+
+PRODUCTS = [
+    product_record(1, 49.0, name="Office Home Edition", description="Word processing and spreadsheets",
+                   features=["Word", "Excel"]),
+    product_record(2, 29.0, name="Antivirus Plus", description="Real-time protection for offices",
+                   features=["Firewall"]),
+    product_record(3, 99.0, name="Photo Designer", description="Raster editing for designers",
+                   features=["Layers", "Office file export"]),
+]
+
+
+def test_stemmer_folds_plurals_and_verb_forms():
+    assert stem("offices") == stem("office")
+    assert stem("editing") == stem("edited") == "edit"
+    assert stem("policies") == "policy"
+    assert stem("2024") == "2024"
+
+
+def test_name_matches_rank_above_description_and_features():
+    index = SearchIndex(PRODUCTS)
+    assert [product_id for product_id, _ in index.search("office")] == ["p1", "p2", "p3"]
+
+
+def test_every_token_must_match():
+    index = SearchIndex(PRODUCTS)
+    assert [product_id for product_id, _ in index.search("office word")] == ["p1"]
+    assert index.search("office nothing") == []
+    assert index.search("  ") == []
+
+
+def test_prefix_matches_score_below_exact_ones():
+    index = SearchIndex(PRODUCTS)
+    assert [product_id for product_id, _ in index.search("desig")] == ["p3"]
+    (_, exact), = index.search("designer")
+    (_, prefix), = index.search("desig")
+    assert prefix < exact
+
+
+@pytest.fixture
+async def searchable(services):
+    await services.products.seed_products(PRODUCTS)
+
+
+async def test_search_listing_defaults_to_relevance(client, searchable):
+    response = await client.get("/api/products", params={"search": "Offices"})
+    assert response.status_code == 200
+    assert [product["id"] for product in response.json()["products"]] == ["p1", "p2", "p3"]
+
+    response = await client.get("/api/products", params={"search": "office", "sort": "price-low"})
+    assert [product["id"] for product in response.json()["products"]] == ["p2", "p1", "p3"]
+
+
+async def test_search_listing_pages_by_cursor(client, searchable):
+    ids, cursor = [], None
+    for _ in range(3):
+        params = {"search": "office", "limit": 1, "paginate": "cursor"}
+        if cursor:
+            params["cursor"] = cursor
+        body = (await client.get("/api/products", params=params)).json()
+        ids += [product["id"] for product in body["products"]]
+        cursor = body["next_cursor"]
+    assert ids == ["p1", "p2", "p3"]
+    assert cursor is None